@@ -4,31 +4,141 @@ Flask REST API Example for Ooredoo Recharge
 Shows how to integrate recharge_api.py into a web service
 """
 
-from flask import Flask, request, jsonify
-from recharge_api import api_recharge
-import os
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from event_bus import EventBus, format_sse
+import metrics
+from job_scheduler import SchedulerClosed, SchedulerFull
+from log_store import LogStore
+from order_store import OrderStore
+from readiness import ReadinessProbe
+from shutdown import GracefulShutdown
+from recharge_jobs import (MAX_BATCH_ITEMS, TERMINAL_STATUSES, IdempotencyConflict, JobStore, RechargeJobs, job_view,
+                           parse_include)
+import response_encoding
 from datetime import datetime
+import os
+import threading
+
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() through response_encoding.dumps() (orjson when installed)"""
+    
+    def dumps(self, obj, **kwargs):
+        return response_encoding.dumps(obj).decode()
+
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+# Background jobs on a bounded worker pool
+# RECHARGE_WORKERS / RECHARGE_QUEUE override the CPU/memory-based sizing
+# Every job is persisted to SQLite (ORDER_DB, default orders.db)
+ORDERS = OrderStore()
+
+# Live stage events per job (SSE / long-poll)
+BUS = EventBus()
+
+# Each SSE stream holds a WSGI thread until its job ends, so only this many
+# are open at once (503 beyond that; asgi_server.py streams without a cap)
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '32'))
+SSE_SLOTS = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# Job event logs: day-sharded, compressed, indexed (LOG_DIR, default api_logs)
+LOGS = LogStore()
 
-# Create logs directory
-os.makedirs('api_logs', exist_ok=True)
+JOBS = RechargeJobs(store=JobStore(orders=ORDERS, bus=BUS), logs=LOGS)
+
+# Liveness / capacity checks for the load balancer (READY_* thresholds)
+PROBE = ReadinessProbe(JOBS)
+
+# SIGTERM / SIGINT: drain jobs (SHUTDOWN_DEADLINE), checkpoint unfinished
+# payment monitors, quit browsers, then close the stores
+SHUTDOWN = GracefulShutdown(JOBS, closers=(LOGS.close, ORDERS.close))
+
+# Load gauges for /metrics, read from the scheduler/bus only when scraped
+metrics.register_gauge('recharge_queue_depth', 'Jobs waiting for a worker',
+                       lambda: JOBS.scheduler.snapshot()['queued'])
+metrics.register_gauge('recharge_queue_capacity', 'Maximum queued jobs before 429',
+                       lambda: JOBS.scheduler.max_queue)
+metrics.register_gauge('recharge_workers', 'Worker threads (max concurrent browsers for jobs)',
+                       lambda: JOBS.scheduler.workers)
+metrics.register_gauge('recharge_workers_busy', 'Workers currently running a job',
+                       lambda: JOBS.scheduler.snapshot()['running'])
+metrics.register_gauge('recharge_jobs', 'In-memory jobs by status',
+                       lambda: [({'status': status}, count) for status, count in JOBS.store.counts().items()])
+metrics.register_gauge('recharge_event_waiters', 'Clients parked on job event streams',
+                       lambda: BUS.stats()['waiters'])
+metrics.register_gauge('recharge_ready', '1 if the node passes its readiness checks',
+                       lambda: int(PROBE.ready()[0]))
+
+
+@app.after_request
+def compress_response(response):
+    """gzip / br for JSON and text bodies the client accepts (streams are left alone)"""
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    
+    body, encoding = response_encoding.encode(
+        response.get_data(), response.content_type, request.headers.get('Accept-Encoding')
+    )
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """
+    Overview for humans (always 200; probes use /health/live and /health/ready)
+    
+    status is "healthy" with spare capacity, "saturated" when a readiness
+    check fails (see "failing").
+    """
+    ready, report = PROBE.ready()
     return jsonify({
-        'status': 'healthy',
+        'status': 'healthy' if ready else 'saturated',
+        'failing': report['failing'],
         'service': 'Ooredoo Recharge API',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'jobs': JOBS.store.counts(),
+        'scheduler': JOBS.scheduler.snapshot()
     })
 
 
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: 200 while workers and store writers run, else 503 (restart)"""
+    ok, body = PROBE.live()
+    return jsonify(body), 200 if ok else 503
+
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: 200 with spare capacity, 503 when a threshold is crossed
+    
+    Checks: free worker slots, queue depth, memory headroom, recent portal
+    latency, Chrome launch failures, CAPTCHA/OCR service (if configured) and
+    whether the scheduler still accepts work; each with value and threshold.
+    """
+    ok, body = PROBE.ready()
+    return jsonify(body), 200 if ok else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (stage latency histograms, outcomes, load gauges)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/v1/recharge', methods=['POST'])
 def create_recharge():
     """
-    Create and monitor recharge
+    Queue a recharge (creation + payment monitoring run in the background)
     
     POST /api/v1/recharge
     Content-Type: application/json
@@ -39,132 +149,510 @@ def create_recharge():
         "password": "mypassword",
         "beneficiary": "27865121",
         "amount": 20,
-        "timeout": 300  // optional, default 300s
+        "timeout": 300,  // optional, default 300s
+        "callback_url": "https://example.com/hook"  // optional
     }
     
-    Response:
+    Response (202):
     {
         "success": true,
-        "message": "Recharge completed successfully",
-        "data": {
-            "order_id": "12345",
-            "transaction_id": "67890",
-            "amount": 20,
-            "beneficiary": "27865121",
-            "elapsed_seconds": 45.2
-        },
+        "message": "Recharge queued",
+        "job_id": "3f9c0a7d12ab44e1",
+        "status": "queued",
+        "payment_url": null,
+        "status_url": "/api/v1/status/3f9c0a7d12ab44e1",
         "timestamp": "2025-02-13T16:30:00"
     }
+    
+    The payment URL appears on the job (status endpoint / callback) as
+    soon as creation finishes; the final outcome replaces it later.
+    
+    429 (queue full) / 503 (shutting down) carry a Retry-After header.
+    
+    Retries are deduplicated: send an Idempotency-Key header, or the same
+    phone/beneficiary/amount within IDEMPOTENCY_WINDOW seconds (default 120)
+    is treated as a retry. A retry of a running job gets that job (202), a
+    retry of a finished one its stored result (200), both marked
+    "idempotent_replay": true. Reusing a key for another request -> 422.
     """
     
-    # Validate request
-    if not request.json:
+    params, error = parse_recharge_request(request.get_json(silent=True))
+    if error:
         return jsonify({
             'success': False,
-            'error': 'Invalid request: JSON body required'
+            'error': error
         }), 400
     
-    # Extract parameters
-    phone = request.json.get('phone')
-    password = request.json.get('password')
-    beneficiary = request.json.get('beneficiary')
-    amount = request.json.get('amount')
-    timeout = request.json.get('timeout', 300)
+    # Queue the job; creation and monitoring run in the background
+    try:
+        job, created = JOBS.submit(idempotency_key=request.headers.get('Idempotency-Key'), **params)
+    except SchedulerFull as e:
+        return busy_response(str(e), e.retry_after, 429)
+    except SchedulerClosed as e:
+        return busy_response(str(e), e.retry_after, 503)
+    except IdempotencyConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 422
     
-    # Validate required fields
-    missing = []
-    if not phone: missing.append('phone')
-    if not password: missing.append('password')
-    if not beneficiary: missing.append('beneficiary')
-    if not amount: missing.append('amount')
+    if not created:
+        # Retry of a known request: no new browser work, return the existing job
+        done = job['status'] in TERMINAL_STATUSES
+        response = jsonify(dict(
+            job_view(job),
+            success=True,
+            idempotent_replay=True,
+            message='Recharge already finished' if done else 'Attached to in-flight recharge'
+        ))
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response, 200 if done else 202
+    
+    return jsonify({
+        'success': True,
+        'message': 'Recharge queued',
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'payment_url': job['payment_url'],
+        'status_url': f"/api/v1/status/{job['job_id']}",
+        'timestamp': job['created_at']
+    }), 202
+
+
+def parse_recharge_request(body):
+    """
+    Validate a POST /api/v1/recharge body (shared with the ASGI server)
     
+    Returns:
+        tuple: (RechargeJobs.submit() keyword arguments, None) or (None, error message)
+    """
+    if not body or not isinstance(body, dict):
+        return None, 'Invalid request: JSON body required'
+    
+    # Validate required fields
+    missing = [field for field in ('phone', 'password', 'beneficiary', 'amount') if not body.get(field)]
     if missing:
-        return jsonify({
-            'success': False,
-            'error': f'Missing required fields: {", ".join(missing)}'
-        }), 400
+        return None, f'Missing required fields: {", ".join(missing)}'
     
     # Validate amount
     try:
-        amount = int(amount)
+        amount = int(body['amount'])
         if amount <= 0:
             raise ValueError()
     except (ValueError, TypeError):
+        return None, 'Invalid amount: must be positive integer'
+    
+    return {
+        'phone': body['phone'],
+        'password': body['password'],
+        'beneficiary': body['beneficiary'],
+        'amount': amount,
+        'timeout_seconds': body.get('timeout', 300),
+        'callback_url': body.get('callback_url')
+    }, None
+
+
+def parse_batch_request(body):
+    """
+    Validate a POST /api/v1/recharges/batch body (shared with the ASGI server)
+    
+    Items inherit the top-level phone/password unless they carry their own.
+    
+    Returns:
+        tuple: (RechargeJobs.submit_batch() keyword arguments, None) or (None, error message)
+    """
+    if not body or not isinstance(body, dict) or not isinstance(body.get('items'), list) or not body['items']:
+        return None, 'Invalid request: JSON body with a non-empty "items" list required'
+    if len(body['items']) > MAX_BATCH_ITEMS:
+        return None, f'Too many items: {len(body["items"])} (max {MAX_BATCH_ITEMS})'
+    
+    items = []
+    for index, raw in enumerate(body['items']):
+        if not isinstance(raw, dict):
+            return None, f'Item {index}: object required'
+        item = {
+            'phone': raw.get('phone') or body.get('phone'),
+            'password': raw.get('password') or body.get('password'),
+            'beneficiary': raw.get('beneficiary'),
+            'amount': raw.get('amount')
+        }
+        missing = [field for field, value in item.items() if not value]
+        if missing:
+            return None, f'Item {index}: missing {", ".join(missing)}'
+        try:
+            item['amount'] = int(item['amount'])
+            if item['amount'] <= 0:
+                raise ValueError()
+        except (ValueError, TypeError):
+            return None, f'Item {index}: invalid amount (must be positive integer)'
+        items.append(item)
+    
+    return {
+        'items': items,
+        'timeout_seconds': body.get('timeout', 300),
+        'callback_url': body.get('callback_url'),
+        'monitor': bool(body.get('monitor', False))
+    }, None
+
+
+def parse_checkout_request(body):
+    """
+    Validate a POST /api/v1/recharges/checkout body (shared with the ASGI server)
+    
+    Items are grouped by amount into the form's recharge lines, in order of
+    first appearance; a beneficiary may appear only once per checkout.
+    
+    Returns:
+        tuple: (RechargeJobs.submit_checkout() keyword arguments, None) or (None, error message)
+    """
+    if not body or not isinstance(body, dict) or not isinstance(body.get('items'), list) or not body['items']:
+        return None, 'Invalid request: JSON body with a non-empty "items" list required'
+    missing = [field for field in ('phone', 'password') if not body.get(field)]
+    if missing:
+        return None, f'Missing required fields: {", ".join(missing)}'
+    if len(body['items']) > MAX_BATCH_ITEMS:
+        return None, f'Too many items: {len(body["items"])} (max {MAX_BATCH_ITEMS})'
+    
+    lines = {}
+    seen = set()
+    for index, raw in enumerate(body['items']):
+        if not isinstance(raw, dict) or not raw.get('beneficiary'):
+            return None, f'Item {index}: beneficiary required'
+        beneficiary = str(raw['beneficiary'])
+        if beneficiary in seen:
+            return None, f'Item {index}: beneficiary {beneficiary} appears twice (one payment per number)'
+        seen.add(beneficiary)
+        try:
+            amount = int(raw.get('amount'))
+            if amount <= 0:
+                raise ValueError()
+        except (ValueError, TypeError):
+            return None, f'Item {index}: invalid amount (must be positive integer)'
+        lines.setdefault(amount, []).append(beneficiary)
+    
+    return {
+        'phone': body['phone'],
+        'password': body['password'],
+        'lines': [{'amount': amount, 'beneficiaries': numbers} for amount, numbers in lines.items()],
+        'timeout_seconds': body.get('timeout', 300),
+        'callback_url': body.get('callback_url')
+    }, None
+
+
+def busy_response(message, retry_after, status_code):
+    """Fast rejection when no worker capacity is left"""
+    response = jsonify({
+        'success': False,
+        'error': message,
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status_code
+
+
+@app.route('/api/v1/recharges/batch', methods=['POST'])
+def create_batch():
+    """
+    Queue many recharges that share logins
+    
+    POST /api/v1/recharges/batch
+    
+    Body:
+    {
+        "phone": "27865121",          // default login for the items
+        "password": "mypassword",
+        "items": [
+            {"beneficiary": "27865121", "amount": 10},
+            {"beneficiary": "27000001", "amount": 5, "phone": "...", "password": "..."}
+        ],
+        "monitor": false,             // optional: monitor each payment as its own job
+        "callback_url": "https://example.com/hook"  // optional
+    }
+    
+    Items are grouped by login phone and each group runs in one logged-in
+    browser session. Payment URLs arrive one by one as "item_ready" events
+    on /api/v1/recharge/<job_id>/events and in the job's result.items; the
+    final result reports beneficiaries per minute next to the single-request
+    estimate.
+    """
+    params, error = parse_batch_request(request.get_json(silent=True))
+    if error:
         return jsonify({
             'success': False,
-            'error': 'Invalid amount: must be positive integer'
+            'error': error
         }), 400
     
-    # Generate log file name
-    log_file = f"api_logs/{phone}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    try:
+        job, created = JOBS.submit_batch(idempotency_key=request.headers.get('Idempotency-Key'), **params)
+    except SchedulerFull as e:
+        return busy_response(str(e), e.retry_after, 429)
+    except SchedulerClosed as e:
+        return busy_response(str(e), e.retry_after, 503)
+    except IdempotencyConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 422
+    
+    return jsonify(batch_response(job, created)), 202 if created or job['status'] not in TERMINAL_STATUSES else 200
+
+
+def batch_response(job, created):
+    """Body of a batch POST (shared with the ASGI server)"""
+    return {
+        'success': True,
+        'message': 'Batch queued' if created else 'Attached to existing batch',
+        'idempotent_replay': not created,
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'items': len(job['request']['items']),
+        'accounts': job['request']['phone'].split(','),
+        'status_url': f"/api/v1/status/{job['job_id']}",
+        'events_url': f"/api/v1/recharge/{job['job_id']}/events",
+        'timestamp': job['created_at']
+    }
+
+
+@app.route('/api/v1/recharges/checkout', methods=['POST'])
+def create_checkout():
+    """
+    Recharge several beneficiaries with one credit card payment
+    
+    POST /api/v1/recharges/checkout
+    
+    Body:
+    {
+        "phone": "27865121",
+        "password": "mypassword",
+        "items": [
+            {"beneficiary": "27865121", "amount": 10},
+            {"beneficiary": "27000001", "amount": 10},
+            {"beneficiary": "27000002", "amount": 5}
+        ],
+        "callback_url": "https://example.com/hook"  // optional
+    }
+    
+    One order is filled with a recharge line per amount and the job gets a
+    single payment_url for the total (25 TND above). Once the payment is
+    detected, result.lines reports the outcome for every beneficiary and
+    result.amount_verified whether the paid amount matched the total.
+    """
+    params, error = parse_checkout_request(request.get_json(silent=True))
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error
+        }), 400
     
-    # Execute recharge
     try:
-        result = api_recharge(
-            phone=phone,
-            password=password,
-            beneficiary=beneficiary,
-            amount=amount,
-            timeout_seconds=timeout,
-            log_file=log_file
-        )
-        
-        # Format response
-        if result['success']:
-            response = {
-                'success': True,
-                'message': result['message'],
-                'data': {
-                    'order_id': result.get('payment', {}).get('data', {}).get('order_id'),
-                    'transaction_id': result.get('payment', {}).get('data', {}).get('transaction_id'),
-                    'amount': amount,
-                    'beneficiary': beneficiary,
-                    'elapsed_seconds': result.get('payment', {}).get('data', {}).get('elapsed_seconds'),
-                    'detection_method': result.get('payment', {}).get('data', {}).get('detection_method')
-                },
-                'timestamp': result.get('completed_at'),
-                'log_file': log_file
-            }
-            return jsonify(response), 200
-        
-        else:
-            response = {
-                'success': False,
-                'message': result['message'],
-                'error': {
-                    'stage': result.get('stage'),
-                    'details': result.get('payment', {}).get('message')
-                },
-                'timestamp': result.get('completed_at'),
-                'log_file': log_file
-            }
-            return jsonify(response), 400
-    
-    except Exception as e:
+        job, created = JOBS.submit_checkout(idempotency_key=request.headers.get('Idempotency-Key'), **params)
+    except SchedulerFull as e:
+        return busy_response(str(e), e.retry_after, 429)
+    except SchedulerClosed as e:
+        return busy_response(str(e), e.retry_after, 503)
+    except IdempotencyConflict as e:
         return jsonify({
             'success': False,
-            'error': f'Internal error: {str(e)}',
-            'log_file': log_file
-        }), 500
+            'error': str(e)
+        }), 422
+    
+    return jsonify(checkout_response(job, created)), 202 if created or job['status'] not in TERMINAL_STATUSES else 200
+
+
+def checkout_response(job, created):
+    """Body of a checkout POST (shared with the ASGI server)"""
+    return {
+        'success': True,
+        'message': 'Checkout queued' if created else 'Attached to existing checkout',
+        'idempotent_replay': not created,
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'amount': job['request']['amount'],
+        'lines': job['request']['lines'],
+        'payment_url': job['payment_url'],
+        'status_url': f"/api/v1/status/{job['job_id']}",
+        'events_url': f"/api/v1/recharge/{job['job_id']}/events",
+        'timestamp': job['created_at']
+    }
 
 
 @app.route('/api/v1/status/<order_id>', methods=['GET'])
 def check_status(order_id):
     """
-    Check status of an order
+    Check status of a recharge job
+    
+    GET /api/v1/status/<order_id>[?wait=20&version=3]
+    
+    <order_id> is the job ID returned by POST /api/v1/recharge, or the
+    portal order/transaction ID once the payment is detected.
+    
+    With ?wait=N (max 30s) the request long-polls: it returns as soon as
+    the job's version is newer than ?version (or the job is finished).
+    
+    The response is compact by default; ?include=logs adds the job's log
+    records, ?include=request,timing the original request and timings
+    (?include=all for everything).
+    """
+    try:
+        include = parse_include(request.args.get('include'))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    wait = request.args.get('wait', type=float)
+    
+    if wait:
+        job = JOBS.store.wait(order_id, request.args.get('version', -1, type=int), wait)
+    else:
+        job = JOBS.store.get(order_id)
+    
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown order: {order_id}'
+        }), 404
+    
+    logs = JOBS.logs.read(job['job_id']) if 'logs' in include else None
+    return jsonify(dict(job_view(job, include, logs), success=True)), 200
+
+
+def job_events(job, after_id, wait):
+    """
+    Events after a cursor, from the bus or (for jobs it does not hold:
+    evicted, run by another process, checkpointed) a single event built
+    from the stored job, after which the stream ends
     
-    GET /api/v1/status/<order_id>
+    Returns:
+        tuple: (events, closed)
+    """
+    if not BUS.has_topic(job['job_id']):
+        snapshot = {'id': 1, 'event': job['status'], 'data': job_view(job), 'timestamp': job['updated_at']}
+        return ([snapshot] if after_id < 1 else []), True
     
-    Note: This is a placeholder. In production, you'd:
-    1. Store order status in database during recharge
-    2. Query database by order_id
-    3. Return current status
+    return BUS.wait(job['job_id'], after_id, wait)
+
+
+@app.route('/api/v1/recharge/<job_id>/events', methods=['GET'])
+def recharge_events(job_id):
     """
+    Live stage events of a job
+    
+    GET /api/v1/recharge/<job_id>/events
+        Server-Sent Events stream (resumes from the Last-Event-ID header)
+    
+    GET /api/v1/recharge/<job_id>/events?poll=1&after=3&wait=25
+        Long-poll fallback: JSON with the events after ?after, returned
+        as soon as one exists (or after ?wait seconds, max 30)
+    
+    Events: queued, creating, logged_in, payment_url_ready, awaiting_payment,
+    payment_page_loaded, 3ds_detected, redirect_detected, payment_detected,
+    then one of success / failed / timeout / error (the stream ends there).
+    A job this process is not running gets one event with its stored state.
+    
+    Each stream holds a server thread, so at most SSE_MAX_STREAMS are open
+    at once; beyond that the stream gets 503 (use ?poll=1 or asgi_server.py).
+    """
+    job = JOBS.store.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown order: {job_id}'
+        }), 404
+    
+    after_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    
+    if request.args.get('poll') == '1':
+        events, closed = job_events(job, after_id, min(request.args.get('wait', 25, type=float), 30))
+        return jsonify({
+            'success': True,
+            'job_id': job['job_id'],
+            'events': events,
+            'cursor': events[-1]['id'] if events else after_id,
+            'done': closed
+        }), 200
+    
+    if not SSE_SLOTS.acquire(blocking=False):
+        return jsonify({
+            'success': False,
+            'error': f'Too many event streams (max {SSE_MAX_STREAMS})',
+            'hint': 'Long-poll with ?poll=1, or serve events from asgi_server.py'
+        }), 503, {'Retry-After': '5'}
+    
+    def stream(cursor):
+        yield 'retry: 3000\n\n'
+        while True:
+            events, closed = job_events(job, cursor, 15)
+            for event in events:
+                cursor = event['id']
+                yield format_sse(event)
+            if closed and not events:
+                break
+            if not events:
+                yield ': keep-alive\n\n'
+    
+    response = Response(stream(after_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, even if it never started streaming
+    response.call_on_close(SSE_SLOTS.release)
+    return response
+
+
+@app.route('/api/v1/orders', methods=['GET'])
+def list_orders():
+    """
+    Query stored orders (newest first)
+    
+    GET /api/v1/orders?beneficiary=27865121&status=success&since=2025-02-13&limit=50
+    
+    Filters: account, beneficiary, status, since, until (ISO dates), limit (max 500)
+    Add ?history=1 for the stage history and payment outcome of each order.
+    """
+    filters = {key: request.args.get(key) for key in ('account', 'beneficiary', 'status', 'since', 'until')}
+    limit = min(request.args.get('limit', 100, type=int), 500)
+    
+    orders = ORDERS.find(limit=limit, **filters)
+    
+    if request.args.get('history') == '1':
+        for order in orders:
+            order['stages'] = ORDERS.stages(order['job_id'])
+            order['outcome'] = ORDERS.outcome(order['job_id'])
+    
+    return jsonify({
+        'success': True,
+        'count': len(orders),
+        'orders': orders
+    }), 200
+
+
+@app.route('/api/v1/logs/<order_id>', methods=['GET'])
+def job_logs(order_id):
+    """
+    Event log of a job, read straight from the indexed log segments
+    
+    GET /api/v1/logs/<job_id|order_id|transaction_id>?event=REDIRECT_DETECTED&limit=200
+    
+    Records are returned oldest first: {"at", "job_id", "event", "data"}.
+    """
+    limit = min(request.args.get('limit', 1000, type=int), 10000)
+    records = JOBS.logs.read(order_id, event=request.args.get('event'), limit=limit)
+    
+    if not records:
+        return jsonify({
+            'success': False,
+            'error': f'No logs found for: {order_id}'
+        }), 404
+    
     return jsonify({
-        'order_id': order_id,
-        'message': 'Status check not yet implemented',
-        'note': 'Store order details in database during recharge creation'
-    }), 501
+        'success': True,
+        'id': order_id,
+        'job_ids': sorted({record['job_id'] for record in records}),
+        'count': len(records),
+        'records': records
+    }), 200
 
 
 @app.errorhandler(404)
@@ -175,8 +663,16 @@ def not_found(e):
         'error': 'Endpoint not found',
         'available_endpoints': [
             'GET /health',
+            'GET /health/live',
+            'GET /health/ready',
+            'GET /metrics',
             'POST /api/v1/recharge',
-            'GET /api/v1/status/<order_id>'
+            'POST /api/v1/recharges/batch',
+            'POST /api/v1/recharges/checkout',
+            'GET /api/v1/status/<order_id>',
+            'GET /api/v1/recharge/<job_id>/events',
+            'GET /api/v1/orders',
+            'GET /api/v1/logs/<order_id>'
         ]
     }), 404
 
@@ -199,12 +695,25 @@ if __name__ == '__main__':
     print()
     print("Available endpoints:")
     print("  GET  /health                - Health check")
-    print("  POST /api/v1/recharge       - Create and monitor recharge")
-    print("  GET  /api/v1/status/<id>    - Check order status (not implemented)")
+    print("  GET  /health/live           - Liveness probe (503 = restart)")
+    print("  GET  /health/ready          - Readiness probe (503 = no spare capacity)")
+    print("  GET  /metrics               - Prometheus metrics")
+    print("  POST /api/v1/recharge       - Queue recharge (returns job ID)")
+    print("  POST /api/v1/recharges/batch - Queue many recharges (one login per account)")
+    print("  POST /api/v1/recharges/checkout - Several beneficiaries, one payment")
+    print("  GET  /api/v1/status/<id>    - Job status (?wait=N to long-poll)")
+    print("  GET  /api/v1/recharge/<id>/events - Live stage events (SSE, ?poll=1)")
+    print("  GET  /api/v1/orders         - Query stored orders")
+    print("  GET  /api/v1/logs/<id>      - Job event log (indexed, ?event=)")
     print()
+    print(f"Workers: {JOBS.scheduler.workers}, queue: {JOBS.scheduler.max_queue}")
     print("Starting server on http://localhost:5000")
     print("=" * 70)
     print()
     
-    # Run server
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Drain on SIGTERM / SIGINT, and pick up monitors the previous process checkpointed
+    SHUTDOWN.install()
+    JOBS.resume()
+    
+    # Run server (no reloader: it would start a second worker pool)
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('API_DEBUG') == '1', use_reloader=False, threaded=True)
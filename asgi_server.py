@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+"""
+ASGI REST API for Ooredoo Recharge
+The api_server_example.py endpoints on an event loop, for many open clients
+
+Same routes, bodies and status codes as the Flask server, sharing its job
+runner, order store and event bus. Long-polls and SSE streams are parked
+coroutines (recharge_async.py) instead of WSGI threads, so one process
+holds thousands of waiting connections; the browser work stays on the
+JobScheduler workers.
+
+When a client disconnects, its request is cancelled. A POST that asked to
+wait for the outcome (?wait=N) also withdraws its job if it is still
+queued, so abandoned synchronous requests never start a browser.
+
+Run with any ASGI server:
+    uvicorn asgi_server:app --port 5000
+"""
+
+import sys
+import json
+import asyncio
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import metrics
+from api_server_example import (BUS, JOBS, PROBE, SHUTDOWN, batch_response, checkout_response, parse_batch_request,
+                                parse_checkout_request, parse_recharge_request)
+from event_bus import format_sse
+from job_scheduler import SchedulerClosed, SchedulerFull
+from recharge_async import AsyncRechargeJobs
+from recharge_jobs import MAX_WAIT_SECONDS, TERMINAL_STATUSES, IdempotencyConflict, job_view, parse_include
+import response_encoding
+
+
+# Longest a POST ?wait=N may hold the connection (creation + monitoring)
+MAX_SYNC_WAIT = 900
+
+# Largest accepted request body
+MAX_BODY_BYTES = 64 * 1024
+
+ENDPOINTS = [
+    'GET /health',
+    'GET /health/live',
+    'GET /health/ready',
+    'GET /metrics',
+    'POST /api/v1/recharge',
+    'POST /api/v1/recharges/batch',
+    'POST /api/v1/recharges/checkout',
+    'GET /api/v1/status/<order_id>',
+    'GET /api/v1/recharge/<job_id>/events',
+    'GET /api/v1/orders',
+    'GET /api/v1/logs/<order_id>'
+]
+
+ASYNC_JOBS = AsyncRechargeJobs(JOBS)
+
+
+class Request:
+    """Parsed ASGI HTTP request"""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        self.body = body
+
+    def json(self):
+        """Decoded JSON body (None if missing or invalid)"""
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+    def arg(self, name, default=None, type=str):
+        """Query argument converted with type (default if missing or invalid)"""
+        try:
+            return type(self.query[name])
+        except (KeyError, ValueError, TypeError):
+            return default
+
+
+async def read_body(receive):
+    """
+    Whole request body
+
+    Returns:
+        bytes: Body (None if it exceeded MAX_BODY_BYTES)
+
+    Raises:
+        ConnectionError: Client disconnected mid-body
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError('Client disconnected')
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_response(send, status, body, content_type='application/json', headers=None):
+    """Send a complete response (dict bodies are JSON-encoded)"""
+    if not isinstance(body, (bytes, str)):
+        body = response_encoding.dumps(body)
+    if isinstance(body, str):
+        body = body.encode()
+
+    raw_headers = [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode(), str(value).encode()))
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def error_body(message, **extra):
+    return dict({'success': False, 'error': message}, **extra)
+
+
+async def health(request, send):
+    """Overview for humans (always 200; probes use /health/live and /health/ready)"""
+    # The OCR service check may do network I/O: keep it off the loop
+    ready, report = await asyncio.get_running_loop().run_in_executor(ASYNC_JOBS.executor, PROBE.ready)
+    await send_response(send, 200, {
+        'status': 'healthy' if ready else 'saturated',
+        'failing': report['failing'],
+        'service': 'Ooredoo Recharge API',
+        'server': 'asgi',
+        'timestamp': datetime.now().isoformat(),
+        'jobs': JOBS.store.counts(),
+        'scheduler': JOBS.scheduler.snapshot(),
+        'event_bus': BUS.stats()
+    })
+
+
+async def liveness(request, send):
+    """Liveness probe: 200 while workers and store writers run, else 503"""
+    ok, body = PROBE.live()
+    await send_response(send, 200 if ok else 503, body)
+
+
+async def readiness(request, send):
+    """Readiness probe: 200 with spare capacity, 503 when a threshold is crossed"""
+    ok, body = await asyncio.get_running_loop().run_in_executor(ASYNC_JOBS.executor, PROBE.ready)
+    await send_response(send, 200 if ok else 503, body)
+
+
+async def prometheus_metrics(request, send):
+    """Prometheus scrape endpoint"""
+    await send_response(send, 200, metrics.render(), content_type='text/plain; version=0.0.4')
+
+
+async def create_recharge(request, send):
+    """
+    Queue a recharge (same contract as the Flask endpoint)
+
+    POST /api/v1/recharge[?wait=N]
+
+    With ?wait=N (max MAX_SYNC_WAIT seconds) the response is held until the
+    job finishes: 200 with the job when done within N seconds, else 202.
+    If the client disconnects while its job is still queued, the job is
+    cancelled.
+    """
+    params, error = parse_recharge_request(request.json())
+    if error:
+        await send_response(send, 400, error_body(error))
+        return
+
+    try:
+        job, created = await ASYNC_JOBS.submit(idempotency_key=request.headers.get('idempotency-key'), **params)
+    except SchedulerFull as e:
+        await busy_response(send, str(e), e.retry_after, 429)
+        return
+    except SchedulerClosed as e:
+        await busy_response(send, str(e), e.retry_after, 503)
+        return
+    except IdempotencyConflict as e:
+        await send_response(send, 422, error_body(str(e)))
+        return
+
+    wait = min(request.arg('wait', 0, float), MAX_SYNC_WAIT)
+    if wait > 0 and job['status'] not in TERMINAL_STATUSES:
+        try:
+            job = await ASYNC_JOBS.wait_done(job['job_id'], wait)
+        except asyncio.CancelledError:
+            if created:
+                ASYNC_JOBS.cancel(job['job_id'])
+            raise
+
+    done = job['status'] in TERMINAL_STATUSES
+
+    if not created:
+        # Retry of a known request: no new browser work, return the existing job
+        await send_response(send, 200 if done else 202, dict(
+            job_view(job),
+            success=True,
+            idempotent_replay=True,
+            message='Recharge already finished' if done else 'Attached to in-flight recharge'
+        ), headers={'Idempotent-Replayed': 'true'})
+        return
+
+    if wait > 0:
+        await send_response(send, 200 if done else 202, dict(
+            job_view(job),
+            success=True,
+            message='Recharge finished' if done else 'Recharge still running'
+        ))
+        return
+
+    await send_response(send, 202, {
+        'success': True,
+        'message': 'Recharge queued',
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'payment_url': job['payment_url'],
+        'status_url': f"/api/v1/status/{job['job_id']}",
+        'timestamp': job['created_at']
+    })
+
+
+async def create_batch(request, send):
+    """
+    Queue many recharges that share logins (same contract as the Flask endpoint)
+
+    POST /api/v1/recharges/batch
+    """
+    params, error = parse_batch_request(request.json())
+    if error:
+        await send_response(send, 400, error_body(error))
+        return
+
+    try:
+        job, created = await ASYNC_JOBS.submit_batch(idempotency_key=request.headers.get('idempotency-key'), **params)
+    except SchedulerFull as e:
+        await busy_response(send, str(e), e.retry_after, 429)
+        return
+    except SchedulerClosed as e:
+        await busy_response(send, str(e), e.retry_after, 503)
+        return
+    except IdempotencyConflict as e:
+        await send_response(send, 422, error_body(str(e)))
+        return
+
+    await send_response(send, 202 if created or job['status'] not in TERMINAL_STATUSES else 200,
+                        batch_response(job, created))
+
+
+async def create_checkout(request, send):
+    """
+    Several beneficiaries, one payment (same contract as the Flask endpoint)
+
+    POST /api/v1/recharges/checkout
+    """
+    params, error = parse_checkout_request(request.json())
+    if error:
+        await send_response(send, 400, error_body(error))
+        return
+
+    try:
+        job, created = await ASYNC_JOBS.submit_checkout(idempotency_key=request.headers.get('idempotency-key'), **params)
+    except SchedulerFull as e:
+        await busy_response(send, str(e), e.retry_after, 429)
+        return
+    except SchedulerClosed as e:
+        await busy_response(send, str(e), e.retry_after, 503)
+        return
+    except IdempotencyConflict as e:
+        await send_response(send, 422, error_body(str(e)))
+        return
+
+    await send_response(send, 202 if created or job['status'] not in TERMINAL_STATUSES else 200,
+                        checkout_response(job, created))
+
+
+async def busy_response(send, message, retry_after, status_code):
+    """Fast rejection when no worker capacity is left"""
+    await send_response(send, status_code, error_body(message, retry_after=retry_after),
+                        headers={'Retry-After': retry_after})
+
+
+async def check_status(request, send, order_id):
+    """
+    Check status of a recharge job
+
+    GET /api/v1/status/<order_id>[?wait=20&version=3&include=logs]
+    """
+    try:
+        include = parse_include(request.query.get('include'))
+    except ValueError as e:
+        await send_response(send, 400, error_body(str(e)))
+        return
+
+    wait = request.arg('wait', 0, float)
+
+    if wait:
+        job = await ASYNC_JOBS.wait(order_id, request.arg('version', -1, int), min(wait, MAX_WAIT_SECONDS))
+    else:
+        job = await ASYNC_JOBS.get(order_id)
+
+    if job is None:
+        await send_response(send, 404, error_body(f'Unknown order: {order_id}'))
+        return
+
+    logs = await ASYNC_JOBS.logs(job['job_id']) if 'logs' in include else None
+    await send_response(send, 200, dict(job_view(job, include, logs), success=True))
+
+
+async def job_events(job, after_id, wait):
+    """
+    Events after a cursor, from the bus or (for jobs it does not hold:
+    evicted, run by another process, checkpointed) a single event built
+    from the stored job, after which the stream ends
+
+    Returns:
+        tuple: (events, closed)
+    """
+    if not BUS.has_topic(job['job_id']):
+        snapshot = {'id': 1, 'event': job['status'], 'data': job_view(job), 'timestamp': job['updated_at']}
+        return ([snapshot] if after_id < 1 else []), True
+
+    return await ASYNC_JOBS.wait_events(job['job_id'], after_id, wait)
+
+
+async def recharge_events(request, send, job_id):
+    """
+    Live stage events of a job
+
+    GET /api/v1/recharge/<job_id>/events          (SSE, resumes from Last-Event-ID)
+    GET /api/v1/recharge/<job_id>/events?poll=1   (long-poll JSON)
+    """
+    job = await ASYNC_JOBS.get(job_id)
+    if job is None:
+        await send_response(send, 404, error_body(f'Unknown order: {job_id}'))
+        return
+
+    try:
+        after_id = int(request.headers.get('last-event-id', ''))
+    except ValueError:
+        after_id = request.arg('after', 0, int)
+
+    if request.query.get('poll') == '1':
+        events, closed = await job_events(job, after_id, min(request.arg('wait', 25, float), 30))
+        await send_response(send, 200, {
+            'success': True,
+            'job_id': job['job_id'],
+            'events': events,
+            'cursor': events[-1]['id'] if events else after_id,
+            'done': closed
+        })
+        return
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no')
+    ]})
+    await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+    cursor = after_id
+    while True:
+        events, closed = await job_events(job, cursor, 15)
+        chunk = ''.join(format_sse(event) for event in events)
+        if events:
+            cursor = events[-1]['id']
+        if closed and not events:
+            break
+        await send({'type': 'http.response.body', 'body': (chunk or ': keep-alive\n\n').encode(), 'more_body': True})
+
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def list_orders(request, send):
+    """
+    Query stored orders (newest first)
+
+    GET /api/v1/orders?beneficiary=27865121&status=success&since=2025-02-13&limit=50
+    """
+    filters = {key: request.query.get(key) for key in ('account', 'beneficiary', 'status', 'since', 'until')}
+    orders = await ASYNC_JOBS.find(limit=min(request.arg('limit', 100, int), 500), **filters)
+
+    if request.query.get('history') == '1':
+        for order in orders:
+            order['stages'], order['outcome'] = await ASYNC_JOBS.history(order['job_id'])
+
+    await send_response(send, 200, {
+        'success': True,
+        'count': len(orders),
+        'orders': orders
+    })
+
+
+async def job_logs(request, send, order_id):
+    """
+    Event log of a job (same contract as the Flask endpoint)
+
+    GET /api/v1/logs/<job_id|order_id|transaction_id>?event=...&limit=200
+    """
+    records = await ASYNC_JOBS.logs(order_id, event=request.query.get('event'),
+                                    limit=min(request.arg('limit', 1000, int), 10000))
+    if not records:
+        await send_response(send, 404, error_body(f'No logs found for: {order_id}'))
+        return
+
+    await send_response(send, 200, {
+        'success': True,
+        'id': order_id,
+        'job_ids': sorted({record['job_id'] for record in records}),
+        'count': len(records),
+        'records': records
+    })
+
+
+def route(method, path):
+    """
+    Handler and path arguments for a request
+
+    Returns:
+        tuple: (handler, args), (None, 405) for a known path with another
+            method, or (None, 404)
+    """
+    parts = path.strip('/').split('/')
+    routes = [
+        (['health'], 'GET', health),
+        (['health', 'live'], 'GET', liveness),
+        (['health', 'ready'], 'GET', readiness),
+        (['metrics'], 'GET', prometheus_metrics),
+        (['api', 'v1', 'recharge'], 'POST', create_recharge),
+        (['api', 'v1', 'recharges', 'batch'], 'POST', create_batch),
+        (['api', 'v1', 'recharges', 'checkout'], 'POST', create_checkout),
+        (['api', 'v1', 'status', None], 'GET', check_status),
+        (['api', 'v1', 'recharge', None, 'events'], 'GET', recharge_events),
+        (['api', 'v1', 'orders'], 'GET', list_orders),
+        (['api', 'v1', 'logs', None], 'GET', job_logs),
+    ]
+
+    path_matched = False
+    for pattern, route_method, handler in routes:
+        if len(pattern) != len(parts) or any(p is not None and p != part for p, part in zip(pattern, parts)):
+            continue
+        if any(p is None and not part for p, part in zip(pattern, parts)):
+            continue
+        if route_method != method:
+            path_matched = True
+            continue
+        return handler, [part for p, part in zip(pattern, parts) if p is None]
+
+    return None, 405 if path_matched else 404
+
+
+async def watch_disconnect(receive):
+    """Return once the client has gone away"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def compressing_send(send, accept_encoding):
+    """
+    Wrap send() so single-message JSON / text responses are compressed the
+    way the client accepts (streamed bodies such as SSE pass through)
+    """
+    pending = []
+
+    async def wrapped(message):
+        if message['type'] == 'http.response.start':
+            pending.append(message)
+            return
+        if pending:
+            start = pending.pop()
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                headers = dict(start['headers'])
+                body, encoding = response_encoding.encode(
+                    message.get('body', b''), headers.get(b'content-type', b'').decode('latin-1'), accept_encoding
+                )
+                if encoding:
+                    headers[b'content-length'] = str(len(body)).encode()
+                    headers[b'content-encoding'] = encoding.encode()
+                    headers[b'vary'] = b'Accept-Encoding'
+                    start = dict(start, headers=list(headers.items()))
+                    message = dict(message, body=body)
+            await send(start)
+        await send(message)
+
+    return wrapped
+
+
+async def handle_http(scope, receive, send):
+    accept_encoding = next((v.decode('latin-1') for k, v in scope.get('headers', []) if k.lower() == b'accept-encoding'), None)
+    send = compressing_send(send, accept_encoding)
+    handler, args = route(scope['method'], scope['path'])
+
+    if handler is None:
+        if args == 405:
+            await send_response(send, 405, error_body('Method not allowed'))
+        else:
+            await send_response(send, 404, error_body('Endpoint not found', available_endpoints=ENDPOINTS))
+        return
+
+    try:
+        body = await read_body(receive)
+    except ConnectionError:
+        return
+    if body is None:
+        await send_response(send, 413, error_body(f'Request body over {MAX_BODY_BYTES} bytes'))
+        return
+
+    request = Request(scope, body)
+    task = asyncio.ensure_future(handler(request, send, *args))
+    watcher = asyncio.ensure_future(watch_disconnect(receive))
+
+    await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+
+    if not task.done():
+        # Client disconnected: stop waiting on its behalf
+        task.cancel()
+    watcher.cancel()
+
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        print(f"❌ {scope['method']} {scope['path']} failed: {str(e)[:200]}")
+        try:
+            await send_response(send, 500, error_body('Internal server error', message=str(e)))
+        except Exception:
+            pass
+
+
+async def handle_lifespan(receive, send):
+    """Resume checkpointed payment monitors at startup; drain jobs and close the stores at shutdown"""
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await loop.run_in_executor(ASYNC_JOBS.executor, JOBS.resume)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Blocks until SHUTDOWN_DEADLINE at most; the server handles the signal
+            await loop.run_in_executor(None, SHUTDOWN.run)
+            ASYNC_JOBS.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI 3 application"""
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ uvicorn not installed. Install with: pip install uvicorn")
+        print("   (or serve asgi_server:app with any other ASGI server)")
+        sys.exit(1)
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print(f"Workers: {JOBS.scheduler.workers}, queue: {JOBS.scheduler.max_queue}")
+    print(f"Starting ASGI server on http://localhost:{port}")
+    # Open long-polls / SSE streams get MAX_WAIT_SECONDS to end before the job drain starts
+    uvicorn.run(app, host='0.0.0.0', port=port, log_level='warning', timeout_graceful_shutdown=MAX_WAIT_SECONDS)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Live Browser Registry
+Every Chrome the API flows open (portal sessions, payment monitors), so a
+shutdown can quit the ones still open instead of orphaning Chrome and
+chromedriver processes
+
+Flows register a driver right after launching it and unregister it just
+before quitting it; quit_all() is the last step of a graceful shutdown.
+"""
+
+import threading
+import time
+
+
+_lock = threading.Lock()
+_drivers = {}  # id(driver) -> (driver, owner, opened_at)
+
+
+def register(driver, owner):
+    """
+    Track a freshly launched driver
+
+    Args:
+        driver (WebDriver): Selenium driver
+        owner (str): Flow that opened it (e.g. 'creditcard', 'payment_monitor')
+    """
+    with _lock:
+        _drivers[id(driver)] = (driver, owner, time.time())
+
+
+def unregister(driver):
+    """Stop tracking a driver (its owner is about to quit it)"""
+    with _lock:
+        _drivers.pop(id(driver), None)
+
+
+def live():
+    """
+    Drivers still open
+
+    Returns:
+        list: Dicts with owner and age_seconds, oldest first
+    """
+    now = time.time()
+    with _lock:
+        entries = sorted(_drivers.values(), key=lambda entry: entry[2])
+    return [{'owner': owner, 'age_seconds': round(now - opened_at, 1)} for _, owner, opened_at in entries]
+
+
+def quit_all():
+    """
+    Quit every driver still registered (shutdown)
+
+    Their owners' own close() still works afterwards: quitting twice is
+    harmless and the error it raises is already ignored there.
+
+    Returns:
+        int: Drivers quit
+    """
+    with _lock:
+        entries = list(_drivers.values())
+        _drivers.clear()
+
+    for driver, owner, _ in entries:
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"⚠️  Could not quit {owner} browser: {str(e)[:80]}")
+    return len(entries)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Offline CAPTCHA Solver Benchmark
+Runs every solver backend and preprocessing variant over a labeled corpus
+in parallel and reports accuracy, p50/p99 latency, CPU time and memory
+
+Each (solver, variant, shard) task runs in a fresh worker process so that
+peak RSS is attributable to a single backend.
+"""
+
+import sys
+import json
+import math
+import time
+import resource
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from captcha_corpus import CaptchaCorpus
+from captcha_solvers import DEFAULT_PREPROCESS, available_solvers, get_solver
+
+# Preprocessing variants to compare (None = raw image)
+PREPROCESS_VARIANTS = {
+    'raw': None,
+    'default': DEFAULT_PREPROCESS,
+    'contrast3': dict(DEFAULT_PREPROCESS or {}, contrast=3.0),
+    'threshold100': dict(DEFAULT_PREPROCESS or {}, threshold=100),
+    'no_median': dict(DEFAULT_PREPROCESS or {}, median_size=0),
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _run_shard(corpus_path, solver_name, variant_name, record_ids):
+    """Worker: solve one shard of the corpus with one backend/variant"""
+    corpus = CaptchaCorpus(corpus_path)
+    records = {r['id']: r for r in corpus.records(labeled_only=True)}
+    solver = get_solver(solver_name)
+    preprocess = PREPROCESS_VARIANTS[variant_name]
+
+    # Warm up once so model loading is reported separately from latency
+    load_start = time.perf_counter()
+    first = records[record_ids[0]]
+    try:
+        solver(corpus.read(first), preprocess=preprocess)
+    except Exception:
+        pass
+    load_seconds = time.perf_counter() - load_start
+
+    latencies = []
+    correct = 0
+    errors = 0
+    cpu_start = time.process_time()
+
+    for record_id in record_ids:
+        record = records[record_id]
+        image_bytes = corpus.read(record)
+
+        start = time.perf_counter()
+        try:
+            text = solver(image_bytes, preprocess=preprocess)
+        except Exception:
+            text = None
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+
+        if text is not None and text.lower() == record['label'].lower():
+            correct += 1
+
+    return {
+        'solver': solver_name,
+        'variant': variant_name,
+        'count': len(record_ids),
+        'correct': correct,
+        'errors': errors,
+        'latencies': latencies,
+        'cpu_seconds': time.process_time() - cpu_start,
+        'load_seconds': load_seconds,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    }
+
+
+def run_benchmark(corpus_path='captcha_corpus', solvers=None, variants=None, workers=4, limit=None):
+    """
+    Benchmark solver backends over a labeled corpus
+
+    Args:
+        corpus_path (str): Corpus directory
+        solvers (list): Solver names (default: every free backend installed)
+        variants (list): Preprocessing variant names (default: all)
+        workers (int): Worker processes
+        limit (int): Only use the first N labeled images
+
+    Returns:
+        list: One result dict per (solver, variant)
+    """
+    corpus = CaptchaCorpus(corpus_path)
+    record_ids = [r['id'] for r in corpus.records(labeled_only=True)]
+    if limit:
+        record_ids = record_ids[:limit]
+    if not record_ids:
+        raise ValueError(f"No labeled CAPTCHAs in {corpus_path}")
+
+    solvers = solvers or available_solvers()
+    variants = variants or list(PREPROCESS_VARIANTS)
+
+    # Split the corpus so every backend/variant uses all workers
+    shard_size = max(1, -(-len(record_ids) // workers))
+    shards = [record_ids[i:i + shard_size] for i in range(0, len(record_ids), shard_size)]
+
+    merged = {}
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        futures = [
+            pool.submit(_run_shard, corpus_path, solver_name, variant_name, shard)
+            for solver_name in solvers
+            for variant_name in variants
+            for shard in shards
+        ]
+        for future in as_completed(futures):
+            part = future.result()
+            key = (part['solver'], part['variant'])
+            total = merged.setdefault(key, {
+                'solver': part['solver'], 'variant': part['variant'], 'count': 0, 'correct': 0,
+                'errors': 0, 'latencies': [], 'cpu_seconds': 0.0, 'load_seconds': 0.0, 'max_rss_mb': 0.0
+            })
+            total['count'] += part['count']
+            total['correct'] += part['correct']
+            total['errors'] += part['errors']
+            total['latencies'].extend(part['latencies'])
+            total['cpu_seconds'] += part['cpu_seconds']
+            total['load_seconds'] = max(total['load_seconds'], part['load_seconds'])
+            total['max_rss_mb'] = max(total['max_rss_mb'], part['max_rss_mb'])
+
+    results = []
+    for total in merged.values():
+        latencies = total.pop('latencies')
+        total['accuracy'] = round(total['correct'] / total['count'], 4)
+        total['p50_ms'] = round(percentile(latencies, 50) * 1000, 2)
+        total['p99_ms'] = round(percentile(latencies, 99) * 1000, 2)
+        total['cpu_ms_per_image'] = round(total['cpu_seconds'] * 1000 / total['count'], 2)
+        total['cpu_seconds'] = round(total['cpu_seconds'], 3)
+        total['load_seconds'] = round(total['load_seconds'], 3)
+        total['max_rss_mb'] = round(total['max_rss_mb'], 1)
+        results.append(total)
+
+    results.sort(key=lambda r: (-r['accuracy'], r['p50_ms']))
+    return results
+
+
+def print_report(results):
+    """Print benchmark results as a table"""
+    print()
+    print("=" * 96)
+    print(f"{'SOLVER':<12}{'VARIANT':<14}{'N':>6}{'ACCURACY':>10}{'P50 ms':>10}{'P99 ms':>10}"
+          f"{'CPU ms/img':>12}{'LOAD s':>9}{'RSS MB':>9}{'ERR':>5}")
+    print("=" * 96)
+    for r in results:
+        print(f"{r['solver']:<12}{r['variant']:<14}{r['count']:>6}{r['accuracy']:>10.1%}{r['p50_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['cpu_ms_per_image']:>12.2f}{r['load_seconds']:>9.2f}"
+              f"{r['max_rss_mb']:>9.1f}{r['errors']:>5}")
+    print("=" * 96)
+    print()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] in ('-h', '--help'):
+        print("Offline CAPTCHA Solver Benchmark")
+        print()
+        print("Usage: python captcha_bench.py [corpus_dir] [solvers] [variants] [workers] [limit] [--json]")
+        print()
+        print("Arguments:")
+        print("  corpus_dir - Corpus directory (default: captcha_corpus)")
+        print("  solvers    - Comma-separated solver names (default: all free installed backends)")
+        print(f"  variants   - Comma-separated preprocessing variants (default: {','.join(PREPROCESS_VARIANTS)})")
+        print("  workers    - Worker processes (default: 4)")
+        print("  limit      - Use only the first N labeled images")
+        print()
+        print("Example:")
+        print("  python captcha_bench.py captcha_corpus easyocr,tesseract default,raw 8")
+        print()
+        sys.exit(1)
+
+    as_json = '--json' in args
+    args = [a for a in args if a != '--json']
+
+    corpus_path = args[0] if len(args) > 0 else 'captcha_corpus'
+    solvers = args[1].split(',') if len(args) > 1 and args[1] else None
+    variants = args[2].split(',') if len(args) > 2 and args[2] else None
+    workers = int(args[3]) if len(args) > 3 else 4
+    limit = int(args[4]) if len(args) > 4 else None
+
+    results = run_benchmark(corpus_path, solvers, variants, workers, limit)
+
+    if as_json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
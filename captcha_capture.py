@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+CAPTCHA Image Capture
+Reads the original CAPTCHA bytes instead of screenshotting the element
+
+Order of attempts:
+    1. data: URI in the img src            - decoded in-process
+    2. CDP Page.getResourceContent         - bytes Chrome already downloaded
+    3. CDP Network.getResponseBody         - needs the performance log enabled
+    4. GET with the browser session cookies
+    5. Element screenshot                  - last resort (re-rasterized pixels)
+
+Steps 1-3 never touch the network, so they return exactly the image the
+page is showing.
+"""
+
+import time
+import base64
+import json
+from urllib.parse import unquote_to_bytes, urljoin
+
+from selenium.webdriver.common.by import By
+
+CAPTCHA_SELECTOR = 'img[alt="captcha"]'
+
+
+def decode_data_uri(uri):
+    """
+    Decode a data: URI
+
+    Returns:
+        tuple: (bytes, content_type)
+    """
+    header, _, data = uri.partition(',')
+    meta = header[len('data:'):].split(';')
+    content_type = meta[0] or 'text/plain'
+    if 'base64' in meta[1:]:
+        return base64.b64decode(data), content_type
+    return unquote_to_bytes(data), content_type
+
+
+def _from_resource_content(driver, src):
+    """Read a cached resource through CDP Page.getResourceContent"""
+    driver.execute_cdp_cmd('Page.enable', {})
+    frame_id = driver.execute_cdp_cmd('Page.getFrameTree', {})['frameTree']['frame']['id']
+    result = driver.execute_cdp_cmd('Page.getResourceContent', {'frameId': frame_id, 'url': src})
+    if result.get('base64Encoded'):
+        return base64.b64decode(result['content'])
+    return result['content'].encode('latin-1')
+
+
+def _from_response_body(driver, src):
+    """Read a response body through CDP Network.getResponseBody"""
+    request_id = None
+    for entry in driver.get_log('performance'):
+        message = json.loads(entry['message'])['message']
+        if message.get('method') == 'Network.responseReceived':
+            params = message['params']
+            if params['response']['url'] == src:
+                request_id = params['requestId']
+
+    if request_id is None:
+        raise LookupError('CAPTCHA request not found in performance log')
+
+    result = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+    if result.get('base64Encoded'):
+        return base64.b64decode(result['body'])
+    return result['body'].encode('latin-1')
+
+
+def _from_session_download(driver, src, timeout=5):
+    """Download the image with the browser's cookies and user agent"""
+    import requests
+
+    session = requests.Session()
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+
+    headers = {
+        'User-Agent': driver.execute_script('return navigator.userAgent;'),
+        'Referer': driver.current_url
+    }
+    response = session.get(src, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    if not response.headers.get('Content-Type', '').startswith('image'):
+        raise ValueError(f"Unexpected content type: {response.headers.get('Content-Type')}")
+    return response.content
+
+
+def capture_captcha(driver, selector=CAPTCHA_SELECTOR, allow_download=True):
+    """
+    Capture the CAPTCHA image shown on the current page
+
+    Args:
+        driver: Selenium WebDriver on a page with the CAPTCHA
+        selector (str): CSS selector of the CAPTCHA <img>
+        allow_download (bool): Allow re-downloading the image with the session
+            cookies. The portal keeps the code per session, so a re-download
+            renders the same text; disable it for sites that rotate the code
+            on every image request.
+
+    Returns:
+        dict: {'image': bytes, 'method': str, 'elapsed_ms': float, 'errors': dict}
+    """
+    start = time.perf_counter()
+    captcha_img = driver.find_element(By.CSS_SELECTOR, selector)
+    src = captcha_img.get_attribute('src') or ''
+    errors = {}
+
+    def done(image, method):
+        return {
+            'image': image,
+            'method': method,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2),
+            'errors': errors
+        }
+
+    if src.startswith('data:'):
+        try:
+            image, _ = decode_data_uri(src)
+            return done(image, 'data_uri')
+        except Exception as e:
+            errors['data_uri'] = str(e)
+    elif src:
+        src = urljoin(driver.current_url, src)
+
+        attempts = [
+            ('resource_content', _from_resource_content),
+            ('response_body', _from_response_body),
+        ]
+        if allow_download:
+            attempts.append(('session_download', _from_session_download))
+
+        for method, fetch in attempts:
+            try:
+                image = fetch(driver, src)
+                if image:
+                    return done(image, method)
+            except Exception as e:
+                errors[method] = str(e)[:200]
+
+    return done(captcha_img.screenshot_as_png, 'screenshot')
+
+
+def fetch_captcha_bytes(driver, selector=CAPTCHA_SELECTOR, allow_download=True):
+    """Convenience wrapper returning only the CAPTCHA image bytes"""
+    return capture_captcha(driver, selector, allow_download)['image']
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+CAPTCHA Corpus Harvester
+Records CAPTCHA images from live or simulated sessions and labels them
+automatically from the portal's accept/reject response
+
+Corpus layout (compact, append-only):
+    images.bin   - concatenated raw image bytes
+    index.jsonl  - one JSON record per image (offset, length, label, ...)
+
+Labeling rule for live sessions: submit a dummy 14-digit code with the
+solver's guess. "Captcha incorrect" means the guess was wrong; any other
+server-side answer ("Recharge non aboutie", success) means the CAPTCHA was
+accepted, so the guess is the true label.
+"""
+
+import io
+import os
+import sys
+import json
+import random
+import hashlib
+import threading
+from datetime import datetime
+
+CAPTCHA_CHARSET = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+CAPTCHA_REJECTED_KEYWORDS = ['captcha']
+CAPTCHA_ACCEPTED_KEYWORDS = ['non aboutie', 'succès', 'effectuée', 'réussie']
+
+
+def classify_captcha_verdict(response):
+    """
+    Decide whether the portal accepted the submitted CAPTCHA
+
+    Args:
+        response (dict): Result of OoredooRecharge.parse_response()
+
+    Returns:
+        str: 'accepted', 'rejected' or 'unknown'
+    """
+    messages = ' '.join(response.get('messages', [])).lower()
+
+    if any(kw in messages for kw in CAPTCHA_REJECTED_KEYWORDS):
+        return 'rejected'
+    if response.get('status') == 'success' or any(kw in messages for kw in CAPTCHA_ACCEPTED_KEYWORDS):
+        return 'accepted'
+    return 'unknown'
+
+
+class CaptchaCorpus:
+    """Append-only store of CAPTCHA images with labels"""
+
+    def __init__(self, path='captcha_corpus'):
+        """
+        Args:
+            path (str): Corpus directory (created if missing)
+        """
+        self.path = path
+        self.images_path = os.path.join(path, 'images.bin')
+        self.index_path = os.path.join(path, 'index.jsonl')
+        self._lock = threading.Lock()
+        self._records = []
+        self._by_hash = {}
+
+        os.makedirs(path, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    self._remember(json.loads(line))
+
+    def _remember(self, record):
+        existing = self._by_hash.get(record['sha1'])
+        if existing is not None:
+            # Later records for the same image update its label
+            existing.update(record)
+            return
+        self._records.append(record)
+        self._by_hash[record['sha1']] = record
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, image_bytes, label=None, guess=None, verdict=None, source='live'):
+        """
+        Store a CAPTCHA image
+
+        Args:
+            image_bytes (bytes): Raw image
+            label (str): True CAPTCHA text, if known
+            guess (str): Text the solver submitted
+            verdict (str): 'accepted', 'rejected', 'synthetic' or 'unknown'
+            source (str): Where the image came from ('live', 'synthetic', ...)
+
+        Returns:
+            dict: The index record
+        """
+        sha1 = hashlib.sha1(image_bytes).hexdigest()
+
+        with self._lock:
+            existing = self._by_hash.get(sha1)
+            if existing is not None:
+                offset, length = existing['offset'], existing['length']
+            else:
+                with open(self.images_path, 'ab') as f:
+                    offset = f.tell()
+                    f.write(image_bytes)
+                length = len(image_bytes)
+
+            record = {
+                'id': sha1[:16],
+                'sha1': sha1,
+                'offset': offset,
+                'length': length,
+                'label': label,
+                'guess': guess,
+                'verdict': verdict,
+                'source': source,
+                'timestamp': datetime.now().isoformat()
+            }
+
+            if existing is not None and existing.get('label') and not label:
+                # Never lose a known label to a later unlabeled sighting
+                record['label'] = existing['label']
+
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+
+            self._remember(record)
+            return self._by_hash[sha1]
+
+    def record_attempt(self, image_bytes, guess, response):
+        """
+        Store a CAPTCHA together with the portal's reaction to a guess
+
+        Args:
+            image_bytes (bytes): Raw image the guess was made on
+            guess (str): Submitted CAPTCHA text
+            response (dict): Result of parse_response()
+
+        Returns:
+            dict: The index record
+        """
+        verdict = classify_captcha_verdict(response)
+        label = guess if verdict == 'accepted' else None
+        return self.add(image_bytes, label=label, guess=guess, verdict=verdict, source='live')
+
+    def read(self, record):
+        """Read the image bytes for an index record"""
+        with open(self.images_path, 'rb') as f:
+            f.seek(record['offset'])
+            return f.read(record['length'])
+
+    def records(self, labeled_only=False):
+        """All index records, optionally only those with a known label"""
+        with self._lock:
+            records = list(self._records)
+        if labeled_only:
+            records = [r for r in records if r.get('label')]
+        return records
+
+    def labeled(self):
+        """Iterate over (record, image_bytes) for labeled images"""
+        with open(self.images_path, 'rb') as f:
+            for record in self.records(labeled_only=True):
+                f.seek(record['offset'])
+                yield record, f.read(record['length'])
+
+    def stats(self):
+        """Summary counts by verdict and source"""
+        summary = {'total': 0, 'labeled': 0, 'by_verdict': {}, 'by_source': {}}
+        for record in self.records():
+            summary['total'] += 1
+            if record.get('label'):
+                summary['labeled'] += 1
+            verdict = record.get('verdict') or 'unknown'
+            source = record.get('source') or 'unknown'
+            summary['by_verdict'][verdict] = summary['by_verdict'].get(verdict, 0) + 1
+            summary['by_source'][source] = summary['by_source'].get(source, 0) + 1
+        return summary
+
+
+def split_samples(samples, val_fraction):
+    """
+    Deterministic train/held-out split by image hash (an image always lands
+    on the same side, whatever else the corpus holds)
+
+    Args:
+        samples (list): (image_bytes, label) pairs
+        val_fraction (float): Share of images held out
+
+    Returns:
+        tuple: (train, held_out) lists
+    """
+    train, val = [], []
+    for image_bytes, label in samples:
+        bucket = int(hashlib.sha1(image_bytes).hexdigest()[:4], 16) / 0xFFFF
+        (val if bucket < val_fraction else train).append((image_bytes, label))
+    return train, val
+
+
+def generate_synthetic_captcha(text=None, length=6, seed=None):
+    """
+    Render a CAPTCHA-like image for simulated sessions
+
+    Args:
+        text (str): Text to render (random lowercase alphanumeric if None)
+        length (int): Length of random text
+        seed (int): Random seed for reproducible images
+
+    Returns:
+        tuple: (text, png_bytes)
+    """
+    from PIL import Image, ImageDraw, ImageFont, ImageFilter
+
+    rng = random.Random(seed)
+    if text is None:
+        text = ''.join(rng.choice(CAPTCHA_CHARSET) for _ in range(length))
+
+    width, height = 150, 50
+    img = Image.new('L', (width, height), color=rng.randint(220, 255))
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.load_default(size=24)
+    except TypeError:  # Pillow < 10.1 has no scalable default font
+        font = ImageFont.load_default()
+
+    # Background noise lines
+    for _ in range(4):
+        draw.line(
+            [(rng.randint(0, width), rng.randint(0, height)), (rng.randint(0, width), rng.randint(0, height))],
+            fill=rng.randint(120, 200),
+            width=1
+        )
+
+    # Glyphs with a little jitter
+    x = 12
+    for char in text:
+        y = rng.randint(4, 14)
+        draw.text((x, y), char, fill=rng.randint(0, 60), font=font)
+        x += rng.randint(18, 22)
+
+    img = img.filter(ImageFilter.SMOOTH)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return text, buffer.getvalue()
+
+
+def harvest_synthetic(corpus, count, seed=0):
+    """Fill the corpus with labeled synthetic CAPTCHAs"""
+    for i in range(count):
+        text, png = generate_synthetic_captcha(seed=seed + i)
+        corpus.add(png, label=text, verdict='synthetic', source='synthetic')
+    return count
+
+
+def harvest_live(corpus, count, solver_name='easyocr', username="27865121", password="espaceclient.ooredoo.tn%2F",
+                 phone_number="27865121", dummy_code="12345678901234"):
+    """
+    Harvest labeled CAPTCHAs from the real /recharge-card form
+
+    A dummy recharge code is submitted with the solver's guess so that the
+    portal's answer tells us whether the CAPTCHA text was right.
+
+    Returns:
+        dict: Counts of accepted/rejected/unknown verdicts
+    """
+    from recharge import OoredooRecharge
+    from captcha_capture import fetch_captcha_bytes
+    from captcha_solvers import get_solver
+
+    solver = get_solver(solver_name)
+    counts = {'accepted': 0, 'rejected': 0, 'unknown': 0}
+
+    bot = OoredooRecharge(headless=True)
+    try:
+        bot.login(username, password)
+        for i in range(count):
+            bot.navigate_to_recharge()
+            captcha_png = fetch_captcha_bytes(bot.driver)
+
+            try:
+                guess = solver(captcha_png)
+            except Exception as e:
+                print(f"   ⚠️  Solver error: {e}")
+                guess = ''
+
+            if not guess:
+                corpus.add(captcha_png, verdict='unknown', source='live')
+                counts['unknown'] += 1
+                continue
+
+            response = bot.submit_recharge(phone_number, dummy_code, captcha_text=guess)
+            record = corpus.record_attempt(captcha_png, guess, response)
+            counts[record['verdict']] = counts.get(record['verdict'], 0) + 1
+            print(f"   [{i + 1}/{count}] {guess!r} -> {record['verdict']}")
+    finally:
+        bot.close()
+
+    return counts
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('stats', 'synth', 'live'):
+        print("CAPTCHA Corpus Harvester")
+        print()
+        print("Usage:")
+        print("  python captcha_corpus.py stats [corpus_dir]")
+        print("  python captcha_corpus.py synth <count> [corpus_dir]")
+        print("  python captcha_corpus.py live <count> [solver] [corpus_dir]")
+        print()
+        print("Examples:")
+        print("  python captcha_corpus.py synth 500")
+        print("  python captcha_corpus.py live 50 easyocr")
+        print()
+        sys.exit(1)
+
+    command = sys.argv[1]
+
+    if command == 'stats':
+        corpus = CaptchaCorpus(sys.argv[2] if len(sys.argv) > 2 else 'captcha_corpus')
+        print(json.dumps(corpus.stats(), indent=2))
+
+    elif command == 'synth':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        corpus = CaptchaCorpus(sys.argv[3] if len(sys.argv) > 3 else 'captcha_corpus')
+        harvest_synthetic(corpus, count, seed=len(corpus))
+        print(f"✅ Added {count} synthetic CAPTCHAs to {corpus.path}")
+        print(json.dumps(corpus.stats(), indent=2))
+
+    elif command == 'live':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+        solver_name = sys.argv[3] if len(sys.argv) > 3 else 'easyocr'
+        corpus = CaptchaCorpus(sys.argv[4] if len(sys.argv) > 4 else 'captcha_corpus')
+        print(f"🔍 Harvesting {count} live CAPTCHAs with {solver_name}...")
+        counts = harvest_live(corpus, count, solver_name)
+        print(f"✅ Done: {counts}")
+        print(json.dumps(corpus.stats(), indent=2))
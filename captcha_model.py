@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Compact CAPTCHA Model (CNN + CTC)
+Small recognizer trained on CPU from the labeled corpus harvested on the
+/recharge-card flow (captcha_corpus.py)
+
+    python captcha_model.py train captcha_corpus captcha_model.pt 40
+    python captcha_model.py eval  captcha_corpus captcha_model.pt
+    python captcha_model.py bench captcha_corpus captcha_model.pt
+
+Architecture: 4 conv blocks collapse the image height, a 1-layer BiGRU reads
+the columns left to right, and CTC aligns the column outputs with the label,
+so no per-character segmentation is needed. The exported TorchScript file
+(weights int8-quantized for the recurrent/linear layers) is a few hundred KB
+and loads in milliseconds.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from PIL import Image
+
+from captcha_corpus import CAPTCHA_CHARSET as CHARSET, split_samples
+
+# Share of the corpus held out from training (validation, then eval)
+VAL_FRACTION = 0.1
+
+IMAGE_HEIGHT = 32
+IMAGE_WIDTH = 128
+DEFAULT_MODEL_PATH = 'captcha_model.pt'
+
+_model_cache = {}
+
+
+def image_to_array(image_bytes):
+    """Decode, grayscale, resize and scale an image to [0, 1] (H, W) float32"""
+    img = Image.open(io.BytesIO(image_bytes)).convert('L').resize((IMAGE_WIDTH, IMAGE_HEIGHT), Image.BILINEAR)
+    arr = np.asarray(img, dtype=np.float32) / 255.0
+    # Dark text on light background -> text = high values
+    if arr.mean() > 0.5:
+        arr = 1.0 - arr
+    return arr
+
+
+class CaptchaCRNN(nn.Module):
+    """Conv feature extractor + BiGRU + per-column classifier"""
+
+    def __init__(self, num_classes=len(CHARSET) + 1, hidden=64):
+        super().__init__()
+
+        def block(c_in, c_out, pool):
+            return nn.Sequential(
+                nn.Conv2d(c_in, c_out, 3, padding=1, bias=False),
+                nn.BatchNorm2d(c_out),
+                nn.ReLU(inplace=True),
+                nn.MaxPool2d(pool)
+            )
+
+        self.features = nn.Sequential(
+            block(1, 32, (2, 2)),    # 16 x 64
+            block(32, 64, (2, 2)),   # 8 x 32
+            block(64, 96, (2, 1)),   # 4 x 32
+            block(96, 96, (4, 1)),   # 1 x 32
+        )
+        self.rnn = nn.GRU(96, hidden, batch_first=True, bidirectional=True)
+        self.classifier = nn.Linear(hidden * 2, num_classes)
+
+    def forward(self, x):
+        """x: (N, 1, H, W) -> log-probs (T, N, C) for CTC"""
+        features = self.features(x).squeeze(2).permute(0, 2, 1)  # N, T, C
+        output, _ = self.rnn(features)
+        return F.log_softmax(self.classifier(output), dim=2).permute(1, 0, 2)
+
+
+def ctc_greedy_decode(log_probs, charset=CHARSET):
+    """Collapse repeats and drop blanks (index 0) -> list of strings"""
+    best = log_probs.argmax(dim=2).permute(1, 0).cpu().numpy()  # N, T
+    texts = []
+    for row in best:
+        chars = []
+        previous = 0
+        for index in row:
+            if index != previous and index != 0:
+                chars.append(charset[index - 1])
+            previous = index
+        texts.append(''.join(chars))
+    return texts
+
+
+def _encode(samples):
+    """Decode images in parallel worker threads and build tensors"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        arrays = list(pool.map(lambda s: image_to_array(s[0]), samples))
+    images = torch.from_numpy(np.stack(arrays)).unsqueeze(1) if arrays else torch.zeros(0, 1, IMAGE_HEIGHT, IMAGE_WIDTH)
+    labels = [label.lower() for _, label in samples]
+    return images, labels
+
+
+def train_model(samples, epochs=40, batch_size=64, lr=3e-3, val_fraction=VAL_FRACTION, threads=None, seed=0):
+    """
+    Train the CRNN on labeled CAPTCHAs using every CPU core
+
+    Args:
+        samples (list): (image_bytes, label) pairs
+        epochs (int): Training epochs
+        batch_size (int): Mini-batch size
+        lr (float): Peak learning rate (one-cycle schedule)
+        val_fraction (float): Share of images held out for validation
+        threads (int): Intra-op threads (default: all cores)
+        seed (int): Random seed
+
+    Returns:
+        tuple: (model, history list)
+    """
+    torch.manual_seed(seed)
+    torch.set_num_threads(threads or os.cpu_count() or 1)
+
+    samples = [(image, label) for image, label in samples if label and all(c in CHARSET for c in label.lower())]
+    train_samples, val_samples = split_samples(samples, val_fraction)
+    train_images, train_labels = _encode(train_samples)
+    val_images, val_labels = _encode(val_samples)
+
+    targets = [torch.tensor([CHARSET.index(c) + 1 for c in label]) for label in train_labels]
+
+    model = CaptchaCRNN()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=1e-4)
+    steps_per_epoch = max(1, -(-len(train_labels) // batch_size))
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=lr, total_steps=epochs * steps_per_epoch)
+    ctc = nn.CTCLoss(blank=0, zero_infinity=True)
+
+    history = []
+    for epoch in range(1, epochs + 1):
+        model.train()
+        start = time.perf_counter()
+        permutation = torch.randperm(len(train_labels))
+        total_loss = 0.0
+
+        for i in range(0, len(train_labels), batch_size):
+            index = permutation[i:i + batch_size]
+            batch = train_images[index]
+
+            # Light augmentation: random horizontal shift
+            shift = int(torch.randint(-4, 5, (1,)))
+            batch = torch.roll(batch, shifts=shift, dims=3)
+
+            batch_targets = [targets[j] for j in index.tolist()]
+            log_probs = model(batch)
+            input_lengths = torch.full((len(index),), log_probs.size(0), dtype=torch.long)
+            target_lengths = torch.tensor([len(t) for t in batch_targets], dtype=torch.long)
+
+            loss = ctc(log_probs, torch.cat(batch_targets), input_lengths, target_lengths)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total_loss += loss.item() * len(index)
+
+        entry = {
+            'epoch': epoch,
+            'loss': round(total_loss / max(len(train_labels), 1), 4),
+            'seconds': round(time.perf_counter() - start, 2)
+        }
+        if len(val_labels):
+            entry['val_accuracy'] = round(evaluate_arrays(model, val_images, val_labels), 4)
+        history.append(entry)
+        print(f"   epoch {epoch:>3}/{epochs}  loss {entry['loss']:.4f}  "
+              f"val {entry.get('val_accuracy', float('nan')):.1%}  ({entry['seconds']}s)")
+
+    model.eval()
+    return model, history
+
+
+def evaluate_arrays(model, images, labels, batch_size=256):
+    """Exact-match accuracy over pre-encoded images"""
+    model.eval()
+    correct = 0
+    with torch.inference_mode():
+        for i in range(0, len(labels), batch_size):
+            texts = ctc_greedy_decode(model(images[i:i + batch_size]))
+            correct += sum(t == l for t, l in zip(texts, labels[i:i + batch_size]))
+    return correct / max(len(labels), 1)
+
+
+def export_model(model, path=DEFAULT_MODEL_PATH):
+    """Quantize GRU/Linear weights to int8 and save as TorchScript"""
+    model.eval()
+    quantized = torch.ao.quantization.quantize_dynamic(model, {nn.GRU, nn.Linear}, dtype=torch.qint8)
+    example = torch.zeros(1, 1, IMAGE_HEIGHT, IMAGE_WIDTH)
+    with torch.inference_mode():
+        scripted = torch.jit.trace(quantized, example)
+    torch.jit.save(scripted, path, _extra_files={'charset': CHARSET})
+    return os.path.getsize(path)
+
+
+class CaptchaModel:
+    """Inference wrapper around an exported TorchScript model"""
+
+    def __init__(self, path=DEFAULT_MODEL_PATH):
+        """
+        Args:
+            path (str): Exported model file
+
+        The torch thread count is process-wide (EasyOCR shares it), so it is
+        left alone here; only the bench CLI pins it.
+        """
+        extra = {'charset': ''}
+        start = time.perf_counter()
+        self.module = torch.jit.load(path, map_location='cpu', _extra_files=extra)
+        self.module.eval()
+        self.charset = extra['charset'].decode() if isinstance(extra['charset'], bytes) else (extra['charset'] or CHARSET)
+        self.load_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def predict_batch(self, images):
+        """Read several CAPTCHA images in one forward pass"""
+        batch = torch.from_numpy(np.stack([image_to_array(image) for image in images])).unsqueeze(1)
+        with torch.inference_mode():
+            return ctc_greedy_decode(self.module(batch), self.charset)
+
+    def predict(self, image_bytes):
+        """Read one CAPTCHA image"""
+        return self.predict_batch([image_bytes])[0]
+
+
+def get_captcha_model(path=None):
+    """Load (and cache) the model used by solve_cnn()"""
+    path = path or os.getenv('CAPTCHA_MODEL', DEFAULT_MODEL_PATH)
+    if path not in _model_cache:
+        _model_cache[path] = CaptchaModel(path)
+    return _model_cache[path]
+
+
+def solve_cnn(image_bytes, preprocess=None):
+    """
+    Solve CAPTCHA with the compact CNN/CTC model (solver interface)
+
+    Args:
+        image_bytes (bytes): Raw CAPTCHA image
+        preprocess (dict): Optional preprocess_captcha() parameters
+
+    Returns:
+        str: CAPTCHA text
+    """
+    if preprocess is not None:
+        from captcha_solvers import _prepare
+        image_bytes = _prepare(image_bytes, preprocess)
+    return get_captcha_model().predict(image_bytes)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('train', 'eval', 'bench'):
+        print("Compact CAPTCHA Model (CNN + CTC)")
+        print()
+        print("Usage:")
+        print("  python captcha_model.py train [corpus_dir] [model_path] [epochs]")
+        print("  python captcha_model.py eval  [corpus_dir] [model_path]")
+        print("  python captcha_model.py bench [corpus_dir] [model_path]")
+        print()
+        print(f"eval scores only the {VAL_FRACTION:.0%} of the corpus train held out (by image hash).")
+        print()
+        sys.exit(1)
+
+    from captcha_corpus import CaptchaCorpus
+
+    command = sys.argv[1]
+    corpus = CaptchaCorpus(sys.argv[2] if len(sys.argv) > 2 else 'captcha_corpus')
+    model_path = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_MODEL_PATH
+    samples = [(image, record['label']) for record, image in corpus.labeled()]
+
+    if command == 'train':
+        epochs = int(sys.argv[4]) if len(sys.argv) > 4 else 40
+        print(f"🧠 Training on {len(samples)} labeled CAPTCHAs ({torch.get_num_threads()} threads)...")
+        start = time.perf_counter()
+        model, history = train_model(samples, epochs=epochs)
+        size = export_model(model, model_path)
+        print(f"✅ Model saved to {model_path} ({size / 1024:.0f} KB, trained in {time.perf_counter() - start:.0f}s)")
+        print(json.dumps(history[-1], indent=2))
+
+    elif command == 'eval':
+        # Only the validation images: the model was trained on the rest
+        _, samples = split_samples(samples, VAL_FRACTION)
+        model = CaptchaModel(model_path)
+        texts = model.predict_batch([image for image, _ in samples]) if samples else []
+        correct = sum(t == label.lower() for t, (_, label) in zip(texts, samples))
+        print(json.dumps({
+            'images': len(samples),
+            'held_out': True,
+            'accuracy': round(correct / max(len(samples), 1), 4),
+            'load_ms': model.load_ms
+        }, indent=2))
+
+    else:
+        # One intra-op thread: the latency of a single solver worker
+        torch.set_num_threads(1)
+        model = CaptchaModel(model_path)
+        latencies = []
+        for image, _ in samples:
+            start = time.perf_counter()
+            model.predict(image)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        batch_start = time.perf_counter()
+        if samples:
+            model.predict_batch([image for image, _ in samples])
+        batch_seconds = time.perf_counter() - batch_start
+        print(json.dumps({
+            'images': len(samples),
+            'load_ms': model.load_ms,
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+            'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+            'batched_ms_per_image': round(batch_seconds * 1000 / max(len(samples), 1), 3)
+        }, indent=2))
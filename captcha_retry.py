@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+In-Session CAPTCHA Retry Engine
+Retries a wrong CAPTCHA on the already-loaded /recharge-card form instead
+of starting the whole login + navigation over
+
+The first CAPTCHA is solved on a worker thread while the form is filled
+(submit_recharge() joins it just before Valider). After a "Captcha
+incorrect" answer the portal re-renders the same form with a new CAPTCHA
+and keeps the recharge code filled in (see RESPONSES.md), so a retry only
+needs to: capture the new image, solve it, refill the CAPTCHA field and
+click Valider again. When the image did not change, the next-best
+candidate from the ensemble is tried on the same image.
+"""
+
+import time
+import hashlib
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+from captcha_capture import CAPTCHA_SELECTOR, capture_captcha
+from captcha_corpus import classify_captcha_verdict
+from captcha_solvers import BackgroundSolve, CaptchaUnsolved
+from metrics import inc as count_metric
+
+
+class CaptchaRetryEngine:
+    """Submit a recharge code, retrying CAPTCHA rejections in-session"""
+
+    def __init__(self, bot, solver, max_attempts=3, corpus=None):
+        """
+        Args:
+            bot: Logged-in OoredooRecharge on the /recharge-card page
+            solver (callable): image_bytes -> str, or image_bytes -> list of
+                candidates best first (e.g. captcha_solvers.solve_candidates)
+            max_attempts (int): CAPTCHA attempts allowed per recharge code
+            corpus (CaptchaCorpus): Optional corpus that records every attempt
+        """
+        self.bot = bot
+        self.solver = solver
+        self.max_attempts = max_attempts
+        self.corpus = corpus
+        self.attempts_used = {}  # recharge code -> attempts spent so far
+
+    def _solve(self, image_bytes):
+        """Run the solver and always return a candidate list"""
+        result = self.solver(image_bytes)
+        if isinstance(result, str):
+            return [result] if result else []
+        return list(result or [])
+
+    def _refresh_captcha(self, previous_hash):
+        """
+        Make sure a new CAPTCHA is shown; the portal normally regenerates it
+        on every answer, otherwise click the image (Yii refresh handler)
+
+        Returns:
+            bool: True if the image changed
+        """
+        driver = self.bot.driver
+        try:
+            driver.find_element(By.CSS_SELECTOR, CAPTCHA_SELECTOR).click()
+            WebDriverWait(driver, 3).until(
+                lambda d: hashlib.sha1(capture_captcha(d)['image']).hexdigest() != previous_hash
+            )
+            return True
+        except Exception:
+            return False
+
+    def _resubmit(self, recharge_code, captcha_text):
+        """Refill only what the portal cleared and click Valider again"""
+        driver = self.bot.driver
+
+        text_inputs = driver.find_elements(By.CSS_SELECTOR, 'input[type="text"]')
+
+        # The recharge code normally survives the round trip; refill if not
+        for inp in text_inputs[:-1]:
+            parent_text = inp.find_element(By.XPATH, './..').text
+            if 'CODE' in parent_text and not inp.get_attribute('value'):
+                inp.send_keys(recharge_code)
+                break
+
+        captcha_input = text_inputs[-1]
+        captcha_input.clear()
+        captcha_input.send_keys(captcha_text)
+
+        valider_btn = WebDriverWait(driver, 10).until(
+            EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Valider')]"))
+        )
+        valider_btn.click()
+
+        time.sleep(3)
+        return self.bot.parse_response()
+
+    def submit(self, phone_number, recharge_code):
+        """
+        Submit a recharge code, retrying CAPTCHA rejections
+
+        Returns:
+            dict: Final parse_response() result plus 'attempts' (per-attempt
+                metrics) and 'captcha_verdict'
+        """
+        attempts = []
+        candidates = []
+        image_hash = None
+        response = {'status': 'error', 'messages': ['CAPTCHA retry budget exhausted']}
+        verdict = 'unknown'
+        form_submitted = False
+
+        while self.attempts_used.get(recharge_code, 0) < self.max_attempts:
+            number = self.attempts_used.get(recharge_code, 0) + 1
+            self.attempts_used[recharge_code] = number
+            metrics = {'attempt': number}
+
+            # Capture (new image, or same image with the next candidate)
+            capture = capture_captcha(self.bot.driver)
+            new_hash = hashlib.sha1(capture['image']).hexdigest()
+            metrics['capture_method'] = capture['method']
+            metrics['capture_ms'] = capture['elapsed_ms']
+
+            overlapped = None
+            if new_hash != image_hash or not candidates:
+                if new_hash == image_hash and self._refresh_captcha(image_hash):
+                    capture = capture_captcha(self.bot.driver)
+                    new_hash = hashlib.sha1(capture['image']).hexdigest()
+                    metrics['refreshed'] = True
+
+                if not form_submitted:
+                    # First submit: solve on a worker thread while
+                    # submit_recharge() fills the phone and code fields
+                    overlapped = BackgroundSolve(self._solve, capture['image'])
+                    candidates = []
+                else:
+                    start = time.perf_counter()
+                    candidates = self._solve(capture['image'])
+                    metrics['solve_ms'] = round((time.perf_counter() - start) * 1000, 2)
+                metrics['candidate_rank'] = 0
+            else:
+                metrics['solve_ms'] = 0.0
+                metrics['candidate_rank'] = attempts[-1]['candidate_rank'] + 1
+
+            image_hash = new_hash
+
+            start = time.perf_counter()
+            if overlapped is not None:
+                try:
+                    response = self.bot.submit_recharge(phone_number, recharge_code, captcha_text=overlapped)
+                    form_submitted = True
+                except CaptchaUnsolved:
+                    pass
+                candidates = overlapped.result()
+                metrics.update(overlapped.timing())
+                guess = candidates.pop(0) if form_submitted else None
+            elif candidates:
+                guess = candidates.pop(0)
+                if not form_submitted:
+                    response = self.bot.submit_recharge(phone_number, recharge_code, captcha_text=guess)
+                    form_submitted = True
+                else:
+                    response = self._resubmit(recharge_code, guess)
+            else:
+                guess = None
+
+            if guess is None:
+                metrics['verdict'] = 'unsolved'
+                attempts.append(metrics)
+                self._refresh_captcha(image_hash)
+                continue
+
+            metrics['guess'] = guess
+            metrics['submit_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+            verdict = classify_captcha_verdict(response)
+            metrics['verdict'] = verdict
+            attempts.append(metrics)
+
+            if self.corpus is not None:
+                self.corpus.record_attempt(capture['image'], guess, response)
+
+            if verdict != 'rejected':
+                break
+
+            print(f"   ❌ Wrong CAPTCHA (attempt {number}/{self.max_attempts}), retrying in-session...")
+
+        response['attempts'] = attempts
+        response['captcha_verdict'] = verdict
+        count_metric('recharge_outcomes_total', outcome=response['status'], detection_method='page_message', flow='voucher')
+        return response
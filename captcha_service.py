@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""
+CAPTCHA Solver Service
+One process per node owns the warm OCR models; recharge workers send it
+images over HTTP or a Unix socket instead of loading their own copy
+
+    POST /solve?solver=cnn   body: image bytes (or JSON {"image": base64, "solver": ...})
+    GET  /metrics            Prometheus text format
+    GET  /health             JSON status
+
+For solvers with a vectorised batch call (cnn), concurrent requests are
+collected for a few milliseconds and run as ONE inference call on the
+solver's worker thread; the others solve one image at a time. Each solver
+has a bounded queue: when it is full the service answers 503 with
+Retry-After instead of piling up latency. A request that times out is
+dropped from the queue, so no inference is spent on it.
+
+Clients: set CAPTCHA_SERVICE_URL (http://127.0.0.1:8090 or
+unix:///run/captcha.sock) and captcha_solvers.get_solver() routes the
+model-backed backends here.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import base64
+import socket
+import threading
+import http.client
+import socketserver
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from captcha_solvers import BATCHED_SOLVERS, SERVICE_SOLVERS, available_solvers, solve_batch
+
+DEFAULT_PORT = 8090
+
+
+class ServiceOverloaded(Exception):
+    """The solver queue is full (HTTP 503)"""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Job:
+    """One image waiting for its batch"""
+
+    __slots__ = ('image', 'enqueued', 'done', 'cancelled', 'text', 'error', 'batch_size', 'queue_ms', 'solve_ms')
+
+    def __init__(self, image):
+        self.image = image
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.cancelled = False  # set when its request gave up waiting
+        self.text = None
+        self.error = None
+        self.batch_size = 0
+        self.queue_ms = 0.0
+        self.solve_ms = 0.0
+
+
+class SolverWorker:
+    """Batching worker thread owning one solver backend"""
+
+    def __init__(self, name, max_batch=1, max_wait_ms=0, max_queue=64):
+        """
+        Args:
+            name (str): Solver backend name
+            max_batch (int): Max images per inference call (1 = no batching)
+            max_wait_ms (float): Max time the first image waits for company
+            max_queue (int): Queued images before requests are rejected
+        """
+        self.name = name
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'captcha-{name}', daemon=True)
+
+        # Updated by handler threads and the worker thread
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'rejected': 0,
+            'cancelled': 0,
+            'errors': 0,
+            'batches': 0,
+            'batched_images': 0,
+            'max_batch_seen': 0,
+            'solve_seconds': 0.0,
+            'queue_seconds': 0.0,
+        }
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats_snapshot(self):
+        """Consistent copy of the counters"""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def warm_up(self):
+        """Load the model once before the first request arrives"""
+        from captcha_corpus import generate_synthetic_captcha
+
+        _, image = generate_synthetic_captcha(seed=0)
+        solve_batch(self.name, [image])
+
+    def submit(self, image_bytes):
+        """
+        Queue an image
+
+        Returns:
+            _Job: Completed via job.done
+
+        Raises:
+            ServiceOverloaded: The queue is full
+        """
+        job = _Job(image_bytes)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['rejected'] += 1
+                # Rough time to drain the queue at the current per-image cost
+                per_image = self.stats['solve_seconds'] / max(self.stats['batched_images'], 1)
+            raise ServiceOverloaded(f"{self.name} queue full", retry_after=max(0.1, per_image * self.queue_depth))
+        with self._stats_lock:
+            self.stats['requests'] += 1
+        return job
+
+    def _collect(self):
+        """Block for the first job, then gather more until full or timed out"""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            live = [job for job in batch if not job.cancelled]
+            if len(live) < len(batch):
+                with self._stats_lock:
+                    self.stats['cancelled'] += len(batch) - len(live)
+            batch = live
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                texts = solve_batch(self.name, [job.image for job in batch])
+                errors = [None] * len(batch)
+            except Exception:
+                # Isolate the failing image(s): one call per image
+                texts, errors = [], []
+                for job in batch:
+                    try:
+                        texts.append(solve_batch(self.name, [job.image])[0])
+                        errors.append(None)
+                    except Exception as e:
+                        texts.append(None)
+                        errors.append(f"{type(e).__name__}: {e}")
+            solve_seconds = time.perf_counter() - start
+
+            with self._stats_lock:
+                self.stats['batches'] += 1
+                self.stats['batched_images'] += len(batch)
+                self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(batch))
+                self.stats['solve_seconds'] += solve_seconds
+                self.stats['queue_seconds'] += sum(start - job.enqueued for job in batch)
+                self.stats['errors'] += sum(1 for error in errors if error)
+
+            for job, text, error in zip(batch, texts, errors):
+                job.text = text
+                job.error = error
+                job.batch_size = len(batch)
+                job.queue_ms = round((start - job.enqueued) * 1000, 2)
+                job.solve_ms = round(solve_seconds * 1000, 2)
+                job.done.set()
+
+
+class _ThreadingTCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class CaptchaService:
+    """HTTP / Unix-socket front end over one SolverWorker per backend"""
+
+    def __init__(self, solvers=None, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None,
+                 max_batch=16, max_wait_ms=10, max_queue=64, timeout=30.0, warm=True):
+        """
+        Args:
+            solvers (list): Backends to serve (default: every local free one)
+            host (str): Bind address for TCP
+            port (int): TCP port (0 = any free port)
+            socket_path (str): Serve on this Unix socket instead of TCP
+            max_batch (int): Max images per inference call, for the
+                BATCHED_SOLVERS only (the others solve one image at a time)
+            max_wait_ms (float): Batching window (BATCHED_SOLVERS only)
+            max_queue (int): Per-solver queue bound (backpressure)
+            timeout (float): Max seconds a request waits for its answer
+            warm (bool): Load every model at startup
+        """
+        solvers = solvers or [name for name in available_solvers(remote=False) if name in SERVICE_SOLVERS]
+        self.workers = {
+            name: SolverWorker(name, max_queue=max_queue, **(
+                {'max_batch': max_batch, 'max_wait_ms': max_wait_ms} if name in BATCHED_SOLVERS else {}
+            ))
+            for name in solvers
+        }
+        self.default_solver = solvers[0] if solvers else None
+        self.timeout = timeout
+        self.started_at = time.time()
+        self.socket_path = socket_path
+
+        if warm:
+            for worker in self.workers.values():
+                start = time.perf_counter()
+                worker.warm_up()
+                print(f"   Warmed up {worker.name} ({(time.perf_counter() - start) * 1000:.0f}ms)")
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json', headers=None):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == '/metrics':
+                    return self._send(200, service.metrics_text().encode('utf-8'), 'text/plain; version=0.0.4')
+                if path == '/health':
+                    return self._send(200, service.health())
+                return self._send(404, {'status': 'error', 'error': 'Not found'})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                if url.path != '/solve':
+                    return self._send(404, {'status': 'error', 'error': 'Not found'})
+
+                solver = parse_qs(url.query).get('solver', [None])[0]
+                image = body
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    try:
+                        payload = json.loads(body)
+                        image = base64.b64decode(payload['image'])
+                        solver = payload.get('solver') or solver
+                    except (ValueError, KeyError, TypeError):
+                        return self._send(400, {'status': 'error', 'error': 'Expected JSON {"image": base64}'})
+                if not image:
+                    return self._send(400, {'status': 'error', 'error': 'Empty image'})
+
+                status, result, headers = service.solve(image, solver)
+                return self._send(status, result, headers=headers)
+
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self._server = _ThreadingUnixHTTPServer(socket_path, Handler)
+        else:
+            self._server = _ThreadingTCPHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        if self.socket_path:
+            return f'unix://{self.socket_path}'
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def solve(self, image_bytes, solver=None):
+        """
+        Solve one image through its solver's batch queue
+
+        Returns:
+            tuple: (http status, response dict, extra headers)
+        """
+        solver = solver or self.default_solver
+        worker = self.workers.get(solver)
+        if worker is None:
+            return 404, {'status': 'error', 'error': f'Solver not served: {solver}', 'solvers': list(self.workers)}, None
+
+        try:
+            job = worker.submit(image_bytes)
+        except ServiceOverloaded as e:
+            return 503, {'status': 'error', 'error': str(e)}, {'Retry-After': f'{e.retry_after:.2f}'}
+
+        if not job.done.wait(self.timeout):
+            # Still queued: the worker skips it instead of solving it for nobody
+            job.cancelled = True
+            return 504, {'status': 'error', 'error': f'No answer within {self.timeout}s'}, None
+        if job.error:
+            return 500, {'status': 'error', 'error': job.error}, None
+
+        return 200, {
+            'status': 'success',
+            'text': job.text,
+            'solver': solver,
+            'batch_size': job.batch_size,
+            'queue_ms': job.queue_ms,
+            'solve_ms': job.solve_ms
+        }, None
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'solvers': list(self.workers),
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'queue_depth': {name: w.queue_depth for name, w in self.workers.items()}
+        }
+
+    def metrics_text(self):
+        """Prometheus text exposition of the per-solver counters"""
+        metrics = [
+            ('captcha_service_requests_total', 'counter', 'Images accepted', 'requests'),
+            ('captcha_service_rejected_total', 'counter', 'Images rejected with 503 (queue full)', 'rejected'),
+            ('captcha_service_cancelled_total', 'counter', 'Timed-out images dropped before inference', 'cancelled'),
+            ('captcha_service_errors_total', 'counter', 'Images whose solve failed', 'errors'),
+            ('captcha_service_batches_total', 'counter', 'Inference calls', 'batches'),
+            ('captcha_service_batched_images_total', 'counter', 'Images solved in inference calls', 'batched_images'),
+            ('captcha_service_solve_seconds_total', 'counter', 'Time spent in inference calls', 'solve_seconds'),
+            ('captcha_service_queue_seconds_total', 'counter', 'Time images waited for their batch', 'queue_seconds'),
+            ('captcha_service_max_batch_size', 'gauge', 'Largest batch so far', 'max_batch_seen'),
+        ]
+        stats = {solver: worker.stats_snapshot() for solver, worker in self.workers.items()}
+        lines = []
+        for name, kind, help_text, key in metrics:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for solver in self.workers:
+                lines.append(f'{name}{{solver="{solver}"}} {stats[solver][key]}')
+        lines.append('# HELP captcha_service_queue_depth Images waiting for a batch')
+        lines.append('# TYPE captcha_service_queue_depth gauge')
+        for solver, worker in self.workers.items():
+            lines.append(f'captcha_service_queue_depth{{solver="{solver}"}} {worker.queue_depth}')
+        return '\n'.join(lines) + '\n'
+
+    def start(self):
+        """Start the solver workers and serve in a background thread"""
+        for worker in self.workers.values():
+            worker.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='captcha-service', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+        self._server.shutdown()
+        self._server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# --- Client ------------------------------------------------------------------
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix domain socket"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class CaptchaServiceClient:
+    """Thin keep-alive client for the solver service (one connection per thread)"""
+
+    def __init__(self, url=None, timeout=30.0, max_retries=2):
+        """
+        Args:
+            url (str): http://host:port or unix:///path/to.sock
+            timeout (float): Socket timeout per request
+            max_retries (int): Retries on 503 (after Retry-After) or a dropped connection
+        """
+        self.url = url or os.getenv('CAPTCHA_SERVICE_URL') or f'http://127.0.0.1:{DEFAULT_PORT}'
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            parsed = urlparse(self.url)
+            if parsed.scheme == 'unix':
+                conn = _UnixHTTPConnection(parsed.path, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(parsed.hostname, parsed.port or DEFAULT_PORT, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method, path, body=None, headers=None):
+        for attempt in range(self.max_retries + 1):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self._local.conn = None
+                if attempt >= self.max_retries:
+                    raise
+                continue
+
+            if response.status == 503 and attempt < self.max_retries:
+                time.sleep(float(response.getheader('Retry-After') or 0.5))
+                continue
+            return response.status, data
+
+    def solve(self, image_bytes, solver=None):
+        """
+        Solve one CAPTCHA image
+
+        Returns:
+            str: CAPTCHA text
+        """
+        path = f'/solve?solver={solver}' if solver else '/solve'
+        status, data = self._request('POST', path, image_bytes, {'Content-Type': 'application/octet-stream'})
+        result = json.loads(data)
+        if status != 200:
+            raise Exception(f"CAPTCHA service error {status}: {result.get('error')}")
+        return result['text']
+
+    def metrics(self):
+        return self._request('GET', '/metrics')[1].decode('utf-8')
+
+    def health(self):
+        return json.loads(self._request('GET', '/health')[1])
+
+
+_client = None
+
+
+def get_service_client():
+    """Process-wide client for CAPTCHA_SERVICE_URL"""
+    global _client
+    if _client is None:
+        _client = CaptchaServiceClient()
+    return _client
+
+
+def bench(solver, requests_count=200, concurrency=16, max_batch=16, socket_path=None):
+    """Concurrent clients against an in-process service: unbatched vs batched"""
+    from concurrent.futures import ThreadPoolExecutor
+    from captcha_corpus import generate_synthetic_captcha
+
+    images = [generate_synthetic_captcha(seed=i)[1] for i in range(requests_count)]
+    results = {}
+    for label, batch in (('single', 1), ('batched', max_batch)):
+        with CaptchaService([solver], port=0, socket_path=socket_path, max_batch=batch, warm=True) as service:
+            client = CaptchaServiceClient(service.url)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(lambda image: client.solve(image, solver), images))
+            elapsed = time.perf_counter() - start
+            stats = service.workers[solver].stats_snapshot()
+            results[label] = {
+                'elapsed_seconds': round(elapsed, 2),
+                'images_per_second': round(requests_count / elapsed, 1),
+                'inference_calls': stats['batches'],
+                'max_batch_seen': stats['max_batch_seen'],
+                'rejected': stats['rejected']
+            }
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('serve', 'bench'):
+        print("CAPTCHA Solver Service")
+        print()
+        print("Usage:")
+        print("  python captcha_service.py serve [port | unix:/path.sock] [solvers] [max_batch] [max_queue]")
+        print("  python captcha_service.py bench [solver] [requests] [concurrency]")
+        print()
+        print("Example:")
+        print("  python captcha_service.py serve unix:/run/captcha.sock cnn,easyocr")
+        print("  export CAPTCHA_SERVICE_URL=unix:///run/captcha.sock")
+        print()
+        sys.exit(1)
+
+    if sys.argv[1] == 'bench':
+        solver = sys.argv[2] if len(sys.argv) > 2 else 'cnn'
+        requests_count = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+        concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+        print(json.dumps(bench(solver, requests_count, concurrency), indent=2))
+        sys.exit(0)
+
+    target = sys.argv[2] if len(sys.argv) > 2 else str(DEFAULT_PORT)
+    solvers = sys.argv[3].split(',') if len(sys.argv) > 3 else None
+    max_batch = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+    max_queue = int(sys.argv[5]) if len(sys.argv) > 5 else 64
+
+    socket_path = target[len('unix:'):] if target.startswith('unix:') else None
+    port = DEFAULT_PORT if socket_path else int(target)
+
+    print("🧠 Loading CAPTCHA models...")
+    service = CaptchaService(solvers, port=port, socket_path=socket_path, max_batch=max_batch, max_queue=max_queue)
+    service.start()
+    print(f"✅ CAPTCHA service on {service.url} (solvers: {', '.join(service.workers)})")
+    print(f"   export CAPTCHA_SERVICE_URL={service.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        service.stop()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Ooredoo CAPTCHA Solvers
+Shared solver backends used by the recharge scripts and the benchmark tools
+
+Every solver takes the raw CAPTCHA image bytes and returns the text it read:
+
+    solver(image_bytes, preprocess=None) -> str
+
+OCR libraries are imported lazily so that a process only pays for the
+backend it actually uses.
+"""
+
+import io
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ALPHANUMERIC = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# Shared solver service (captcha_service.py), e.g. http://127.0.0.1:8090
+# or unix:///run/captcha.sock; when set, model-backed solvers run there
+SERVICE_URL = os.getenv('CAPTCHA_SERVICE_URL')
+
+# Tuned parameters per solver, written by captcha_tuner.py
+PROFILE_PATH = os.getenv('CAPTCHA_PROFILE', 'captcha_profile.json')
+
+
+def load_profile(path=PROFILE_PATH):
+    """Read the tuned solver profile ({} if missing or unreadable)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+PROFILE = load_profile()
+
+# Default preprocessing used by recharge_tesseract.py (tuned profile wins,
+# including a tuned None: the raw image scored best)
+DEFAULT_PREPROCESS = {
+    'contrast': 2.0,
+    'threshold': 128,
+    'median_size': 3,
+}
+if 'preprocess' in PROFILE.get('tesseract', {}):
+    DEFAULT_PREPROCESS = PROFILE['tesseract']['preprocess']
+
+DEFAULT_TESSERACT_CONFIG = (PROFILE.get('tesseract', {}).get('tesseract_config')
+                            or f'--oem 3 --psm 7 -c tessedit_char_whitelist={ALPHANUMERIC}')
+
+VISION_PROMPT = "Read the text shown in this CAPTCHA image. Return ONLY the characters you see, no explanation, no quotes, just the text."
+
+_easyocr_reader = None
+_background_pool = None
+_background_lock = threading.Lock()
+
+
+class CaptchaUnsolved(Exception):
+    """The solver returned no text for the CAPTCHA"""
+
+
+def clean_captcha_text(text):
+    """Strip whitespace and newlines that OCR engines insert between glyphs"""
+    return text.strip().replace(' ', '').replace('\n', '')
+
+
+def preprocess_captcha(image_bytes, contrast=2.0, threshold=128, median_size=3):
+    """
+    Preprocess CAPTCHA image for better OCR accuracy
+
+    Args:
+        image_bytes (bytes): Raw CAPTCHA image (PNG/JPEG)
+        contrast (float): Contrast enhancement factor
+        threshold (int): Binarization threshold (0-255)
+        median_size (int): Median filter size, 0 to disable
+
+    Returns:
+        PIL.Image: Preprocessed grayscale image
+    """
+    from PIL import Image, ImageFilter, ImageEnhance
+
+    img = Image.open(io.BytesIO(image_bytes))
+
+    # Convert to grayscale
+    img = img.convert('L')
+
+    # Increase contrast
+    if contrast and contrast != 1.0:
+        img = ImageEnhance.Contrast(img).enhance(contrast)
+
+    # Apply threshold (binarization)
+    if threshold is not None:
+        img = img.point(lambda p: p > threshold and 255)
+
+    # Slight noise reduction
+    if median_size:
+        img = img.filter(ImageFilter.MedianFilter(size=median_size))
+
+    return img
+
+
+def _image_to_png(img):
+    """Encode a PIL image as PNG bytes"""
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _prepare(image_bytes, preprocess):
+    """Apply optional preprocessing and return PNG bytes"""
+    if preprocess is None:
+        return image_bytes
+    return _image_to_png(preprocess_captcha(image_bytes, **preprocess))
+
+
+def get_easyocr_reader():
+    """Load the EasyOCR reader once per process"""
+    global _easyocr_reader
+    if _easyocr_reader is None:
+        import easyocr
+        _easyocr_reader = easyocr.Reader(['en'], gpu=False)  # CPU mode, no GPU needed
+    return _easyocr_reader
+
+
+def solve_easyocr(image_bytes, preprocess=None):
+    """
+    Solve CAPTCHA using FREE EasyOCR
+
+    Args:
+        image_bytes (bytes): Raw CAPTCHA image
+        preprocess (dict): Optional preprocess_captcha() parameters
+
+    Returns:
+        str: CAPTCHA text (empty if nothing was read)
+    """
+    result = get_easyocr_reader().readtext(_prepare(image_bytes, preprocess), detail=0)
+    return clean_captcha_text(''.join(result))
+
+
+def solve_tesseract(image_bytes, preprocess=DEFAULT_PREPROCESS, config=DEFAULT_TESSERACT_CONFIG):
+    """
+    Solve CAPTCHA using FREE Tesseract OCR
+
+    Args:
+        image_bytes (bytes): Raw CAPTCHA image
+        preprocess (dict): preprocess_captcha() parameters, None for the raw image
+        config (str): Tesseract command line config
+
+    Returns:
+        str: CAPTCHA text (empty if nothing was read)
+    """
+    import pytesseract
+    from PIL import Image
+
+    if preprocess is None:
+        img = Image.open(io.BytesIO(image_bytes))
+    else:
+        img = preprocess_captcha(image_bytes, **preprocess)
+
+    return clean_captcha_text(pytesseract.image_to_string(img, config=config))
+
+
+def solve_vision(image_bytes, preprocess=None, api_key=None):
+    """
+    Solve CAPTCHA using OpenAI Vision API
+
+    Requests go through the shared pooled client in vision_client.py
+    (keep-alive, timeout budget, retries, concurrency limit).
+
+    Args:
+        image_bytes (bytes): Raw CAPTCHA image
+        preprocess (dict): Optional preprocess_captcha() parameters
+        api_key (str): OpenAI API key (defaults to OPENAI_API_KEY)
+
+    Returns:
+        str: CAPTCHA text
+    """
+    from vision_client import solve_captcha_sync
+
+    return solve_captcha_sync(_prepare(image_bytes, preprocess), api_key=api_key)
+
+
+def solve_template(image_bytes, preprocess=None):
+    """
+    Solve CAPTCHA with the fast template matcher (captcha_template.py)
+
+    Needs a template bank trained from a labeled corpus
+    (CAPTCHA_TEMPLATE_BANK, default captcha_templates.npz).
+    """
+    from captcha_template import solve_template as template_solve
+
+    return template_solve(image_bytes, preprocess=preprocess)
+
+
+def solve_cnn(image_bytes, preprocess=None):
+    """
+    Solve CAPTCHA with the compact CNN/CTC model (captcha_model.py)
+
+    Needs a model trained from a labeled corpus
+    (CAPTCHA_MODEL, default captcha_model.pt).
+    """
+    from captcha_model import solve_cnn as model_solve
+
+    return model_solve(image_bytes, preprocess=preprocess)
+
+
+# Registered solver backends, by name
+SOLVERS = {
+    'easyocr': solve_easyocr,
+    'tesseract': solve_tesseract,
+    'vision': solve_vision,
+    'template': solve_template,
+    'cnn': solve_cnn,
+}
+
+# Backends that cost money per call; the benchmark only runs them on request
+PAID_SOLVERS = {'vision'}
+
+# Backends that hold a model in memory and can be served by captcha_service.py
+SERVICE_SOLVERS = {'easyocr', 'tesseract', 'template', 'cnn'}
+
+# Backends whose solve_batch() is one vectorised inference call; for the
+# others it loops over the images, so waiting to fill a batch only adds delay
+BATCHED_SOLVERS = {'cnn'}
+
+
+def solve_remote(image_bytes, preprocess=None, solver='easyocr'):
+    """
+    Solve CAPTCHA through the shared solver service (CAPTCHA_SERVICE_URL)
+
+    Preprocessing runs locally; the service only sees the final image.
+    """
+    from captcha_service import get_service_client
+
+    return get_service_client().solve(_prepare(image_bytes, preprocess), solver=solver)
+
+
+def get_solver(name, remote=None):
+    """
+    Look up a solver backend by name
+
+    Args:
+        name (str): Backend name
+        remote (bool): Route through the solver service (default: when
+            CAPTCHA_SERVICE_URL is set and the backend is model-backed)
+    """
+    if name not in SOLVERS:
+        raise ValueError(f"Unknown CAPTCHA solver: {name} (available: {', '.join(sorted(SOLVERS))})")
+    if remote is None:
+        remote = bool(SERVICE_URL)
+    if remote and name in SERVICE_SOLVERS:
+        return lambda image_bytes, preprocess=None: solve_remote(image_bytes, preprocess, solver=name)
+    return SOLVERS[name]
+
+
+def solve_batch(name, images, preprocess=None):
+    """
+    Solve several CAPTCHAs with one local backend, in one inference call
+    for the BATCHED_SOLVERS (cnn) and one call per image otherwise
+
+    Returns:
+        list: CAPTCHA texts, in input order
+    """
+    images = [_prepare(image, preprocess) for image in images]
+    if name == 'cnn':
+        from captcha_model import get_captcha_model
+        return get_captcha_model().predict_batch(images)
+    solver = get_solver(name, remote=False)
+    return [solver(image, preprocess=None) for image in images]
+
+
+def available_solvers(include_paid=False, remote=None):
+    """Names of solver backends whose libraries are importable here
+    (or that the solver service provides, see get_solver())"""
+    modules = {'easyocr': 'easyocr', 'tesseract': 'pytesseract', 'vision': 'aiohttp', 'template': 'numpy', 'cnn': 'torch'}
+    models = {
+        'template': os.getenv('CAPTCHA_TEMPLATE_BANK', 'captcha_templates.npz'),
+        'cnn': os.getenv('CAPTCHA_MODEL', 'captcha_model.pt'),
+    }
+    names = []
+    for name in SOLVERS:
+        if name in PAID_SOLVERS and not include_paid:
+            continue
+        if (SERVICE_URL if remote is None else remote) and name in SERVICE_SOLVERS:
+            # Models live in the solver service, not in this process
+            names.append(name)
+            continue
+        if name in models and not os.path.exists(models[name]):
+            continue
+        module = modules.get(name)
+        if module:
+            try:
+                __import__(module)
+            except ImportError:
+                continue
+        names.append(name)
+    return names
+
+
+def configured_solvers(default):
+    """
+    Solver names for the free scripts: CAPTCHA_SOLVERS (comma-separated,
+    e.g. "cnn,easyocr") overrides the script's own default backends
+    """
+    names = [name.strip() for name in os.getenv('CAPTCHA_SOLVERS', '').split(',') if name.strip()]
+    for name in names:
+        get_solver(name)
+    return tuple(names) or tuple(default)
+
+
+def tuned_variants(solver_name):
+    """Preprocessing variants for a solver: its tuned profile first, then raw"""
+    if 'preprocess' in PROFILE.get(solver_name, {}):
+        preprocess = PROFILE[solver_name].get('preprocess')
+        return (preprocess,) if preprocess is None else (preprocess, None)
+    return (None,) if DEFAULT_PREPROCESS is None else (None, DEFAULT_PREPROCESS)
+
+
+def solve_candidates(image_bytes, solvers=('easyocr',), variants=None):
+    """
+    Ensemble solve: run several solver/preprocessing combinations and rank
+    the distinct answers by how many combinations agreed on them
+
+    Args:
+        image_bytes (bytes): Raw CAPTCHA image
+        solvers (tuple): Solver names (or callables) to run
+        variants (tuple): preprocess_captcha() parameter dicts (None = raw);
+            default: tuned_variants() of each solver
+
+    Returns:
+        list: Candidate texts, best first (may be empty)
+    """
+    votes = {}
+    order = []
+    for solver in solvers:
+        solve = get_solver(solver) if isinstance(solver, str) else solver
+        solver_variants = variants
+        if solver_variants is None:
+            solver_variants = tuned_variants(solver) if isinstance(solver, str) else (None, DEFAULT_PREPROCESS)
+        for preprocess in solver_variants:
+            try:
+                text = solve(image_bytes, preprocess=preprocess)
+            except Exception:
+                continue
+            if not text:
+                continue
+            if text not in votes:
+                order.append(text)
+            votes[text] = votes.get(text, 0) + 1
+
+    # Stable sort: ties keep the order of the first (preferred) backend
+    return sorted(order, key=lambda text: -votes[text])
+
+
+class BackgroundSolve:
+    """
+    A CAPTCHA solve running on a worker thread while the caller keeps using
+    the browser (the worker never touches the driver, only image bytes)
+
+        task = BackgroundSolve(solver, image_bytes)
+        ...fill the rest of the form...
+        text = task.result()
+        task.timing()  # solve_ms, wait_ms, hidden_ms
+    """
+
+    def __init__(self, solver, image_bytes):
+        """
+        Args:
+            solver (callable): image_bytes -> str (or candidate list)
+            image_bytes (bytes): Captured CAPTCHA image
+        """
+        global _background_pool
+        with _background_lock:
+            if _background_pool is None:
+                _background_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='captcha-solve')
+        self.image = image_bytes
+        self.solve_ms = None
+        self.wait_ms = None
+        self._future = _background_pool.submit(self._run, solver, image_bytes)
+
+    def _run(self, solver, image_bytes):
+        start = time.perf_counter()
+        try:
+            return solver(image_bytes)
+        finally:
+            self.solve_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def result(self, timeout=None):
+        """Block until the solver finishes (re-raises its exception)"""
+        start = time.perf_counter()
+        try:
+            return self._future.result(timeout)
+        finally:
+            if self.wait_ms is None:
+                # Only the first join (the one the form waited on) counts
+                self.wait_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def timing(self):
+        """Solve time, time the caller blocked on it, and the difference that
+        overlapped with other work"""
+        hidden = None
+        if self.solve_ms is not None and self.wait_ms is not None:
+            hidden = round(max(0.0, self.solve_ms - self.wait_ms), 2)
+        return {'solve_ms': self.solve_ms, 'wait_ms': self.wait_ms, 'hidden_ms': hidden}
+
+
+def join_captcha(captcha_text):
+    """
+    Resolve a submit_recharge() captcha_text argument
+
+    Args:
+        captcha_text (str | BackgroundSolve): Text, or a running solve
+            (whose result may be a text or a ranked candidate list)
+
+    Returns:
+        tuple: (text, timing dict or None)
+
+    Raises:
+        CaptchaUnsolved: The solve produced no text
+    """
+    if not isinstance(captcha_text, BackgroundSolve):
+        return captcha_text, None
+
+    result = captcha_text.result()
+    if isinstance(result, (list, tuple)):
+        result = result[0] if result else None
+    if not result:
+        raise CaptchaUnsolved("Could not read CAPTCHA text")
+    return result, captcha_text.timing()
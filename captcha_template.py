@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Template-Matching CAPTCHA Recognizer
+Lightweight solver for the portal's fixed-font lowercase alphanumeric CAPTCHA
+
+    1. Binarize (Otsu threshold)
+    2. Segment glyphs: connected components (run-length union-find),
+       noise removal, merging of stacked parts (i, j dots) and splitting of
+       touching glyphs at vertical projection-profile minima
+    3. Normalize every glyph to a fixed-size zero-mean unit vector
+    4. Classify all glyphs at once against the learned template bank with
+       one matrix product (normalized cross-correlation)
+
+The template bank is learned from a labeled corpus (captcha_corpus.py),
+minus a held-out share of it that eval then scores:
+    python captcha_template.py train captcha_corpus captcha_templates.npz
+    python captcha_template.py eval  captcha_corpus captcha_templates.npz
+"""
+
+import io
+import os
+import sys
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+GLYPH_SIZE = (16, 20)  # width, height of a normalized glyph
+MIN_GLYPH_AREA = 6
+DEFAULT_BANK_PATH = 'captcha_templates.npz'
+DEFAULT_LENGTH = 6
+
+# Share of the corpus kept out of training for eval (split by image hash)
+HOLDOUT_FRACTION = 0.2
+
+_bank_cache = {}
+
+
+def binarize(image_bytes, threshold=None):
+    """
+    Load an image and return a boolean ink mask (True = text pixel)
+
+    Args:
+        image_bytes (bytes): Raw CAPTCHA image
+        threshold (int): Fixed threshold, Otsu if None
+    """
+    gray = np.asarray(Image.open(io.BytesIO(image_bytes)).convert('L'), dtype=np.uint8)
+
+    if threshold is None:
+        hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+        weights = np.arange(256)
+        w0 = np.cumsum(hist)
+        w1 = w0[-1] - w0
+        m0 = np.cumsum(hist * weights)
+        mean0 = m0 / np.maximum(w0, 1)
+        mean1 = (m0[-1] - m0) / np.maximum(w1, 1)
+        threshold = int(np.argmax(w0 * w1 * (mean0 - mean1) ** 2))
+
+    mask = gray <= threshold
+    # Text is the minority class; invert light-on-dark images
+    if mask.mean() > 0.5:
+        mask = ~mask
+    return remove_thin_strokes(mask)
+
+
+def remove_thin_strokes(mask):
+    """
+    Morphological opening with a 2x2 element: erases 1px noise lines and
+    specks while keeping the thicker glyph strokes
+    """
+    eroded = mask.copy()
+    eroded[:-1, :] &= mask[1:, :]
+    eroded[:, :-1] &= mask[:, 1:]
+    eroded[:-1, :-1] &= mask[1:, 1:]
+    eroded[-1, :] = False
+    eroded[:, -1] = False
+
+    opened = eroded.copy()
+    opened[1:, :] |= eroded[:-1, :]
+    opened[:, 1:] |= eroded[:, :-1]
+    opened[1:, 1:] |= eroded[:-1, :-1]
+    return opened
+
+
+def _label_components(mask):
+    """
+    8-connected component labeling over horizontal runs
+
+    Returns:
+        list: [(x0, y0, x1, y1, area), ...] bounding boxes (exclusive end)
+    """
+    parent = []
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    runs = []  # (row, start, end, run_id)
+    previous = []
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+
+    for row in range(mask.shape[0]):
+        starts = np.flatnonzero(edges[row] == 1)
+        ends = np.flatnonzero(edges[row] == -1)
+        current = []
+        for start, end in zip(starts, ends):
+            run_id = len(parent)
+            parent.append(run_id)
+            for p_start, p_end, p_id in previous:
+                if p_start <= end and start <= p_end:  # 8-connectivity overlap
+                    a, b = find(run_id), find(p_id)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+            current.append((start, end, run_id))
+            runs.append((row, start, end, run_id))
+        previous = current
+
+    boxes = {}
+    for row, start, end, run_id in runs:
+        root = find(run_id)
+        box = boxes.get(root)
+        if box is None:
+            boxes[root] = [start, row, end, row + 1, end - start]
+        else:
+            box[0] = min(box[0], start)
+            box[2] = max(box[2], end)
+            box[3] = row + 1
+            box[4] += end - start
+    return [tuple(box) for box in boxes.values()]
+
+
+def _split_wide(mask, box, parts):
+    """Split a box of touching glyphs at vertical projection minima"""
+    x0, y0, x1, y1, _ = box
+    profile = mask[y0:y1, x0:x1].sum(axis=0)
+    width = x1 - x0
+    cuts = []
+    for k in range(1, parts):
+        center = int(round(width * k / parts))
+        window = max(1, width // (parts * 3))
+        lo, hi = max(1, center - window), min(width - 1, center + window + 1)
+        cuts.append(lo + int(np.argmin(profile[lo:hi])))
+    bounds = [0] + cuts + [width]
+    pieces = []
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        if b > a:
+            sub = mask[y0:y1, x0 + a:x0 + b]
+            rows = np.flatnonzero(sub.any(axis=1))
+            if rows.size:
+                pieces.append((x0 + a, y0 + rows[0], x0 + b, y0 + rows[-1] + 1, int(sub.sum())))
+    return pieces
+
+
+def segment_glyphs(mask, expected_length=None):
+    """
+    Split an ink mask into per-character boxes, left to right
+
+    Args:
+        mask (np.ndarray): Boolean ink mask
+        expected_length (int): Known CAPTCHA length, used to split/merge
+
+    Returns:
+        list: Glyph boxes (x0, y0, x1, y1, area)
+    """
+    boxes = [b for b in _label_components(mask) if b[4] >= MIN_GLYPH_AREA]
+    boxes.sort(key=lambda b: b[0])
+
+    # Merge parts that overlap horizontally (dots of i/j, broken strokes)
+    merged = []
+    for box in boxes:
+        if merged:
+            last = merged[-1]
+            overlap = min(last[2], box[2]) - max(last[0], box[0])
+            if overlap >= 0.6 * min(last[2] - last[0], box[2] - box[0]):
+                merged[-1] = (min(last[0], box[0]), min(last[1], box[1]), max(last[2], box[2]),
+                              max(last[3], box[3]), last[4] + box[4])
+                continue
+        merged.append(box)
+
+    # Drop the faintest blobs if there are too many (noise lines, specks)
+    if expected_length and len(merged) > expected_length:
+        keep = sorted(sorted(merged, key=lambda b: -b[4])[:expected_length], key=lambda b: b[0])
+        merged = keep
+
+    # Split the widest boxes while there are too few
+    if expected_length:
+        while len(merged) < expected_length:
+            widest = max(range(len(merged)), key=lambda i: merged[i][2] - merged[i][0])
+            box = merged[widest]
+            if box[2] - box[0] < 4:
+                break
+            median_width = np.median([b[2] - b[0] for b in merged])
+            parts = max(2, min(expected_length - len(merged) + 1, int(round((box[2] - box[0]) / max(median_width, 1)))))
+            pieces = _split_wide(mask, box, parts)
+            if len(pieces) < 2:
+                break
+            merged[widest:widest + 1] = pieces
+
+    return merged
+
+
+def glyph_vectors(mask, boxes):
+    """
+    Normalize glyph crops into an (N, D) matrix of zero-mean unit vectors
+    """
+    width, height = GLYPH_SIZE
+    vectors = np.zeros((len(boxes), width * height), dtype=np.float32)
+    for i, (x0, y0, x1, y1, _) in enumerate(boxes):
+        crop = Image.fromarray((mask[y0:y1, x0:x1] * 255).astype(np.uint8))
+        # Keep aspect ratio: pad to the glyph box aspect before resizing
+        scale = min(width / max(crop.width, 1), height / max(crop.height, 1))
+        resized = crop.resize((max(1, int(crop.width * scale)), max(1, int(crop.height * scale))), Image.BILINEAR)
+        canvas = Image.new('L', GLYPH_SIZE, 0)
+        canvas.paste(resized, ((width - resized.width) // 2, (height - resized.height) // 2))
+        vec = np.asarray(canvas, dtype=np.float32).ravel()
+        vec -= vec.mean()
+        norm = np.linalg.norm(vec)
+        vectors[i] = vec / norm if norm else vec
+    return vectors
+
+
+class TemplateBank:
+    """Per-character glyph templates for vectorized correlation matching"""
+
+    def __init__(self, chars=None, templates=None, length=DEFAULT_LENGTH):
+        """
+        Args:
+            chars (list): Character of each template row
+            templates (np.ndarray): (K, D) unit template vectors
+            length (int): Typical CAPTCHA length (segmentation hint)
+        """
+        self.chars = list(chars or [])
+        self.templates = templates if templates is not None else np.zeros((0, GLYPH_SIZE[0] * GLYPH_SIZE[1]), np.float32)
+        self.length = length
+
+    @classmethod
+    def train(cls, samples, length=None):
+        """
+        Learn templates from labeled images
+
+        Args:
+            samples (iterable): (image_bytes, label) pairs
+            length (int): CAPTCHA length (default: most common label length)
+
+        Returns:
+            tuple: (TemplateBank, stats dict)
+        """
+        samples = list(samples)
+        if length is None:
+            lengths = [len(label) for _, label in samples]
+            length = max(set(lengths), key=lengths.count) if lengths else DEFAULT_LENGTH
+
+        sums = {}
+        counts = {}
+        used = skipped = 0
+        for image_bytes, label in samples:
+            label = label.lower()
+            mask = binarize(image_bytes)
+            boxes = segment_glyphs(mask, expected_length=len(label))
+            if len(boxes) != len(label):
+                skipped += 1
+                continue
+            used += 1
+            for char, vec in zip(label, glyph_vectors(mask, boxes)):
+                sums[char] = sums.get(char, 0) + vec
+                counts[char] = counts.get(char, 0) + 1
+
+        chars = sorted(sums)
+        templates = np.zeros((len(chars), GLYPH_SIZE[0] * GLYPH_SIZE[1]), dtype=np.float32)
+        for i, char in enumerate(chars):
+            mean = sums[char] / counts[char]
+            mean = mean - mean.mean()
+            norm = np.linalg.norm(mean)
+            templates[i] = mean / norm if norm else mean
+
+        stats = {'images_used': used, 'images_skipped': skipped, 'chars': len(chars), 'length': length}
+        return cls(chars, templates, length), stats
+
+    def save(self, path=DEFAULT_BANK_PATH):
+        np.savez_compressed(path, templates=self.templates, chars=np.array(self.chars), length=self.length)
+
+    @classmethod
+    def load(cls, path=DEFAULT_BANK_PATH):
+        data = np.load(path)
+        return cls([str(c) for c in data['chars']], data['templates'], int(data['length']))
+
+    def recognize(self, image_bytes, expected_length=None):
+        """
+        Read a CAPTCHA image
+
+        Returns:
+            tuple: (text, per-glyph correlation scores)
+        """
+        if not self.chars:
+            raise ValueError("Template bank is empty - train it first")
+        mask = binarize(image_bytes)
+        boxes = segment_glyphs(mask, expected_length=expected_length or self.length)
+        if not boxes:
+            return '', []
+        scores = glyph_vectors(mask, boxes) @ self.templates.T
+        best = scores.argmax(axis=1)
+        text = ''.join(self.chars[i] for i in best)
+        return text, scores[np.arange(len(best)), best].tolist()
+
+
+def get_template_bank(path=None):
+    """Load (and cache) the template bank used by solve_template()"""
+    path = path or os.getenv('CAPTCHA_TEMPLATE_BANK', DEFAULT_BANK_PATH)
+    if path not in _bank_cache:
+        _bank_cache[path] = TemplateBank.load(path)
+    return _bank_cache[path]
+
+
+def solve_template(image_bytes, preprocess=None):
+    """
+    Solve CAPTCHA with the template matcher (solver interface)
+
+    Args:
+        image_bytes (bytes): Raw CAPTCHA image
+        preprocess (dict): Optional preprocess_captcha() parameters
+
+    Returns:
+        str: CAPTCHA text
+    """
+    if preprocess is not None:
+        from captcha_solvers import _prepare
+        image_bytes = _prepare(image_bytes, preprocess)
+    text, _ = get_template_bank().recognize(image_bytes)
+    return text
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('train', 'eval'):
+        print("Template-Matching CAPTCHA Recognizer")
+        print()
+        print("Usage:")
+        print("  python captcha_template.py train [corpus_dir] [bank_path]")
+        print("  python captcha_template.py eval  [corpus_dir] [bank_path]")
+        print()
+        print(f"train skips a held-out {HOLDOUT_FRACTION:.0%} of the corpus (by image hash); eval scores only that part.")
+        print()
+        sys.exit(1)
+
+    from captcha_corpus import CaptchaCorpus, split_samples
+
+    corpus = CaptchaCorpus(sys.argv[2] if len(sys.argv) > 2 else 'captcha_corpus')
+    bank_path = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_BANK_PATH
+    train_samples, samples = split_samples(
+        [(image, record['label']) for record, image in corpus.labeled()], HOLDOUT_FRACTION
+    )
+
+    if sys.argv[1] == 'train':
+        bank, stats = TemplateBank.train(train_samples)
+        stats['images_held_out'] = len(samples)
+        bank.save(bank_path)
+        print(f"✅ Template bank saved to {bank_path}")
+        print(json.dumps(stats, indent=2))
+    else:
+        bank = TemplateBank.load(bank_path)
+        correct = 0
+        latencies = []
+        for image, label in samples:
+            start = time.perf_counter()
+            text, _ = bank.recognize(image)
+            latencies.append(time.perf_counter() - start)
+            correct += text == label.lower()
+        latencies.sort()
+        print(json.dumps({
+            'images': len(samples),
+            'held_out': True,
+            'accuracy': round(correct / max(len(samples), 1), 4),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+            'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None
+        }, indent=2))
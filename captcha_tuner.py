@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+CAPTCHA Preprocessing Auto-Tuner
+Grid-searches preprocessing (and Tesseract) parameters over a labeled corpus
+on a process pool and saves the best setting as a solver profile
+
+    python captcha_tuner.py tune  captcha_corpus tesseract
+    python captcha_tuner.py drift captcha_corpus tesseract --retune
+
+The profile (captcha_profile.json, or CAPTCHA_PROFILE) is read by
+captcha_solvers.py at import, so every script picks up the tuned values on
+its next start. `drift` re-checks the profile against the newest labeled
+images and the live CAPTCHA rejection rate and re-tunes when either slips.
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from captcha_corpus import CaptchaCorpus
+from captcha_solvers import ALPHANUMERIC, PROFILE_PATH, get_solver, load_profile, solve_tesseract
+
+# Preprocessing search space (None entries disable the step)
+PREPROCESS_GRID = {
+    'contrast': [1.0, 1.5, 2.0, 3.0],
+    'threshold': [None, 100, 128, 160],
+    'median_size': [0, 3],
+}
+
+# Tesseract page segmentation modes and character whitelists to try
+TESSERACT_PSM = [7, 8, 13]
+TESSERACT_WHITELISTS = {
+    'alnum': ALPHANUMERIC,
+    'lower': 'abcdefghijklmnopqrstuvwxyz0123456789',
+}
+
+# Per-process cache of the corpus images (filled by the pool initializer)
+_worker_samples = []
+
+
+def tesseract_config(psm, whitelist):
+    """Build a Tesseract command line config"""
+    return f'--oem 3 --psm {psm} -c tessedit_char_whitelist={whitelist}'
+
+
+def build_grid(solver_name):
+    """
+    All parameter combinations to evaluate for a solver
+
+    Returns:
+        list: {'preprocess': dict or None, 'tesseract_config': str or None}
+    """
+    keys = list(PREPROCESS_GRID)
+    preprocess_options = [None] + [
+        dict(zip(keys, values)) for values in itertools.product(*(PREPROCESS_GRID[k] for k in keys))
+    ]
+
+    configs = [None]
+    if solver_name == 'tesseract':
+        configs = [tesseract_config(psm, chars) for psm in TESSERACT_PSM for chars in TESSERACT_WHITELISTS.values()]
+
+    return [
+        {'preprocess': preprocess, 'tesseract_config': config}
+        for preprocess in preprocess_options
+        for config in configs
+    ]
+
+
+def _init_worker(corpus_path, record_ids):
+    """Pool initializer: load the sample images once per worker"""
+    global _worker_samples
+    corpus = CaptchaCorpus(corpus_path)
+    wanted = set(record_ids)
+    _worker_samples = [(image, record['label']) for record, image in corpus.labeled() if record['id'] in wanted]
+
+
+def evaluate_params(solver_name, params, samples=None):
+    """
+    Accuracy and latency of one parameter set
+
+    Args:
+        solver_name (str): Solver backend
+        params (dict): Entry of build_grid()
+        samples (list): (image_bytes, label) pairs (default: worker cache)
+
+    Returns:
+        dict: params plus accuracy, p50_ms, mean_ms
+    """
+    samples = _worker_samples if samples is None else samples
+    solver = get_solver(solver_name)
+    if params.get('tesseract_config'):
+        solver = lambda image, preprocess: solve_tesseract(image, preprocess, config=params['tesseract_config'])
+
+    # Warm up so model loading is not counted as latency
+    if samples:
+        try:
+            solver(samples[0][0], preprocess=params['preprocess'])
+        except Exception:
+            pass
+
+    correct = 0
+    latencies = []
+    for image_bytes, label in samples:
+        start = time.perf_counter()
+        try:
+            text = solver(image_bytes, preprocess=params['preprocess'])
+        except Exception:
+            text = None
+        latencies.append(time.perf_counter() - start)
+        if text and text.lower() == label.lower():
+            correct += 1
+
+    latencies.sort()
+    return dict(
+        params,
+        accuracy=round(correct / max(len(samples), 1), 4),
+        p50_ms=round(latencies[len(latencies) // 2] * 1000, 2) if latencies else 0.0,
+        mean_ms=round(sum(latencies) * 1000 / max(len(latencies), 1), 2)
+    )
+
+
+def pareto_front(results):
+    """Results not beaten on both accuracy and p50 latency, fastest first"""
+    front = []
+    best_accuracy = -1.0
+    for result in sorted(results, key=lambda r: (r['p50_ms'], -r['accuracy'])):
+        if result['accuracy'] > best_accuracy:
+            front.append(result)
+            best_accuracy = result['accuracy']
+    return front
+
+
+def choose_profile(front, max_p50_ms=None):
+    """Most accurate point on the front, optionally under a latency budget"""
+    candidates = [r for r in front if max_p50_ms is None or r['p50_ms'] <= max_p50_ms] or front[:1]
+    return max(candidates, key=lambda r: (r['accuracy'], -r['p50_ms']))
+
+
+def tune(corpus_path='captcha_corpus', solver_name='tesseract', workers=None, limit=None, max_p50_ms=None):
+    """
+    Grid-search one solver's parameters over the labeled corpus
+
+    Args:
+        corpus_path (str): Corpus directory
+        solver_name (str): Solver backend to tune
+        workers (int): Worker processes (default: all cores)
+        limit (int): Only use the newest N labeled images
+        max_p50_ms (float): Latency budget for the chosen profile
+
+    Returns:
+        dict: {'chosen', 'front', 'evaluated', 'samples', 'seconds'}
+    """
+    get_solver(solver_name)
+    corpus = CaptchaCorpus(corpus_path)
+    record_ids = [r['id'] for r in corpus.records(labeled_only=True)]
+    if limit:
+        record_ids = record_ids[-limit:]
+    if not record_ids:
+        raise ValueError(f"No labeled CAPTCHAs in {corpus_path}")
+
+    grid = build_grid(solver_name)
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(corpus_path, record_ids)) as pool:
+        results = list(pool.map(evaluate_params, itertools.repeat(solver_name), grid, chunksize=4))
+    elapsed = time.perf_counter() - start
+
+    front = pareto_front(results)
+    return {
+        'chosen': choose_profile(front, max_p50_ms),
+        'front': front,
+        'evaluated': len(results),
+        'samples': len(record_ids),
+        'seconds': round(elapsed, 1)
+    }
+
+
+def save_profile(solver_name, tuning, corpus_path, path=PROFILE_PATH):
+    """
+    Store the chosen parameters for a solver in the profile file
+
+    Other solvers' entries are kept; the file is replaced atomically.
+    """
+    profile = load_profile(path)
+    chosen = tuning['chosen']
+    records = CaptchaCorpus(corpus_path).records(labeled_only=True)
+
+    profile[solver_name] = {
+        'preprocess': chosen['preprocess'],
+        'tesseract_config': chosen['tesseract_config'],
+        'accuracy': chosen['accuracy'],
+        'p50_ms': chosen['p50_ms'],
+        'samples': tuning['samples'],
+        'last_record': records[-1]['id'] if records else None,
+        'tuned_at': datetime.now().isoformat(),
+        'pareto': [
+            {k: r[k] for k in ('preprocess', 'tesseract_config', 'accuracy', 'p50_ms')}
+            for r in tuning['front']
+        ]
+    }
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+    return profile[solver_name]
+
+
+def check_drift(corpus_path='captcha_corpus', solver_name='tesseract', path=PROFILE_PATH,
+                window=200, tolerance=0.05, max_rejection_rate=0.5, min_samples=30):
+    """
+    Decide whether the CAPTCHA style has drifted away from the profile
+
+    Signals:
+        - Accuracy of the profile on labeled images newer than the tuning
+          run is more than `tolerance` below the tuned accuracy
+        - Share of live CAPTCHAs rejected by the portal since the tuning
+          run is above `max_rejection_rate`
+
+    Returns:
+        dict: {'drift': bool, 'reasons': list, ...measurements}
+    """
+    entry = load_profile(path).get(solver_name)
+    if not entry:
+        return {'drift': True, 'reasons': [f'no profile for {solver_name}']}
+
+    corpus = CaptchaCorpus(corpus_path)
+    records = corpus.records()
+    newer = [r for r in records if r.get('timestamp', '') > entry['tuned_at']]
+    report = {'drift': False, 'reasons': [], 'new_records': len(newer)}
+
+    labeled = [r for r in newer if r.get('label')][-window:]
+    if len(labeled) >= min_samples:
+        samples = [(corpus.read(r), r['label']) for r in labeled]
+        params = {'preprocess': entry['preprocess'], 'tesseract_config': entry.get('tesseract_config')}
+        recent = evaluate_params(solver_name, params, samples)
+        report['recent_accuracy'] = recent['accuracy']
+        if recent['accuracy'] < entry['accuracy'] - tolerance:
+            report['reasons'].append(
+                f"accuracy {recent['accuracy']:.1%} on {len(samples)} new images "
+                f"(tuned: {entry['accuracy']:.1%})"
+            )
+
+    live = [r for r in newer if r.get('source') == 'live' and r.get('verdict') in ('accepted', 'rejected')][-window:]
+    if len(live) >= min_samples:
+        rejection_rate = sum(r['verdict'] == 'rejected' for r in live) / len(live)
+        report['rejection_rate'] = round(rejection_rate, 4)
+        if rejection_rate > max_rejection_rate:
+            report['reasons'].append(f"live rejection rate {rejection_rate:.1%} over {len(live)} CAPTCHAs")
+
+    report['drift'] = bool(report['reasons'])
+    return report
+
+
+def print_front(tuning):
+    """Print the Pareto front as a table"""
+    print()
+    print("=" * 90)
+    print(f"{'ACCURACY':>9}{'P50 ms':>9}  PARAMETERS")
+    print("=" * 90)
+    for r in tuning['front']:
+        marker = '*' if r is tuning['chosen'] else ' '
+        config = f"  {r['tesseract_config'].split(' -c')[0]}" if r['tesseract_config'] else ''
+        print(f"{marker}{r['accuracy']:>8.1%}{r['p50_ms']:>9.2f}  {json.dumps(r['preprocess'])}{config}")
+    print("=" * 90)
+    print(f"{tuning['evaluated']} settings x {tuning['samples']} images in {tuning['seconds']}s (* = chosen)")
+    print()
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if not args or args[0] not in ('tune', 'drift'):
+        print("CAPTCHA Preprocessing Auto-Tuner")
+        print()
+        print("Usage:")
+        print("  python captcha_tuner.py tune  [corpus_dir] [solver] [workers] [limit] [max_p50_ms]")
+        print("  python captcha_tuner.py drift [corpus_dir] [solver] [limit] [--retune]")
+        print()
+        print(f"The chosen parameters are saved to {PROFILE_PATH} (CAPTCHA_PROFILE)")
+        print()
+        print("Example:")
+        print("  python captcha_tuner.py tune captcha_corpus tesseract 8")
+        print()
+        sys.exit(1)
+
+    command = args[0]
+    corpus_path = args[1] if len(args) > 1 else 'captcha_corpus'
+    solver_name = args[2] if len(args) > 2 else 'tesseract'
+
+    if command == 'drift':
+        report = check_drift(corpus_path, solver_name)
+        print(json.dumps(report, indent=2))
+        if not (report['drift'] and '--retune' in sys.argv):
+            sys.exit(0)
+        print(f"🔁 Drift detected, re-tuning {solver_name}...")
+        workers, max_p50_ms = None, None
+        limit = int(args[3]) if len(args) > 3 else None
+    else:
+        workers = int(args[3]) if len(args) > 3 else None
+        limit = int(args[4]) if len(args) > 4 else None
+        max_p50_ms = float(args[5]) if len(args) > 5 else None
+
+    print(f"🔧 Tuning {solver_name} on {corpus_path}...")
+    tuning = tune(corpus_path, solver_name, workers, limit, max_p50_ms)
+    print_front(tuning)
+    entry = save_profile(solver_name, tuning, corpus_path)
+    print(f"✅ Profile saved to {PROFILE_PATH}: {json.dumps(entry['preprocess'])} "
+          f"({entry['accuracy']:.1%}, p50 {entry['p50_ms']}ms)")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+In-Process Event Bus for Live Recharge Status
+Per-job ring buffers of stage events with cursor-based reads, feeding the
+SSE / long-poll endpoints
+
+Subscribers are only a cursor (last event ID) plus, while they wait, a
+one-shot callback: the bus holds no queue or thread per subscriber, and a
+publish costs one append plus one call per parked waiter.
+"""
+
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+
+class EventBus:
+    """Topic -> bounded event history, with one-shot waiters"""
+
+    def __init__(self, history=256, max_topics=10000):
+        """
+        Args:
+            history (int): Events kept per topic (older ones are dropped)
+            max_topics (int): Closed topics beyond this count are evicted (oldest first)
+        """
+        self.history = history
+        self.max_topics = max_topics
+        self.topics = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _topic(self, topic):
+        state = self.topics.get(topic)
+        if state is None:
+            state = self.topics[topic] = {
+                'events': deque(maxlen=self.history),
+                'next_id': 1,
+                'waiters': [],
+                'closed': False
+            }
+            self._evict()
+        return state
+
+    def publish(self, topic, event_type, data=None, close=False):
+        """
+        Append an event and wake everyone waiting on the topic
+
+        Args:
+            topic (str): Job ID
+            event_type (str): Stage name (e.g. 'logged_in', '3ds_detected')
+            data (dict): JSON-serializable payload
+            close (bool): Last event of the topic (streams end after it)
+
+        Returns:
+            dict: The published event
+        """
+        with self.lock:
+            state = self._topic(topic)
+            event = {
+                'id': state['next_id'],
+                'event': event_type,
+                'data': data or {},
+                'timestamp': datetime.now().isoformat()
+            }
+            state['next_id'] += 1
+            state['events'].append(event)
+            state['closed'] = state['closed'] or close
+            waiters, state['waiters'] = state['waiters'], []
+
+        for callback in waiters:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️  Event waiter failed: {str(e)[:80]}")
+
+        return event
+
+    def read(self, topic, after_id=0):
+        """
+        Events newer than a cursor
+
+        Args:
+            topic (str): Job ID
+            after_id (int): Last event ID the client has seen
+
+        Returns:
+            tuple: (events, closed) - closed means no more events will come
+                (always the case for a topic the bus does not hold)
+        """
+        with self.lock:
+            state = self.topics.get(topic)
+            if state is None:
+                return [], True
+            return [e for e in state['events'] if e['id'] > after_id], state['closed']
+
+    def cursor(self, topic):
+        """ID of the topic's latest event (0 if none)"""
+        with self.lock:
+            state = self.topics.get(topic)
+            return state['next_id'] - 1 if state else 0
+
+    def has_topic(self, topic):
+        """True if the bus still holds events for the topic"""
+        with self.lock:
+            return topic in self.topics
+
+    def subscribe(self, topic, after_id, callback):
+        """
+        Register a one-shot callback for the next publish on a topic
+
+        The callback runs on the publishing thread, so it must only hand off
+        (set an Event, schedule a coroutine), never block. Only topics that
+        already exist can be subscribed to: a job finished by another process
+        (or evicted here) never publishes again, so waiting on it would park
+        the client forever.
+
+        Returns:
+            bool: False if the topic is unknown or closed, or events after
+                after_id already exist (read instead)
+        """
+        with self.lock:
+            state = self.topics.get(topic)
+            if state is None or state['closed'] or (state['events'] and state['events'][-1]['id'] > after_id):
+                return False
+            state['waiters'].append(callback)
+            return True
+
+    def unsubscribe(self, topic, callback):
+        """Drop a parked callback (client gave up or disconnected)"""
+        with self.lock:
+            state = self.topics.get(topic)
+            if state and callback in state['waiters']:
+                state['waiters'].remove(callback)
+
+    def wait(self, topic, after_id=0, timeout=25):
+        """
+        Blocking read: return as soon as events after the cursor exist
+
+        Returns:
+            tuple: (events, closed) - empty events on timeout
+        """
+        woken = threading.Event()
+        deadline = time.time() + timeout
+
+        while True:
+            events, closed = self.read(topic, after_id)
+            if events or closed:
+                return events, closed
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return [], False
+
+            if self.subscribe(topic, after_id, woken.set):
+                woken.wait(remaining)
+                self.unsubscribe(topic, woken.set)
+                woken.clear()
+
+    def stats(self):
+        """Topic and parked-waiter counts"""
+        with self.lock:
+            return {
+                'topics': len(self.topics),
+                'open_topics': sum(1 for s in self.topics.values() if not s['closed']),
+                'waiters': sum(len(s['waiters']) for s in self.topics.values())
+            }
+
+    def _evict(self):
+        excess = len(self.topics) - self.max_topics
+        for topic in list(self.topics):
+            if excess <= 0:
+                break
+            if self.topics[topic]['closed']:
+                del self.topics[topic]
+                excess -= 1
+
+
+def format_sse(event):
+    """
+    Serialize an event as a Server-Sent Events frame
+
+    Returns:
+        str: 'id:', 'event:' and 'data:' lines plus the blank separator
+    """
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+Bounded Recharge Job Scheduler
+Fixed worker pool + bounded queue between the HTTP layer and RechargeAPI, so a
+traffic burst queues (or is rejected fast) instead of launching a Chrome per request
+"""
+
+import os
+import sys
+import math
+import time
+import threading
+from collections import deque
+
+
+# Resident memory of one recharge job (Chrome + chromedriver), used to size the pool
+BROWSER_MB = int(os.getenv('RECHARGE_BROWSER_MB', '400'))
+
+# Memory left for the OS and the API process itself
+RESERVED_MB = int(os.getenv('RECHARGE_RESERVED_MB', '512'))
+
+
+class SchedulerFull(Exception):
+    """Queue is full: the caller should answer 429 with Retry-After"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SchedulerClosed(Exception):
+    """Scheduler is not accepting work: the caller should answer 503"""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def available_memory_mb():
+    """
+    Memory available for new processes (MemAvailable on Linux)
+
+    Returns:
+        int: Megabytes, or None if unknown
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_workers():
+    """
+    Worker count from CPU and memory
+
+    Jobs spend most of their time waiting on the portal or the card holder,
+    so two per core is fine for CPU; memory (one browser per job) is usually
+    the real limit.
+
+    Returns:
+        int: Worker count (RECHARGE_WORKERS overrides)
+    """
+    if os.getenv('RECHARGE_WORKERS'):
+        return max(1, int(os.getenv('RECHARGE_WORKERS')))
+
+    by_cpu = (os.cpu_count() or 1) * 2
+    memory_mb = available_memory_mb()
+    if memory_mb is None:
+        return by_cpu
+
+    by_memory = (memory_mb - RESERVED_MB) // BROWSER_MB
+    return max(1, min(by_cpu, by_memory))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def parse_rate(spec, default):
+    """
+    Parse a "<per_minute>/<burst>" rate (e.g. "6/3"); "0" disables the limit
+
+    Returns:
+        tuple: (per_minute, burst) or None when disabled
+    """
+    spec = spec or default
+    per_minute, _, burst = spec.partition('/')
+    per_minute = float(per_minute)
+    if per_minute <= 0:
+        return None
+    return per_minute, float(burst or max(1.0, per_minute))
+
+
+def parse_weights(spec):
+    """Parse "account=weight,..." (ACCOUNT_WEIGHTS) into a dict"""
+    weights = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            account, weight = item.split('=', 1)
+            weights[account.strip()] = max(0.01, float(weight))
+    return weights
+
+
+# Portal throttling limits, "<jobs per minute>/<burst>" ("0" = unlimited,
+# the default); set them (e.g. ACCOUNT_RATE=6/3) once the portal's real
+# limits are known, jobs over the rate then wait in the queue
+ACCOUNT_RATE = os.getenv('ACCOUNT_RATE', '0')
+BENEFICIARY_RATE = os.getenv('BENEFICIARY_RATE', '0')
+
+# Seconds a job waits for the worker holding its account's session before
+# another worker may take it (and log in again)
+AFFINITY_WAIT = float(os.getenv('AFFINITY_WAIT', '10'))
+
+# A worker's idle session is closed after this many seconds
+SESSION_IDLE = float(os.getenv('SESSION_IDLE', '300'))
+
+# Keep per-key token buckets bounded (idle full buckets are dropped)
+MAX_BUCKETS = 10000
+
+# Queued jobs of one account inspected for a rate-limited beneficiary
+# (so one throttled number does not block the rest of the account's queue)
+ACCOUNT_SCAN = 8
+
+_worker_local = threading.local()
+
+
+def worker_state():
+    """
+    State dict of the scheduler worker running the current thread
+
+    Jobs keep per-worker resources here: 'session' (a long-lived object),
+    'account' (which account that session belongs to, used for affinity)
+    and 'cleanup' (called when the session sits idle for SESSION_IDLE).
+
+    Returns:
+        dict: Worker state, or None outside a scheduler worker
+    """
+    return getattr(_worker_local, 'state', None)
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `burst` stored"""
+
+    def __init__(self, per_minute, burst, now=None):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now if now is not None else time.time()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class JobScheduler:
+    """
+    Fixed pool of worker threads fed by per-account queues
+
+    Dequeuing is weighted-fair across accounts (start-time fair queuing:
+    each job gets a virtual finish tag of max(virtual time, account's last
+    tag) + 1/weight and the smallest eligible tag runs next), so one busy
+    account cannot starve the others. A job is eligible when its account
+    and beneficiary token buckets have a token, and (session affinity) when
+    no other worker holds its account's session, unless that holder has
+    been busy for longer than AFFINITY_WAIT.
+    """
+
+    def __init__(self, workers=None, max_queue=None, window=500, max_account_queue=None,
+                 account_rate=None, beneficiary_rate=None, weights=None, affinity_wait=None):
+        """
+        Args:
+            workers (int): Concurrent jobs (default_workers() if None)
+            max_queue (int): Queued jobs before rejecting (RECHARGE_QUEUE, else 2 x workers)
+            window (int): Recent jobs kept for queue/run time percentiles
+            max_account_queue (int): Queued jobs per account (default half of max_queue)
+            account_rate (str): Token bucket per login account (ACCOUNT_RATE)
+            beneficiary_rate (str): Token bucket per beneficiary (BENEFICIARY_RATE)
+            weights (dict): account -> fair-share weight (ACCOUNT_WEIGHTS, default 1)
+            affinity_wait (float): Seconds before a job leaves its session's worker
+        """
+        self.workers = workers or default_workers()
+        self.max_queue = max_queue or int(os.getenv('RECHARGE_QUEUE', str(self.workers * 2)))
+        self.max_account_queue = max_account_queue or max(1, self.max_queue // 2)
+        self.account_rate = parse_rate(account_rate, ACCOUNT_RATE)
+        self.beneficiary_rate = parse_rate(beneficiary_rate, BENEFICIARY_RATE)
+        self.weights = weights if weights is not None else parse_weights(os.getenv('ACCOUNT_WEIGHTS'))
+        self.affinity_wait = AFFINITY_WAIT if affinity_wait is None else affinity_wait
+        self.accepting = True
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+
+        self.queues = {}
+        self.queued = 0
+        self.virtual_time = 0.0
+        self.last_tag = {}
+        self.buckets = {}
+
+        self.queue_ms = deque(maxlen=window)
+        self.run_ms = deque(maxlen=window)
+        self.account_wait_ms = {}
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+            'running': 0,
+            'session_hits': 0,
+            'affinity_steals': 0
+        }
+
+        self.states = []
+        self.threads = []
+        for i in range(self.workers):
+            state = {'worker_id': i, 'account': None, 'session': None, 'cleanup': None,
+                     'busy': False, 'busy_since': None, 'idle_since': time.time()}
+            self.states.append(state)
+            thread = threading.Thread(target=self._worker, args=(state,), name=f'recharge-worker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, fn, *args, account=None, beneficiary=None, key=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs) without blocking
+
+        Args:
+            account (str): Login account (fair share, rate limit, affinity key)
+            beneficiary (str): Recharged number (rate limit key)
+            key (str): Handle for cancel() while the job is still queued
+
+        Raises:
+            SchedulerFull: Queue (or this account's share of it) at capacity
+            SchedulerClosed: Scheduler is shutting down
+        """
+        account = account or ''
+        full = None
+
+        with self.ready:
+            if not self.accepting:
+                raise SchedulerClosed('Scheduler is not accepting new jobs')
+
+            if self.queued >= self.max_queue:
+                full = f'Job queue full ({self.max_queue} waiting)'
+            elif len(self.queues.get(account, ())) >= self.max_account_queue:
+                full = f'Too many queued jobs for account {account} ({self.max_account_queue})'
+
+            if full:
+                self.stats['rejected'] += 1
+            else:
+                start = max(self.virtual_time, self.last_tag.get(account, 0.0))
+                tag = start + 1.0 / self.weights.get(account, 1.0)
+                self.last_tag[account] = tag
+                self.queues.setdefault(account, deque()).append({
+                    'fn': fn, 'args': args, 'kwargs': kwargs,
+                    'account': account, 'beneficiary': beneficiary, 'key': key,
+                    'queued_at': time.time(), 'start': start, 'tag': tag
+                })
+                self.queued += 1
+                self.stats['submitted'] += 1
+                self.ready.notify_all()
+
+        if full:
+            raise SchedulerFull(full, self.retry_after())
+
+    def cancel(self, key):
+        """
+        Withdraw a job that has not started yet
+
+        Returns:
+            bool: True if it was still queued (it will never run)
+        """
+        with self.ready:
+            for account, pending in self.queues.items():
+                for entry in pending:
+                    if entry['key'] == key:
+                        pending.remove(entry)
+                        self.queued -= 1
+                        if not pending:
+                            del self.queues[account]
+                        self.ready.notify_all()
+                        return True
+        return False
+
+    def retry_after(self):
+        """
+        Seconds until a queue slot is likely to free up
+
+        Returns:
+            int: Median run time / workers, at least 1
+        """
+        with self.lock:
+            p50 = percentile(list(self.run_ms), 50)
+        if p50 is None:
+            return 5
+        return max(1, int(p50 / 1000 / self.workers + 0.5))
+
+    def snapshot(self):
+        """
+        Current load and recent latency
+
+        Returns:
+            dict: Counters, queue depth, queue/run time p50/p95 in ms, and
+                per-account queue depth and wait times
+        """
+        with self.lock:
+            queue_ms = list(self.queue_ms)
+            run_ms = list(self.run_ms)
+            snapshot = dict(self.stats)
+            accounts = {
+                account or '-': {
+                    'queued': len(self.queues.get(account, ())),
+                    'dispatched': waits['dispatched'],
+                    'wait_ms_p50': percentile(list(waits['recent']), 50),
+                    'wait_ms_p95': percentile(list(waits['recent']), 95),
+                    'sessions': sum(1 for state in self.states if state['account'] == account)
+                }
+                for account, waits in self.account_wait_ms.items()
+            }
+            queued = self.queued
+
+        snapshot.update({
+            'workers': self.workers,
+            'queued': queued,
+            'max_queue': self.max_queue,
+            'accepting': self.accepting,
+            'queue_ms_p50': percentile(queue_ms, 50),
+            'queue_ms_p95': percentile(queue_ms, 95),
+            'run_ms_p50': percentile(run_ms, 50),
+            'run_ms_p95': percentile(run_ms, 95),
+            'accounts': accounts
+        })
+        return snapshot
+
+    def close(self):
+        """Stop accepting jobs (queued and running jobs still finish)"""
+        self.accepting = False
+
+    def withdraw(self):
+        """
+        Remove every queued job at once (shutdown: nothing new starts)
+
+        Returns:
+            list: Keys of the withdrawn jobs
+        """
+        with self.ready:
+            keys = [entry['key'] for pending in self.queues.values() for entry in pending]
+            self.queues.clear()
+            self.queued = 0
+            self.ready.notify_all()
+        return keys
+
+    def drain(self, timeout):
+        """
+        Wait until no job is queued or running
+
+        Returns:
+            bool: True if the pool went idle within timeout
+        """
+        deadline = time.time() + timeout
+        with self.ready:
+            while self.queued or self.stats['running']:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.ready.wait(remaining)
+        return True
+
+    def release_sessions(self):
+        """
+        Close the sessions of idle workers now instead of after SESSION_IDLE
+
+        Returns:
+            int: Sessions closed
+        """
+        with self.lock:
+            cleanups = []
+            for state in self.states:
+                if state['session'] is not None and not state['busy']:
+                    cleanups.append(state['cleanup'])
+                    state['session'] = None
+                    state['cleanup'] = None
+                    state['account'] = None
+
+        for cleanup in cleanups:
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    print(f"⚠️  Session cleanup failed: {str(e)[:80]}")
+        return len(cleanups)
+
+    def _bucket(self, kind, key, rate, now):
+        if rate is None or not key:
+            return None
+        bucket = self.buckets.get((kind, key))
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                for old_key in [k for k, b in self.buckets.items() if b.wait_time(now) == 0 and b.tokens >= b.burst]:
+                    del self.buckets[old_key]
+            bucket = self.buckets[(kind, key)] = TokenBucket(rate[0], rate[1], now)
+        return bucket
+
+    def _pick(self, state, now):
+        """
+        Choose the next job for a worker (caller holds the lock)
+
+        Returns:
+            tuple: (entry, None) or (None, seconds until something may become eligible)
+        """
+        best = None
+        wake = None
+
+        for account, pending in self.queues.items():
+            if not pending:
+                continue
+
+            # Session affinity: leave the job to the worker holding the session
+            affinity_delay = 0.0
+            holders = [s for s in self.states if s['account'] == account and s is not state]
+            if account and holders and state['account'] != account:
+                if any(not s['busy'] for s in holders):
+                    continue
+                # Counted from when the holder got busy, not from when the job queued
+                affinity_delay = min(s['busy_since'] for s in holders) + self.affinity_wait - now
+
+            account_bucket = self._bucket('account', account, self.account_rate, now)
+            delay = max(affinity_delay, account_bucket.wait_time(now) if account_bucket else 0.0)
+            if delay > 0:
+                wake = delay if wake is None else min(wake, delay)
+                continue
+
+            for index in range(min(len(pending), ACCOUNT_SCAN)):
+                entry = pending[index]
+                bucket = self._bucket('beneficiary', entry['beneficiary'], self.beneficiary_rate, now)
+                delay = bucket.wait_time(now) if bucket else 0.0
+
+                if delay > 0:
+                    wake = delay if wake is None else min(wake, delay)
+                    continue
+
+                if best is None or entry['tag'] < best[1]['tag']:
+                    best = (index, entry)
+                break
+
+        if best is None:
+            return None, wake
+
+        index, best = best
+        pending = self.queues[best['account']]
+        del pending[index]
+        self.queued -= 1
+        self.virtual_time = max(self.virtual_time, best['start'])
+
+        if not pending:
+            del self.queues[best['account']]
+            if self.last_tag.get(best['account'], 0.0) <= self.virtual_time:
+                self.last_tag.pop(best['account'], None)
+
+        for kind, key, rate in (('account', best['account'], self.account_rate),
+                                ('beneficiary', best['beneficiary'], self.beneficiary_rate)):
+            bucket = self._bucket(kind, key, rate, now)
+            if bucket:
+                bucket.take(now)
+
+        if best['account'] and state['account'] == best['account']:
+            self.stats['session_hits'] += 1
+        elif any(s['account'] == best['account'] for s in self.states if s is not state) and best['account']:
+            self.stats['affinity_steals'] += 1
+
+        return best, None
+
+    def _release_idle_session(self, state):
+        """Close a worker's session after SESSION_IDLE without jobs"""
+        if state['session'] is not None and time.time() - state['idle_since'] >= SESSION_IDLE:
+            cleanup, state['cleanup'] = state['cleanup'], None
+            state['session'] = None
+            state['account'] = None
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    print(f"⚠️  Session cleanup failed: {str(e)[:80]}")
+
+    def _worker(self, state):
+        _worker_local.state = state
+
+        while True:
+            with self.ready:
+                while True:
+                    now = time.time()
+                    entry, wake = self._pick(state, now)
+                    if entry:
+                        break
+                    if state['session'] is not None:
+                        idle_left = state['idle_since'] + SESSION_IDLE - now
+                        if idle_left <= 0:
+                            break
+                        wake = idle_left if wake is None else min(wake, idle_left)
+                    self.ready.wait(wake)
+
+                if entry:
+                    started = time.time()
+                    queue_ms = round((started - entry['queued_at']) * 1000, 1)
+                    self.queue_ms.append(queue_ms)
+                    waits = self.account_wait_ms.setdefault(entry['account'], {'dispatched': 0, 'recent': deque(maxlen=200)})
+                    waits['dispatched'] += 1
+                    waits['recent'].append(queue_ms)
+                    state['busy'] = True
+                    state['busy_since'] = started
+                    self.stats['running'] += 1
+
+            if entry is None:
+                self._release_idle_session(state)
+                continue
+
+            try:
+                entry['fn'](*entry['args'], **entry['kwargs'])
+                outcome = 'completed'
+            except Exception as e:
+                print(f"❌ Job failed in {threading.current_thread().name}: {str(e)[:120]}")
+                outcome = 'failed'
+
+            with self.ready:
+                self.run_ms.append(round((time.time() - started) * 1000, 1))
+                self.stats['running'] -= 1
+                self.stats[outcome] += 1
+                state['busy'] = False
+                state['busy_since'] = None
+                state['idle_since'] = time.time()
+                # A free session holder (or a new token) may unblock queued jobs
+                self.ready.notify_all()
+
+
+if __name__ == '__main__':
+    memory_mb = available_memory_mb()
+    print(f"CPUs: {os.cpu_count()}")
+    print(f"Available memory: {memory_mb} MB" if memory_mb is not None else "Available memory: unknown")
+    print(f"Browser budget: {BROWSER_MB} MB per job, {RESERVED_MB} MB reserved")
+    print(f"Workers: {default_workers()}")
+    sys.exit(0)
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Recharge Log Store
+Append-only event log of API jobs, sharded by day, with compressed closed
+segments and an SQLite index for direct lookups
+
+Layout under the log directory (default api_logs/):
+    2025-02-13/0001.log       segment being written (JSON lines)
+    2025-02-13/0000.log.gz    closed segment, gzip members of ~64 KB each
+    index.db                  record offsets, search keys, gzip block table
+
+Every record's (segment, offset, length) is indexed by job ID, and each job
+is tagged with its phone, order ID, transaction ID and status, so a lookup
+by any of them seeks straight to the job's records: raw segments are read
+at the offset, compressed ones by decompressing only the block holding it.
+Day directories older than the retention period are deleted with their
+index rows.
+
+Writes go through one writer thread (file append + index commit per batch),
+so logging never blocks a browser flow.
+"""
+
+import os
+import re
+import sys
+import json
+import zlib
+import gzip
+import queue
+import shutil
+import sqlite3
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from order_store import connect
+
+
+LOG_DIR = os.getenv('LOG_DIR', 'api_logs')
+
+# Days of logs kept; older day directories are deleted
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '30'))
+
+# A segment is closed and compressed once it reaches this size (or the day ends)
+LOG_SEGMENT_BYTES = int(os.getenv('LOG_SEGMENT_BYTES', str(8 * 1024 * 1024)))
+
+# Uncompressed bytes per gzip member (the unit decompressed for one lookup)
+BLOCK_BYTES = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    name          TEXT PRIMARY KEY,
+    day           TEXT NOT NULL,
+    compressed    INTEGER NOT NULL DEFAULT 0,
+    raw_bytes     INTEGER,
+    stored_bytes  INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS records (
+    job_id      TEXT NOT NULL,
+    segment     TEXT NOT NULL,
+    offset      INTEGER NOT NULL,
+    length      INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS log_keys (
+    job_id      TEXT NOT NULL,
+    field       TEXT NOT NULL,
+    value       TEXT NOT NULL,
+    day         TEXT NOT NULL,
+    PRIMARY KEY (job_id, field)
+);
+
+CREATE TABLE IF NOT EXISTS blocks (
+    segment     TEXT NOT NULL,
+    raw_offset  INTEGER NOT NULL,
+    gz_offset   INTEGER NOT NULL,
+    PRIMARY KEY (segment, raw_offset)
+);
+
+CREATE INDEX IF NOT EXISTS idx_records_job ON records (job_id, segment, offset);
+CREATE INDEX IF NOT EXISTS idx_records_segment ON records (segment);
+CREATE INDEX IF NOT EXISTS idx_log_keys_value ON log_keys (field, value);
+"""
+
+# Fields a job can be tagged with (and searched by)
+KEY_FIELDS = ('phone', 'order_id', 'transaction_id', 'status')
+
+INSERT_RECORD = "INSERT INTO records (job_id, segment, offset, length) VALUES (?, ?, ?, ?)"
+
+UPSERT_KEY = "INSERT OR REPLACE INTO log_keys (job_id, field, value, day) VALUES (?, ?, ?, ?)"
+
+SEGMENT_NAME = re.compile(r'^(\d{4}-\d{2}-\d{2})/(\d+)\.log$')
+
+
+class LogStore:
+    """Day-sharded JSON-lines log with gzip segments and an SQLite offset index"""
+
+    def __init__(self, root=None, retention_days=None, segment_bytes=None, batch_size=256, flush_ms=50):
+        """
+        Args:
+            root (str): Log directory (LOG_DIR, default api_logs)
+            retention_days (int): Days kept (LOG_RETENTION_DAYS, default 30)
+            segment_bytes (int): Segment size limit (LOG_SEGMENT_BYTES, default 8 MB)
+            batch_size (int): Max queued writes per index transaction
+            flush_ms (int): How long the writer gathers a batch after the first write
+        """
+        self.root = root or LOG_DIR
+        self.retention_days = retention_days if retention_days is not None else LOG_RETENTION_DAYS
+        self.segment_bytes = segment_bytes or LOG_SEGMENT_BYTES
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.index_path = os.path.join(self.root, 'index.db')
+        self.pending = queue.Queue()
+        self.local = threading.local()
+        self.stats = {'records': 0, 'segments_compressed': 0, 'days_pruned': 0, 'errors': 0}
+
+        os.makedirs(self.root, exist_ok=True)
+        conn = connect(self.index_path)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        # Writer-thread state
+        self.segment = None
+        self.segment_file = None
+        self.segment_day = None
+
+        self.writer = threading.Thread(target=self._write_loop, name='log-store-writer', daemon=True)
+        self.writer.start()
+
+    # ---- writes (non-blocking, batched) ----
+
+    def append(self, job_id, event_type, data=None):
+        """
+        Queue one log record
+
+        Args:
+            job_id (str): Job the record belongs to
+            event_type (str): Event name (e.g. 'LOGGED_IN', 'REDIRECT_DETECTED')
+            data (dict): Event payload (anything JSON-serialisable; str() otherwise)
+        """
+        self.pending.put(('record', (datetime.now(), job_id, event_type, data)))
+
+    def tag(self, job_id, **fields):
+        """
+        Queue search keys for a job (phone, order_id, transaction_id, status)
+
+        A later tag of the same field replaces the earlier value.
+        """
+        values = {field: str(value) for field, value in fields.items() if field in KEY_FIELDS and value}
+        if values:
+            self.pending.put(('tag', (job_id, values, datetime.now().strftime('%Y-%m-%d'))))
+
+    def prune(self, now=None):
+        """Queue deletion of day directories older than the retention period"""
+        self.pending.put(('prune', now))
+
+    def flush(self, timeout=10):
+        """
+        Block until everything queued so far is written and indexed
+
+        Returns:
+            bool: True if flushed within timeout
+        """
+        done = threading.Event()
+        self.pending.put(('flush', done))
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        """Flush, close the open segment and stop the writer"""
+        self.flush(timeout)
+        self.pending.put(('stop', None))
+        self.writer.join(timeout)
+
+    def _write_loop(self):
+        conn = connect(self.index_path)
+        self._recover(conn)
+        self._prune(conn, datetime.now())
+
+        while True:
+            batch = [self.pending.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.pending.get(timeout=self.flush_ms / 1000))
+            except queue.Empty:
+                pass
+
+            stop = False
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for kind, item in batch:
+                    if kind == 'record':
+                        self._write_record(conn, *item)
+                    elif kind == 'tag':
+                        job_id, values, day = item
+                        for field, value in values.items():
+                            conn.execute(UPSERT_KEY, (job_id, field, value, day))
+                    elif kind == 'prune':
+                        conn.execute('COMMIT')
+                        self._prune(conn, item or datetime.now())
+                        conn.execute('BEGIN IMMEDIATE')
+                if self.segment_file:
+                    self.segment_file.flush()
+                conn.execute('COMMIT')
+            except (OSError, sqlite3.Error) as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                self.stats['errors'] += 1
+                print(f"❌ Log store write failed ({len(batch)} entries): {e}")
+
+            for kind, item in batch:
+                if kind == 'flush':
+                    item.set()
+                elif kind == 'stop':
+                    stop = True
+
+            if stop:
+                conn.execute('BEGIN IMMEDIATE')
+                self._close_segment(conn)
+                conn.execute('COMMIT')
+                conn.close()
+                return
+
+    def _write_record(self, conn, at, job_id, event_type, data):
+        """Append one JSON line to the day's open segment and index it"""
+        day = at.strftime('%Y-%m-%d')
+        if self.segment_day != day or (self.segment_file and self.segment_file.tell() >= self.segment_bytes):
+            self._open_segment(conn, day)
+
+        line = json.dumps({
+            'at': at.isoformat(),
+            'job_id': job_id,
+            'event': event_type,
+            'data': data
+        }, default=str).encode() + b'\n'
+
+        offset = self.segment_file.tell()
+        self.segment_file.write(line)
+        conn.execute(INSERT_RECORD, (job_id, self.segment, offset, len(line)))
+        self.stats['records'] += 1
+
+    def _open_segment(self, conn, day):
+        """Close the current segment (compressing it) and start the next one of the day"""
+        if self.segment_day != day and self.segment_day is not None:
+            # First record of a new day: apply retention once per day
+            self._close_segment(conn)
+            conn.execute('COMMIT')
+            self._prune(conn, datetime.now())
+            conn.execute('BEGIN IMMEDIATE')
+        else:
+            self._close_segment(conn)
+
+        os.makedirs(os.path.join(self.root, day), exist_ok=True)
+        row = conn.execute("SELECT COUNT(*) AS n FROM segments WHERE day = ?", (day,)).fetchone()
+        number = row['n']
+        while os.path.exists(self._path(f'{day}/{number:04d}')) or os.path.exists(self._path(f'{day}/{number:04d}', True)):
+            number += 1
+
+        self.segment = f'{day}/{number:04d}'
+        self.segment_day = day
+        self.segment_file = open(self._path(self.segment), 'ab')
+        conn.execute("INSERT OR IGNORE INTO segments (name, day) VALUES (?, ?)", (self.segment, day))
+
+    def _close_segment(self, conn):
+        if self.segment_file is None:
+            return
+        self.segment_file.close()
+        self.segment_file = None
+        self._compress(conn, self.segment)
+        self.segment = None
+
+    def _compress(self, conn, segment):
+        """
+        Rewrite a closed segment as independent gzip members of ~BLOCK_BYTES
+        (split on record boundaries) and record where each member starts
+        """
+        raw_path = self._path(segment)
+        gz_path = self._path(segment, compressed=True)
+        if not os.path.exists(raw_path):
+            return
+
+        blocks = []
+        with open(raw_path, 'rb') as src, open(gz_path + '.tmp', 'wb') as dst:
+            raw_offset = 0
+            while True:
+                chunk = src.read(BLOCK_BYTES)
+                if not chunk:
+                    break
+                chunk += src.readline()  # Finish the record the block cut through
+                blocks.append((segment, raw_offset, dst.tell()))
+                dst.write(gzip.compress(chunk))
+                raw_offset += len(chunk)
+            os.fsync(dst.fileno())
+            stored = dst.tell()
+
+        conn.execute("DELETE FROM blocks WHERE segment = ?", (segment,))
+        conn.executemany("INSERT INTO blocks (segment, raw_offset, gz_offset) VALUES (?, ?, ?)", blocks)
+        conn.execute(
+            "INSERT OR REPLACE INTO segments (name, day, compressed, raw_bytes, stored_bytes) VALUES (?, ?, 1, ?, ?)",
+            (segment, segment.split('/')[0], raw_offset, stored)
+        )
+        conn.execute('COMMIT')
+
+        # Readers switch to the .gz file once the raw one is gone
+        os.replace(gz_path + '.tmp', gz_path)
+        os.remove(raw_path)
+        conn.execute('BEGIN IMMEDIATE')
+        self.stats['segments_compressed'] += 1
+
+    def _recover(self, conn):
+        """Compress segments left open by a previous run"""
+        conn.execute('BEGIN IMMEDIATE')
+        for day in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, day)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                match = SEGMENT_NAME.match(f'{day}/{name}')
+                if match:
+                    segment = f'{day}/{name[:-len(".log")]}'
+                    print(f"🗜️  Compressing log segment left open: {segment}")
+                    self._compress(conn, segment)
+        conn.execute('COMMIT')
+
+    def _prune(self, conn, now):
+        """Delete day directories (and their index rows) past the retention period"""
+        if self.retention_days <= 0:
+            return
+        cutoff = (now - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        for day in sorted(os.listdir(self.root)):
+            if not os.path.isdir(os.path.join(self.root, day)) or day >= cutoff or day == self.segment_day:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("DELETE FROM records WHERE segment >= ? AND segment < ?", (day + '/', day + '0'))
+            conn.execute("DELETE FROM blocks WHERE segment >= ? AND segment < ?", (day + '/', day + '0'))
+            conn.execute("DELETE FROM segments WHERE day = ?", (day,))
+            conn.execute("DELETE FROM log_keys WHERE day = ?", (day,))
+            conn.execute('COMMIT')
+            shutil.rmtree(os.path.join(self.root, day), ignore_errors=True)
+            self.stats['days_pruned'] += 1
+            print(f"🧹 Pruned logs of {day} (retention {self.retention_days} days)")
+
+    def _path(self, segment, compressed=False):
+        return os.path.join(self.root, segment + ('.log.gz' if compressed else '.log'))
+
+    # ---- reads (concurrent with the writer) ----
+
+    def _reader(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.index_path, readonly=True)
+        return conn
+
+    def job_ids(self, any_id):
+        """
+        Jobs a lookup ID refers to: the job ID itself, or the jobs tagged
+        with it as order ID / transaction ID
+
+        Returns:
+            list: Job IDs (empty if unknown)
+        """
+        conn = self._reader()
+        if conn.execute("SELECT 1 FROM records WHERE job_id = ? LIMIT 1", (any_id,)).fetchone():
+            return [any_id]
+        rows = conn.execute(
+            "SELECT DISTINCT job_id FROM log_keys WHERE field IN ('order_id', 'transaction_id') AND value = ?",
+            (str(any_id),)
+        ).fetchall()
+        return [row['job_id'] for row in rows]
+
+    def read(self, any_id, event=None, limit=None):
+        """
+        Log records of a job, oldest first, read at their indexed offsets
+
+        Args:
+            any_id (str): Job ID, order ID or transaction ID
+            event (str): Only records of this event type
+            limit (int): Max records
+
+        Returns:
+            list: Record dicts (at, job_id, event, data)
+        """
+        job_ids = self.job_ids(any_id)
+        if not job_ids:
+            return []
+
+        rows = self._reader().execute(
+            f"SELECT segment, offset, length FROM records WHERE job_id IN ({', '.join('?' for _ in job_ids)}) "
+            "ORDER BY segment, offset",
+            job_ids
+        ).fetchall()
+
+        records = []
+        handles = {}
+        try:
+            for row in rows:
+                record = self._read_at(handles, row['segment'], row['offset'], row['length'])
+                if record is None or (event and record['event'] != event):
+                    continue
+                records.append(record)
+                if limit and len(records) >= limit:
+                    break
+        finally:
+            for handle in handles.values():
+                handle[0].close()
+        return records
+
+    def _read_at(self, handles, segment, offset, length):
+        """One record: direct read from a raw segment, or from its gzip block"""
+        handle = handles.get(segment)
+        if handle is None:
+            try:
+                handle = (open(self._path(segment), 'rb'), None, {})
+            except FileNotFoundError:
+                try:
+                    blocks = self._reader().execute(
+                        "SELECT raw_offset, gz_offset FROM blocks WHERE segment = ? ORDER BY raw_offset", (segment,)
+                    ).fetchall()
+                    handle = (open(self._path(segment, compressed=True), 'rb'),
+                              [(row['raw_offset'], row['gz_offset']) for row in blocks], {})
+                except FileNotFoundError:
+                    return None  # Pruned meanwhile
+            handles[segment] = handle
+
+        file, blocks, cache = handle
+        if blocks is None:
+            file.seek(offset)
+            line = file.read(length)
+        else:
+            index = bisect_right([raw for raw, _ in blocks], offset) - 1
+            if index < 0:
+                return None
+            raw_start, gz_start = blocks[index]
+            if index not in cache:
+                cache.clear()
+                file.seek(gz_start)
+                end = blocks[index + 1][1] if index + 1 < len(blocks) else None
+                cache[index] = zlib.decompress(file.read(end - gz_start if end else -1), wbits=31)
+            line = cache[index][offset - raw_start:offset - raw_start + length]
+
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def find(self, limit=100, **fields):
+        """
+        Jobs whose tags match every given field, most recently tagged day first
+
+        Args:
+            **fields: phone, order_id, transaction_id, status
+
+        Returns:
+            list: Dicts with job_id and its tags
+        """
+        conditions = []
+        params = []
+        for field, value in fields.items():
+            if field not in KEY_FIELDS:
+                raise ValueError(f"Unknown field: {field} (use {', '.join(KEY_FIELDS)})")
+            if value is not None:
+                conditions.append("job_id IN (SELECT job_id FROM log_keys WHERE field = ? AND value = ?)")
+                params.extend((field, str(value)))
+
+        sql = "SELECT job_id, MAX(day) AS day FROM log_keys"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " GROUP BY job_id ORDER BY day DESC LIMIT ?"
+
+        conn = self._reader()
+        jobs = []
+        for row in conn.execute(sql, params + [int(limit)]).fetchall():
+            tags = conn.execute("SELECT field, value FROM log_keys WHERE job_id = ?", (row['job_id'],)).fetchall()
+            jobs.append(dict({tag['field']: tag['value'] for tag in tags}, job_id=row['job_id']))
+        return jobs
+
+    def usage(self):
+        """
+        Segment counts and sizes
+
+        Returns:
+            dict: days, segments, compressed, raw_bytes, stored_bytes, records
+        """
+        conn = self._reader()
+        row = conn.execute(
+            "SELECT COUNT(DISTINCT day) AS days, COUNT(*) AS segments, SUM(compressed) AS compressed, "
+            "SUM(raw_bytes) AS raw_bytes, SUM(stored_bytes) AS stored_bytes FROM segments"
+        ).fetchone()
+        usage = {key: row[key] or 0 for key in ('days', 'segments', 'compressed', 'raw_bytes', 'stored_bytes')}
+        usage['records'] = conn.execute("SELECT COUNT(*) AS n FROM records").fetchone()['n']
+        return usage
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('show', 'find', 'stats', 'prune'):
+        print("Usage:")
+        print("  python log_store.py show <job_id|order_id|transaction_id> [event]")
+        print("  python log_store.py find [phone=..] [order_id=..] [transaction_id=..] [status=..] [limit=..]")
+        print("  python log_store.py stats")
+        print("  python log_store.py prune")
+        print()
+        print(f"Directory: {LOG_DIR} (set LOG_DIR to change), retention: {LOG_RETENTION_DAYS} days")
+        sys.exit(1)
+
+    store = LogStore()
+    command = sys.argv[1]
+
+    if command == 'show':
+        records = store.read(sys.argv[2], event=sys.argv[3] if len(sys.argv) > 3 else None)
+        if not records:
+            print(f"❌ No logs for: {sys.argv[2]}")
+            sys.exit(1)
+        for record in records:
+            print(f"{record['at'][:23]}  {record['job_id']}  [{record['event']}] {json.dumps(record['data'])}")
+
+    elif command == 'find':
+        filters = dict(arg.split('=', 1) for arg in sys.argv[2:])
+        for job in store.find(**filters):
+            print(json.dumps(job))
+
+    elif command == 'stats':
+        print(json.dumps(store.usage(), indent=2))
+
+    else:
+        store.prune()
+        store.flush()
+        print(f"✅ Pruned {store.stats['days_pruned']} day(s)")
+
+    store.close()
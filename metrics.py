@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Recharge Flow Metrics
+Process-wide counters, gauges and per-stage latency histograms, rendered in
+the Prometheus text format for the API server's /metrics endpoint
+
+Recording is a dict lookup plus a few additions under one lock, so the
+browser flows call it unconditionally:
+
+    with metrics.timed('login', flow='creditcard'):
+        ...
+    metrics.inc('recharge_outcomes_total', outcome='success', detection_method='redirect_url')
+    metrics.gauge_add('recharge_live_browsers', 1)
+
+timed() also works as a method decorator (one stage per method), and
+StageTimer covers long straight-line steps without re-indenting them.
+Gauges that are cheaper to read than to track (queue depth, worker counts)
+are registered as callbacks and evaluated only when /metrics is scraped.
+
+The last few hundred durations and errors of each stage are also kept
+with their timestamps, so recent() can answer "how slow is the portal
+right now" (readiness checks) without a Prometheus query.
+"""
+
+import sys
+import time
+import math
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+
+# Upper bounds (seconds) of the latency buckets: page actions take seconds,
+# payment detection can take minutes
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+# Metric name -> (type, help text); anything recorded must be declared here
+METRICS = {
+    'recharge_stage_seconds': ('histogram', 'Duration of each recharge stage'),
+    'recharge_stage_errors_total': ('counter', 'Stages that raised an exception'),
+    'recharge_outcomes_total': ('counter', 'Finished recharges by outcome, detection method and flow'),
+    'recharge_live_browsers': ('gauge', 'Chrome instances currently open'),
+    'recharge_active_monitors': ('gauge', 'Payment pages currently being monitored'),
+}
+
+# Samples kept per stage for recent()
+RECENT_SAMPLES = 512
+
+_lock = threading.Lock()
+_values = {}
+_histograms = {}
+_callbacks = {}
+_recent = {}
+_recent_errors = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def observe(stage, seconds, **labels):
+    """
+    Record one stage duration
+
+    Args:
+        stage (str): Stage name (e.g. 'browser_launch', 'valider_2')
+        seconds (float): Duration
+        **labels: Extra labels (e.g. flow='voucher')
+    """
+    labels['stage'] = stage
+    key = _key('recharge_stage_seconds', labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {'buckets': [0] * len(STAGE_BUCKETS), 'sum': 0.0, 'count': 0}
+        index = bisect_left(STAGE_BUCKETS, seconds)
+        if index < len(STAGE_BUCKETS):
+            hist['buckets'][index] += 1
+        hist['sum'] += seconds
+        hist['count'] += 1
+        samples = _recent.get(stage)
+        if samples is None:
+            samples = _recent[stage] = deque(maxlen=RECENT_SAMPLES)
+        samples.append((time.time(), seconds))
+
+
+def stage_error(stage, **labels):
+    """Count a failed stage (e.g. Chrome did not start)"""
+    inc('recharge_stage_errors_total', stage=stage, **labels)
+    with _lock:
+        errors = _recent_errors.get(stage)
+        if errors is None:
+            errors = _recent_errors[stage] = deque(maxlen=RECENT_SAMPLES)
+        errors.append(time.time())
+
+
+def recent(stages, window=300):
+    """
+    Durations and errors of stages over the last window seconds (all labels)
+
+    Args:
+        stages (iterable): Stage names, pooled together
+        window (float): Seconds to look back
+
+    Returns:
+        dict: count, errors, p50 and p95 (seconds, None without samples)
+    """
+    since = time.time() - window
+    with _lock:
+        durations = sorted(seconds for stage in stages for at, seconds in _recent.get(stage, ()) if at >= since)
+        errors = sum(1 for stage in stages for at in _recent_errors.get(stage, ()) if at >= since)
+
+    def rank(pct):
+        if not durations:
+            return None
+        return round(durations[max(0, math.ceil(pct / 100.0 * len(durations)) - 1)], 3)
+
+    return {'count': len(durations), 'errors': errors, 'p50': rank(50), 'p95': rank(95)}
+
+
+@contextmanager
+def timed(stage, **labels):
+    """
+    Time a block as a stage (errors are counted, then re-raised)
+
+    Args:
+        stage (str): Stage name
+        **labels: Extra labels
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_error(stage, **labels)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, **labels)
+
+
+class StageTimer:
+    """
+    Consecutive stages of one flow: each mark() records the time since the
+    previous mark, so straight-line code needs one call per step
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.started = time.perf_counter()
+
+    def restart(self):
+        """Start the next stage now (skip whatever ran since the last mark)"""
+        self.started = time.perf_counter()
+
+    def mark(self, stage):
+        """Record the stage that just finished and start the next one"""
+        now = time.perf_counter()
+        observe(stage, now - self.started, **self.labels)
+        self.started = now
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def gauge_add(name, delta, **labels):
+    """Move a gauge up or down (e.g. +1 on browser launch, -1 on quit)"""
+    inc(name, delta, **labels)
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to an absolute value"""
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def register_gauge(name, help_text, callback):
+    """
+    Declare a gauge computed at scrape time
+
+    Args:
+        name (str): Metric name
+        help_text (str): HELP line
+        callback (callable): Returns a number, or a list of (labels dict, number)
+    """
+    with _lock:
+        METRICS[name] = ('gauge', help_text)
+        _callbacks[name] = callback
+
+
+def reset():
+    """Forget every recorded value (callbacks stay registered)"""
+    with _lock:
+        _values.clear()
+        _histograms.clear()
+        _recent.clear()
+        _recent_errors.clear()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def render():
+    """
+    Prometheus text exposition of everything recorded so far
+
+    Returns:
+        str: HELP/TYPE headers followed by the samples of each metric
+    """
+    with _lock:
+        values = dict(_values)
+        histograms = {k: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                      for k, h in _histograms.items()}
+        declared = dict(METRICS)
+        callbacks = dict(_callbacks)
+
+    samples = {}
+    for (name, labels), value in values.items():
+        samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    for (name, labels), hist in sorted(histograms.items()):
+        cumulative = 0
+        lines = samples.setdefault(name, [])
+        for bound, count in zip(STAGE_BUCKETS, hist['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {hist["count"]}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {round(hist["sum"], 6)}')
+        lines.append(f'{name}_count{_format_labels(labels)} {hist["count"]}')
+
+    for name, callback in callbacks.items():
+        try:
+            result = callback()
+        except Exception as e:
+            print(f"⚠️  Metric callback {name} failed: {str(e)[:80]}")
+            continue
+        if not isinstance(result, list):
+            result = [({}, result)]
+        samples[name] = [
+            f'{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}'
+            for labels, value in result
+        ]
+
+    lines = []
+    for name, (kind, help_text) in declared.items():
+        if name not in samples:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(sorted(samples[name]) if kind != 'histogram' else samples[name])
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print("Usage: python metrics.py")
+        print("Prints a sample exposition (one observation per stage)")
+        sys.exit(0)
+
+    for stage in ('browser_launch', 'login', 'navigation', 'payment_detection'):
+        observe(stage, 1.5, flow='creditcard')
+    inc('recharge_outcomes_total', outcome='success', detection_method='redirect_url')
+    print(render(), end='')
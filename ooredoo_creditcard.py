@@ -8,6 +8,9 @@ import os
 import sys
 import time
 import re
+import hashlib
+import browsers
+import metrics
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -15,22 +18,40 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 
 
+def _credentials_key(username, password):
+    """Opaque key identifying a login (the password itself is never stored)"""
+    return hashlib.sha256(f"{username}\0{password}".encode()).hexdigest()
+
+
 class OoredooCreditCardRecharge:
     """
     Ooredoo Tunisia credit card recharge
     """
     
-    def __init__(self, headless=False):
+    def __init__(self, headless=False, on_event=None):
         """
         Args:
             headless (bool): Run browser in headless mode
+            on_event (callable): Called with (event_type, data) at each milestone
         """
         self.headless = headless
+        self.on_event = on_event
         self.driver = None
         self.wait = None
+        self.account = None
+        self.credentials = None
+    
+    def _emit(self, event_type, data=None):
+        """Report a milestone to the listener (errors are ignored)"""
+        if self.on_event:
+            try:
+                self.on_event(event_type, data or {})
+            except Exception as e:
+                print(f"   ⚠️  Event listener failed: {str(e)[:80]}")
         
     def _setup_driver(self):
         """Setup Chrome driver with options"""
+        started = time.perf_counter()
         chrome_options = Options()
         
         # Use headless mode on Linux servers, visible on Mac/Windows
@@ -54,7 +75,13 @@ class OoredooCreditCardRecharge:
         chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         chrome_options.add_experimental_option('useAutomationExtension', False)
         
-        self.driver = webdriver.Chrome(options=chrome_options)
+        try:
+            self.driver = webdriver.Chrome(options=chrome_options)
+        except Exception:
+            metrics.stage_error('browser_launch', flow='creditcard')
+            raise
+        metrics.gauge_add('recharge_live_browsers', 1)
+        browsers.register(self.driver, 'creditcard')
         self.driver.execute_cdp_cmd('Network.enable', {})
         
         # Hide webdriver property
@@ -63,6 +90,7 @@ class OoredooCreditCardRecharge:
         )
         
         self.wait = WebDriverWait(self.driver, 20)
+        metrics.observe('browser_launch', time.perf_counter() - started, flow='creditcard')
         
     def login(self, username, password):
         """
@@ -75,6 +103,7 @@ class OoredooCreditCardRecharge:
         Returns:
             bool: True if login successful
         """
+        started = time.perf_counter()
         try:
             print(f"🔐 Logging in as {username}...")
             
@@ -110,8 +139,51 @@ class OoredooCreditCardRecharge:
         except Exception as e:
             print(f"❌ Login error: {str(e)}")
             return False
+        finally:
+            metrics.observe('login', time.perf_counter() - started, flow='creditcard')
+    
+    def has_session(self, username, password):
+        """True if the browser is logged in with these credentials"""
+        return self.driver is not None and self.credentials == _credentials_key(username, password)
     
-    def recharge(self, username, password, beneficiary_number, amount):
+    def start_session(self, username, password):
+        """
+        Launch the browser and log in (no-op if already logged in with
+        these credentials); create_payment() can then run repeatedly
+        
+        Returns:
+            bool: True if logged in
+        """
+        if self.has_session(username, password):
+            return True
+        if self.driver:
+            self.close()  # Logged in as another account
+        
+        self._setup_driver()
+        if not self.login(username, password):
+            self._emit('LOGIN_FAILED', {'username': username})
+            return False
+        
+        self.account = username
+        self.credentials = _credentials_key(username, password)
+        self._emit('LOGGED_IN', {'username': username})
+        return True
+    
+    def close(self):
+        """Quit the browser and forget the session"""
+        if self.driver:
+            browsers.unregister(self.driver)
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            metrics.gauge_add('recharge_live_browsers', -1)
+        self.driver = None
+        self.wait = None
+        self.account = None
+        self.credentials = None
+    
+    def recharge(self, username, password, beneficiary_number, amount, keep_session=False):
         """
         Perform credit card recharge
         
@@ -120,238 +192,469 @@ class OoredooCreditCardRecharge:
             password (str): Login password
             beneficiary_number (str): Number to recharge (can be same as username)
             amount (int): Recharge amount in TND (e.g., 10, 20, 50)
+            keep_session (bool): Reuse this instance's browser when it is already
+                logged in with the same credentials, and leave it open afterwards
         
         Returns:
             dict: Result with payment URL
         """
+        return self._in_session(username, password, keep_session,
+                                lambda: self.create_payment(beneficiary_number, amount))
+    
+    def checkout(self, username, password, lines, keep_session=False):
+        """
+        Recharge several beneficiaries with a single credit card payment
+        
+        Args:
+            username (str): Login phone number
+            password (str): Login password
+            lines (list): Dicts with 'amount' (int) and 'beneficiaries' (list),
+                one recharge line of the form per amount
+            keep_session (bool): Same as recharge()
+        
+        Returns:
+            dict: Result with payment URL, lines and total amount
+        """
+        return self._in_session(username, password, keep_session,
+                                lambda: self.create_checkout(lines))
+    
+    def _in_session(self, username, password, keep_session, create):
+        """Run create() in a logged-in browser (login, session reuse, cleanup)"""
         try:
-            self._setup_driver()
+            if keep_session and self.has_session(username, password):
+                print(f"♻️  Reusing logged-in session for {username}")
+                result = create()
+                if not result.get('session_expired'):
+                    return result
+                print("   Session expired, logging in again...")
+            
+            if keep_session and self.driver:
+                self.close()  # Expired, or logged in as another account
             
             print("🚀 Starting Ooredoo credit card recharge...")
             
             # Step 1: Login
-            if not self.login(username, password):
+            if not self.start_session(username, password):
+                if keep_session:
+                    self.close()
                 return {
                     'status': 'error',
                     'message': 'Login failed'
                 }
             
-            # Step 2: Navigate to recharge online page
-            print("📱 Navigating to recharge online page...")
-            self.driver.get("https://espaceclient.ooredoo.tn/recharge-online")
-            time.sleep(3)
-            
-            # Step 3: Select beneficiary number (checkbox)
-            print(f"📞 Selecting beneficiary: {beneficiary_number}")
+            return create()
             
-            try:
-                # The beneficiary checkbox has a value like "21627865121" (country code + number)
-                # Try multiple possible formats
-                possible_values = [
-                    f"216{beneficiary_number}",  # With Tunisia country code
-                    beneficiary_number,          # Just the number
-                ]
-                
-                checkbox_found = False
-                for phone_value in possible_values:
-                    try:
-                        # Find checkbox by value attribute
-                        checkbox = self.driver.find_element(
-                            By.CSS_SELECTOR, 
-                            f'input[type="checkbox"][name*="phones"][value="{phone_value}"]'
-                        )
-                        
-                        if checkbox:
-                            # Check if already checked
-                            if not checkbox.is_selected():
-                                self.driver.execute_script("arguments[0].click();", checkbox)
-                                print(f"   ✅ Checked beneficiary: {beneficiary_number}")
-                            else:
-                                print(f"   ℹ️  Beneficiary already checked: {beneficiary_number}")
-                            checkbox_found = True
-                            break
-                    except:
-                        continue
-                
-                if not checkbox_found:
-                    # Fallback: find any checkbox for phones and check the first one
-                    checkboxes = self.driver.find_elements(By.CSS_SELECTOR, 'input[type="checkbox"][name*="phones"]')
-                    if checkboxes:
-                        self.driver.execute_script("arguments[0].click();", checkboxes[0])
-                        print(f"   ✅ Checked first available number")
-                    else:
-                        print(f"   ℹ️  No checkbox found, number may be pre-selected")
-                        
-            except Exception as e:
-                print(f"   ⚠️  Checkbox selection error: {str(e)[:80]}")
-            
-            time.sleep(1)
-            
-            # Step 4: Select amount from <select> dropdown
-            print(f"💰 Selecting amount: {amount} TND")
-            
-            # Predefined amounts available: 5, 10, 15, 20, 30, 40, 50, other
-            predefined_amounts = [5, 10, 15, 20, 30, 40, 50]
-            use_custom = amount not in predefined_amounts
-            
-            try:
-                from selenium.webdriver.support.select import Select
-                
-                # Find the select element by name or id
-                print("   Finding price select dropdown...")
-                select_element = self.wait.until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, 'select[name*="price"]'))
-                )
-                
-                # Create Select object
-                select = Select(select_element)
-                
-                if use_custom:
-                    # Select "Autre montant" (value="other")
-                    print(f"   Selecting 'Autre montant' for custom amount: {amount} DT")
-                    select.select_by_value('other')
-                    time.sleep(1)  # Wait for custom input field to appear
+        except Exception as e:
+            print(f"❌ Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            if keep_session:
+                self.close()  # Unknown page state: never reuse it
+            return {
+                'status': 'error',
+                'message': str(e)
+            }
+        
+        finally:
+            if self.driver and not keep_session:
+                time.sleep(5)  # Keep browser open to see result
+                # self.driver.quit()  # Uncomment in production
+    
+    def create_payment(self, beneficiary_number, amount):
+        """
+        Fill the recharge-online form in the logged-in browser and capture
+        the ClicToPay payment URL (steps 2-7 of recharge())
+        
+        Args:
+            beneficiary_number (str): Number to recharge
+            amount (int): Recharge amount in TND
+        
+        Returns:
+            dict: Result with payment URL ('session_expired' if the portal
+                sent us back to the login page)
+        """
+        timer = metrics.StageTimer(flow='creditcard')
+        
+        expired = self._open_recharge_form()
+        if expired:
+            return expired
+        timer.mark('navigation')
+        
+        self._select_beneficiary(beneficiary_number)
+        timer.mark('beneficiary_selection')
+        
+        self._select_amount(amount)
+        timer.mark('amount_selection')
+        
+        return self._confirm_and_capture(timer, {
+            'beneficiary': beneficiary_number,
+            'amount': amount
+        })
+    
+    def create_checkout(self, lines):
+        """
+        Several recharge lines in one order, paid with one ClicToPay payment
+        
+        Line N fills RechargeOnline[recharges][rechargeN] (added with the
+        form's "Ajouter" button when missing) and ticks one phones[] checkbox
+        per beneficiary, so every beneficiary of a line gets that line's
+        amount. Numbers ticked but not requested on their line are unticked,
+        and nothing is paid unless the confirmation page shows the total.
+        
+        Args:
+            lines (list): Dicts with 'amount' (int) and 'beneficiaries' (list)
+        
+        Returns:
+            dict: Result with payment URL, 'lines' and the combined 'amount'
+                ('session_expired' if the portal sent us back to the login page)
+        """
+        timer = metrics.StageTimer(flow='creditcard')
+        total = sum(line['amount'] * len(line['beneficiaries']) for line in lines)
+        
+        expired = self._open_recharge_form()
+        if expired:
+            return expired
+        timer.mark('navigation')
+        
+        for number, line in enumerate(lines, 1):
+            print(f"🧾 Recharge line {number}: {line['amount']} TND x {len(line['beneficiaries'])}")
+            self._add_recharge_line(number)
+            for beneficiary_number in line['beneficiaries']:
+                self._select_beneficiary(beneficiary_number, line=number, strict=True)
+            timer.mark('beneficiary_selection')
+            
+            self._select_amount(line['amount'], line=number)
+            timer.mark('amount_selection')
+        
+        self._clear_other_beneficiaries(lines)
+        
+        return self._confirm_and_capture(timer, {
+            'lines': lines,
+            'amount': total
+        }, expected_total=total)
+    
+    def _line_selector(self, selector, line):
+        """CSS selector narrowed to recharge line N (line 1 keeps the plain selector)"""
+        if line == 1:
+            return selector
+        return f'{selector}[name*="[recharge{line}]"]'
+    
+    def _open_recharge_form(self):
+        """
+        Step 2: load the recharge-online form
+        
+        Returns:
+            dict: Error result if the session expired, else None
+        """
+        # Step 2: Navigate to recharge online page
+        print("📱 Navigating to recharge online page...")
+        self.driver.get("https://espaceclient.ooredoo.tn/recharge-online")
+        time.sleep(3)
+        
+        if 'login' in self.driver.current_url.lower():
+            return {
+                'status': 'error',
+                'message': 'Session expired',
+                'session_expired': True
+            }
+        
+        return None
+    
+    def _add_recharge_line(self, line):
+        """Make sure recharge line N exists on the form (clicks "Ajouter" when needed)"""
+        selector = self._line_selector('select[name*="price"]', line)
+        if self.driver.find_elements(By.CSS_SELECTOR, selector):
+            return
+        
+        print(f"➕ Adding recharge line {line}...")
+        buttons = self.driver.find_elements(
+            By.XPATH,
+            "//*[self::button or self::a][contains(translate(normalize-space(.), 'AJOUTER', 'ajouter'), 'ajouter')]"
+        )
+        if not buttons:
+            raise RuntimeError(f'Recharge line {line} not available: no add button on the form')
+        self.driver.execute_script("arguments[0].click();", buttons[0])
+        self.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
+    
+    def _select_beneficiary(self, beneficiary_number, line=1, strict=False):
+        """
+        Step 3: tick the beneficiary's phones[] checkbox
+        
+        Args:
+            line (int): Recharge line the checkbox belongs to
+            strict (bool): Raise instead of falling back to the first number
+                (lines after the first only ever match their own phones[])
+        """
+        # Step 3: Select beneficiary number (checkbox)
+        print(f"📞 Selecting beneficiary: {beneficiary_number}")
+        
+        try:
+            # The beneficiary checkbox has a value like "21627865121" (country code + number)
+            # Try multiple possible formats
+            possible_values = [
+                f"216{beneficiary_number}",  # With Tunisia country code
+                beneficiary_number,          # Just the number
+            ]
+            
+            # Later lines only match their own phones[] (line 1's are not namespaced)
+            selectors = [self._line_selector('input[type="checkbox"][name*="phones"][value="{}"]', line)]
+            candidates = [selector.format(value) for value in possible_values for selector in selectors]
+            
+            checkbox_found = False
+            for candidate in candidates:
+                try:
+                    # Find checkbox by value attribute
+                    checkbox = self.driver.find_element(By.CSS_SELECTOR, candidate)
                     
-                    # Find and fill the custom amount input field
-                    # Input has name="RechargeOnline[recharges][recharge1][amount]"
-                    print("   Entering custom amount...")
-                    custom_input = self.wait.until(
-                        EC.visibility_of_element_located((By.CSS_SELECTOR, 'input[name*="amount"].other-mount-field, input[id*="amount"]'))
-                    )
-                    custom_input.clear()
-                    custom_input.send_keys(str(amount))
-                    print(f"   ✅ Entered custom amount: {amount} DT")
+                    if checkbox:
+                        # Check if already checked
+                        if not checkbox.is_selected():
+                            self.driver.execute_script("arguments[0].click();", checkbox)
+                            print(f"   ✅ Checked beneficiary: {beneficiary_number}")
+                        else:
+                            print(f"   ℹ️  Beneficiary already checked: {beneficiary_number}")
+                        checkbox_found = True
+                        break
+                except:
+                    continue
+            
+            if not checkbox_found and not strict:
+                # Fallback: find any checkbox for phones and check the first one
+                checkboxes = self.driver.find_elements(By.CSS_SELECTOR, 'input[type="checkbox"][name*="phones"]')
+                if checkboxes:
+                    self.driver.execute_script("arguments[0].click();", checkboxes[0])
+                    print(f"   ✅ Checked first available number")
                 else:
-                    # Select predefined amount by value
-                    print(f"   Selecting predefined amount: {amount} DT")
-                    select.select_by_value(str(amount))
-                    print(f"   ✅ Selected {amount} DT")
+                    print(f"   ℹ️  No checkbox found, number may be pre-selected")
                     
-            except Exception as amount_error:
-                print(f"   ❌ Amount selection error: {str(amount_error)[:200]}")
-                print("   Taking screenshot for debugging...")
-                try:
-                    self.driver.save_screenshot('/tmp/ooredoo_amount_error.png')
-                    print(f"   Screenshot saved: /tmp/ooredoo_amount_error.png")
-                except:
-                    pass
-                raise
-            
-            time.sleep(1)
-            
-            # Step 5: Click first Valider button
-            print("✅ Clicking Valider (step 1)...")
-            valider_btn = self.driver.find_element(By.XPATH, "//button[contains(text(), 'Valider')]")
-            self.driver.execute_script("arguments[0].click();", valider_btn)
-            
-            time.sleep(3)
-            
-            # Step 6: Confirm on the confirmation page
-            print("✅ Clicking Valider (step 2 - confirmation)...")
-            
-            # Wait for confirmation page to load
-            # Should show summary with beneficiary number and amount
+        except Exception as e:
+            print(f"   ⚠️  Checkbox selection error: {str(e)[:80]}")
+        
+        if strict and not checkbox_found:
+            raise RuntimeError(f'Beneficiary {beneficiary_number} not found on recharge line {line}')
+        
+        time.sleep(1)
+    
+    def _clear_other_beneficiaries(self, lines):
+        """
+        Untick every phones[] checkbox not requested on its own line (the
+        form can come with numbers already ticked, e.g. the account's own)
+        
+        Args:
+            lines (list): Checkout lines ('beneficiaries' per line)
+        """
+        wanted = {(number, str(b)) for number, line in enumerate(lines, 1) for b in line['beneficiaries']}
+        
+        for checkbox in self.driver.find_elements(By.CSS_SELECTOR, 'input[type="checkbox"][name*="phones"]'):
+            if not checkbox.is_selected():
+                continue
+            
+            match = re.search(r'\[recharge(\d+)\]', checkbox.get_attribute('name') or '')
+            line = int(match.group(1)) if match else 1
+            value = checkbox.get_attribute('value') or ''
+            number = value[3:] if value.startswith('216') and len(value) > 8 else value
+            
+            if (line, number) not in wanted:
+                self.driver.execute_script("arguments[0].click();", checkbox)
+                print(f"   ☐ Unticked {number} on recharge line {line} (not in this checkout)")
+    
+    def _select_amount(self, amount, line=1):
+        """Step 4: choose the amount of a recharge line (predefined or 'Autre montant')"""
+        # Step 4: Select amount from <select> dropdown
+        print(f"💰 Selecting amount: {amount} TND")
+        
+        # Predefined amounts available: 5, 10, 15, 20, 30, 40, 50, other
+        predefined_amounts = [5, 10, 15, 20, 30, 40, 50]
+        use_custom = amount not in predefined_amounts
+        
+        try:
+            from selenium.webdriver.support.select import Select
             
-            # Click the second Valider button
-            valider_confirm = self.wait.until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Valider')]"))
+            # Find the select element by name or id
+            print("   Finding price select dropdown...")
+            select_element = self.wait.until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, self._line_selector('select[name*="price"]', line)))
             )
             
-            # Set up network logging to capture the redirect
-            print("🔍 Enabling network logging...")
-            self.driver.execute_cdp_cmd('Network.enable', {})
-            
-            # Click confirm button
-            print("💳 Clicking final Valider button...")
-            self.driver.execute_script("arguments[0].click();", valider_confirm)
-            
-            # Step 7: Wait for redirect and capture URL
-            print("⏳ Waiting for redirect to payment...")
-            payment_url = None
-            
-            # Wait for navigation to complete
-            time.sleep(5)
+            # Create Select object
+            select = Select(select_element)
             
-            # Check current URL first (might have been redirected)
-            current_url = self.driver.current_url
-            print(f"   Current URL after click: {current_url}")
-            
-            if 'ipay' in current_url or 'clictopay' in current_url:
-                print("✅ Payment URL obtained from browser redirect!")
-                payment_url = current_url
-            else:
-                # Try to find redirect URL in page source
-                print("   Checking page source for payment URL...")
-                page_source = self.driver.page_source
-                print(f"   Page source length: {len(page_source)} chars")
+            if use_custom:
+                # Select "Autre montant" (value="other")
+                print(f"   Selecting 'Autre montant' for custom amount: {amount} DT")
+                select.select_by_value('other')
+                time.sleep(1)  # Wait for custom input field to appear
                 
-                # Look for meta refresh tag with URL
-                import re
-                meta_refresh = re.search(r'<meta[^>]*http-equiv=["\']?refresh["\']?[^>]*content=["\']?\d+;\s*url=([^"\'>\s]+)', page_source, re.IGNORECASE)
-                if meta_refresh:
-                    payment_url = meta_refresh.group(1)
-                    payment_url = payment_url.replace('&amp;', '&')
-                    print("   ✅ Found payment URL in meta refresh tag!")
-                    print(f"   URL: {payment_url[:80]}...")
+                # Find and fill the custom amount input field
+                # Input has name="RechargeOnline[recharges][recharge1][amount]"
+                print("   Entering custom amount...")
+                if line == 1:
+                    amount_selector = 'input[name*="amount"].other-mount-field, input[id*="amount"]'
                 else:
-                    # Try broader ipay search
-                    ipay_match = re.search(r'https?://[^"\s<>]*ipay[^"\s<>]*', page_source, re.IGNORECASE)
-                    if ipay_match:
-                        payment_url = ipay_match.group(0)
-                        # Clean up HTML entities
-                        payment_url = payment_url.replace('&amp;', '&')
-                        # Remove any trailing HTML
-                        payment_url = payment_url.split('"')[0].split("'")[0].split('<')[0]
-                        print("   ✅ Found payment URL in page source!")
-                        print(f"   URL: {payment_url[:80]}...")
-            
-            # If we got the payment URL, return success
-            if payment_url:
+                    amount_selector = f'input[name*="[recharge{line}][amount]"]'
+                custom_input = self.wait.until(
+                    EC.visibility_of_element_located((By.CSS_SELECTOR, amount_selector))
+                )
+                custom_input.clear()
+                custom_input.send_keys(str(amount))
+                print(f"   ✅ Entered custom amount: {amount} DT")
+            else:
+                # Select predefined amount by value
+                print(f"   Selecting predefined amount: {amount} DT")
+                select.select_by_value(str(amount))
+                print(f"   ✅ Selected {amount} DT")
+                
+        except Exception as amount_error:
+            print(f"   ❌ Amount selection error: {str(amount_error)[:200]}")
+            print("   Taking screenshot for debugging...")
+            try:
+                self.driver.save_screenshot('/tmp/ooredoo_amount_error.png')
+                print(f"   Screenshot saved: /tmp/ooredoo_amount_error.png")
+            except:
+                pass
+            raise
+        
+        time.sleep(1)
+    
+    def _confirm_and_capture(self, timer, details, expected_total=None):
+        """
+        Steps 5-7: both Valider clicks, then capture the payment URL
+        
+        Args:
+            timer (metrics.StageTimer): Timer of the current creation
+            details (dict): Fields added to a successful result
+            expected_total (int): Abort unless the confirmation page shows it
+                (including when no total can be read there)
+        """
+        # Step 5: Click first Valider button
+        print("✅ Clicking Valider (step 1)...")
+        valider_btn = self.driver.find_element(By.XPATH, "//button[contains(text(), 'Valider')]")
+        self.driver.execute_script("arguments[0].click();", valider_btn)
+        
+        time.sleep(3)
+        timer.mark('valider_1')
+        
+        # Step 6: Confirm on the confirmation page
+        print("✅ Clicking Valider (step 2 - confirmation)...")
+        
+        # Wait for confirmation page to load
+        # Should show summary with beneficiary number and amount
+        
+        # Click the second Valider button
+        valider_confirm = self.wait.until(
+            EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Valider')]"))
+        )
+        
+        if expected_total is not None:
+            shown = self._confirmation_amounts()
+            if not shown:
+                print(f"   ❌ Confirmation page shows no total, expected {expected_total} TND")
                 return {
-                    'status': 'success',
-                    'payment_url': payment_url,
-                    'beneficiary': beneficiary_number,
-                    'amount': amount
+                    'status': 'error',
+                    'message': f'Confirmation total not readable (expected {expected_total} TND), not paying'
                 }
-            
-            # Fallback: try to find URL in page source
+            if expected_total not in shown:
+                print(f"   ❌ Confirmation shows {sorted(shown)} TND, expected total {expected_total} TND")
+                return {
+                    'status': 'error',
+                    'message': f'Confirmation total mismatch (expected {expected_total} TND, page shows {sorted(shown)})'
+                }
+            print(f"   ✅ Total {expected_total} TND confirmed")
+        
+        # Set up network logging to capture the redirect
+        print("🔍 Enabling network logging...")
+        self.driver.execute_cdp_cmd('Network.enable', {})
+        
+        # Click confirm button
+        print("💳 Clicking final Valider button...")
+        self.driver.execute_script("arguments[0].click();", valider_confirm)
+        timer.mark('valider_2')
+        
+        # Step 7: Wait for redirect and capture URL
+        print("⏳ Waiting for redirect to payment...")
+        payment_url = None
+        
+        # Wait for navigation to complete
+        time.sleep(5)
+        
+        # Check current URL first (might have been redirected)
+        current_url = self.driver.current_url
+        print(f"   Current URL after click: {current_url}")
+        
+        if 'ipay' in current_url or 'clictopay' in current_url:
+            print("✅ Payment URL obtained from browser redirect!")
+            payment_url = current_url
+        else:
+            # Try to find redirect URL in page source
+            print("   Checking page source for payment URL...")
             page_source = self.driver.page_source
-            if 'ipay' in page_source:
-                import re
-                match = re.search(r'https://[^"\s<>]*ipay[^"\s<>]*', page_source)
-                if match:
-                    payment_url = match.group(0)
-                    # Decode HTML entities
+            print(f"   Page source length: {len(page_source)} chars")
+            
+            # Look for meta refresh tag with URL
+            import re
+            meta_refresh = re.search(r'<meta[^>]*http-equiv=["\']?refresh["\']?[^>]*content=["\']?\d+;\s*url=([^"\'>\s]+)', page_source, re.IGNORECASE)
+            if meta_refresh:
+                payment_url = meta_refresh.group(1)
+                payment_url = payment_url.replace('&amp;', '&')
+                print("   ✅ Found payment URL in meta refresh tag!")
+                print(f"   URL: {payment_url[:80]}...")
+            else:
+                # Try broader ipay search
+                ipay_match = re.search(r'https?://[^"\s<>]*ipay[^"\s<>]*', page_source, re.IGNORECASE)
+                if ipay_match:
+                    payment_url = ipay_match.group(0)
+                    # Clean up HTML entities
                     payment_url = payment_url.replace('&amp;', '&')
-                    print(f"✅ Payment URL found in page source!")
-                    return {
-                        'status': 'success',
-                        'payment_url': payment_url,
-                        'beneficiary': beneficiary_number,
-                        'amount': amount
-                    }
-            
-            print("⚠️  Payment initiated but URL not captured automatically")
-            current_url = self.driver.current_url
+                    # Remove any trailing HTML
+                    payment_url = payment_url.split('"')[0].split("'")[0].split('<')[0]
+                    print("   ✅ Found payment URL in page source!")
+                    print(f"   URL: {payment_url[:80]}...")
+        
+        # If we got the payment URL, return success
+        if payment_url:
+            timer.mark('payment_url_capture')
+            self._emit('PAYMENT_URL_READY', {'payment_url': payment_url})
             return {
-                'status': 'partial_success',
-                'message': 'Reached payment step - check browser for payment URL',
-                'current_url': current_url
-            }
-            
-        except Exception as e:
-            print(f"❌ Error: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return {
-                'status': 'error',
-                'message': str(e)
+                'status': 'success',
+                'payment_url': payment_url,
+                **details
             }
         
-        finally:
-            if self.driver:
-                time.sleep(5)  # Keep browser open to see result
-                # self.driver.quit()  # Uncomment in production
+        # Fallback: try to find URL in page source
+        page_source = self.driver.page_source
+        if 'ipay' in page_source:
+            import re
+            match = re.search(r'https://[^"\s<>]*ipay[^"\s<>]*', page_source)
+            if match:
+                payment_url = match.group(0)
+                # Decode HTML entities
+                payment_url = payment_url.replace('&amp;', '&')
+                print(f"✅ Payment URL found in page source!")
+                timer.mark('payment_url_capture')
+                self._emit('PAYMENT_URL_READY', {'payment_url': payment_url})
+                return {
+                    'status': 'success',
+                    'payment_url': payment_url,
+                    **details
+                }
+        
+        print("⚠️  Payment initiated but URL not captured automatically")
+        metrics.stage_error('payment_url_capture', flow='creditcard')
+        current_url = self.driver.current_url
+        return {
+            'status': 'partial_success',
+            'message': 'Reached payment step - check browser for payment URL',
+            'current_url': current_url
+        }
+    
+    def _confirmation_amounts(self):
+        """Amounts (TND) printed on the confirmation page"""
+        text = self.driver.find_element(By.TAG_NAME, 'body').text
+        amounts = set()
+        for match in re.finditer(r'(\d+(?:[.,]\d+)?)\s*(?:DT|TND|Dinars?)\b', text, re.IGNORECASE):
+            value = float(match.group(1).replace(',', '.'))
+            amounts.add(int(value) if value.is_integer() else value)
+        return amounts
 
 
 def main():
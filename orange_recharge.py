@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Orange Tunisia Recharge - HTTP ENGINE
+Recharges an Orange number with a scratch card code over plain HTTP
+(no browser, no login) - see orange-analysis.md and ORANGE_STATUS.md
+
+    1. GET the recharge page in a cookie session (the CAPTCHA is bound to it)
+    2. Read the math CAPTCHA ("10 + 7 = ?"): from the page text/state when
+       it is rendered as text, otherwise from the CAPTCHA image with a tiny
+       digit/operator OCR
+    3. Evaluate it safely (AST whitelist, no eval)
+    4. POST the topupWithScratchCard GraphQL mutation
+    5. Parse the documented JSON answers into the same result schema as
+       the Ooredoo flows: {'status', 'messages', 'captcha_verdict', ...}
+
+A rejected CAPTCHA is retried with a fresh one in the same session.
+"""
+
+import os
+import re
+import ast
+import sys
+import json
+import time
+import base64
+import operator
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup
+
+ORANGE_BASE_URL = 'https://www.orange.tn'
+RECHARGE_PAGE = '/recharge-par-carte-de-recharge'
+GRAPHQL_PATH = '/graphql'
+
+TOPUP_MUTATION = (
+    'mutation topupWithScratchCard($phone: String!, $code: String!, $captcha: String!) '
+    '{ topupWithScratchCard(phoneNumber: $phone, scratchCode: $code, captchaAnswer: $captcha) }'
+)
+
+DEFAULT_HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+}
+
+# GraphQL error message -> (error code, message shown by the Orange UI, CAPTCHA verdict)
+ORANGE_ERRORS = {
+    'invalidScratch': ('invalid_code', "Le numéro de carte de recharge saisi n'est pas valide.", 'accepted'),
+    'captcha': ('captcha_failed', "La vérification de la captcha a échoué, veuillez réessayer.", 'rejected'),
+}
+
+SUCCESS_MESSAGE = "Opération effectuée avec succès"
+
+# "10 + 7", "10+7=?", "5 x 3", "20 − 8"
+EQUATION_RE = re.compile(r'(\d{1,4})\s*([+\-−xX×*/÷:])\s*(\d{1,4})(?:\s*=\s*\??)?')
+
+OPERATOR_ALIASES = {'−': '-', 'x': '*', 'X': '*', '×': '*', '÷': '/', ':': '/'}
+
+MATH_CHARSET = '0123456789+-x='
+DEFAULT_MATH_BANK = 'orange_math_templates.npz'
+
+_ALLOWED_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+}
+
+
+def solve_math_captcha(equation_text):
+    """
+    Evaluate a CAPTCHA equation such as "10 + 7 = ?" without eval()
+
+    Only integer literals, + - * / and unary minus are accepted.
+
+    Returns:
+        int: The answer
+
+    Raises:
+        ValueError: No equation found, a disallowed expression, or one with
+            no whole-number answer (division by zero or a remainder, i.e.
+            most likely an OCR misread), so the caller fetches a new CAPTCHA
+    """
+    match = EQUATION_RE.search(equation_text or '')
+    if not match:
+        raise ValueError(f"Cannot parse equation: {equation_text!r}")
+
+    left, op, right = match.groups()
+    expression = f"{left} {OPERATOR_ALIASES.get(op, op)} {right}"
+
+    def evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -evaluate(node.operand)
+        if isinstance(node, ast.BinOp) and type(node.op) in _ALLOWED_OPERATORS:
+            try:
+                return _ALLOWED_OPERATORS[type(node.op)](evaluate(node.left), evaluate(node.right))
+            except ZeroDivisionError:
+                raise ValueError(f"Division by zero: {expression!r}")
+        raise ValueError(f"Disallowed expression: {expression!r}")
+
+    result = evaluate(ast.parse(expression, mode='eval'))
+    if isinstance(result, float):
+        if not result.is_integer():
+            raise ValueError(f"No whole-number answer: {expression!r}")
+        result = int(result)
+    return result
+
+
+def find_equation_text(html):
+    """
+    Look for the equation in the page: visible text first, then anything
+    embedded in scripts (SSR state of the Vue/React form)
+
+    Returns:
+        str: Equation text, or None
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Elements whose class/id/label mention the captcha
+    for element in soup.find_all(attrs={'class': re.compile('captcha', re.I)}) + \
+            soup.find_all(id=re.compile('captcha', re.I)):
+        match = EQUATION_RE.search(element.get_text(' ', strip=True))
+        if match:
+            return match.group(0)
+
+    # Equation ending in "= ?" anywhere in the visible text
+    text = soup.get_text(' ', strip=True)
+    for match in EQUATION_RE.finditer(text):
+        if '=' in match.group(0):
+            return match.group(0)
+
+    # Serialized state, e.g. "captcha":{"question":"10 + 7"}
+    state = re.search(r'captcha[^<]{0,80}?["\'](\d{1,4}\s*[+\-−xX×*/÷]\s*\d{1,4})', html, re.I)
+    return state.group(1) if state else None
+
+
+def find_captcha_image_url(html, base_url=ORANGE_BASE_URL):
+    """URL (or data: URI) of the CAPTCHA image in the page, or None"""
+    soup = BeautifulSoup(html, 'html.parser')
+    for img in soup.find_all('img'):
+        src = img.get('src') or ''
+        if 'captcha' in (img.get('alt') or '').lower() or 'captcha' in src.lower():
+            return src if src.startswith('data:') else urljoin(base_url, src)
+    return None
+
+
+def get_math_bank(path=None):
+    """Template bank for digits/operators (None if not trained yet)"""
+    from captcha_template import get_template_bank
+
+    path = path or os.getenv('ORANGE_MATH_BANK', DEFAULT_MATH_BANK)
+    return get_template_bank(path) if os.path.exists(path) else None
+
+
+def read_equation_image(image_bytes):
+    """
+    Tiny digit/operator OCR for image CAPTCHAs
+
+    Uses the template matcher trained on equations (train-ocr), or
+    Tesseract restricted to digits and operators when no bank exists.
+
+    Returns:
+        str: Text read from the image
+    """
+    bank = get_math_bank()
+    if bank is not None:
+        text, _ = bank.recognize(image_bytes)
+        return text
+
+    from captcha_solvers import solve_tesseract
+
+    return solve_tesseract(image_bytes, config=f'--oem 3 --psm 7 -c tessedit_char_whitelist={MATH_CHARSET}')
+
+
+def train_math_bank(count=400, path=DEFAULT_MATH_BANK, seed=0):
+    """
+    Train the digit/operator template bank on rendered equations
+
+    Returns:
+        dict: Training stats plus accuracy on fresh equations
+    """
+    import random
+    from captcha_corpus import generate_synthetic_captcha
+    from captcha_template import TemplateBank
+
+    rng = random.Random(seed)
+
+    def equation():
+        left, right = rng.randint(0, 20), rng.randint(0, 20)
+        op = rng.choice('+-x')
+        return f"{left}{op}{right}="
+
+    samples = [
+        (image, text)
+        for text, image in (generate_synthetic_captcha(equation(), seed=seed + i) for i in range(count))
+    ]
+    bank, stats = TemplateBank.train(samples, length=0)
+    bank.save(path)
+
+    correct = 0
+    for i in range(100):
+        text, image = generate_synthetic_captcha(equation(), seed=seed + count + i)
+        correct += bank.recognize(image)[0] == text
+    stats['accuracy'] = correct / 100.0
+    return stats
+
+
+class OrangeRecharge:
+    """HTTP-only Orange scratch card recharge"""
+
+    def __init__(self, base_url=ORANGE_BASE_URL, timeout=15, session=None):
+        """
+        Args:
+            base_url (str): Orange site root
+            timeout (float): Per-request timeout in seconds
+            session (requests.Session): Reuse an existing session (cookies)
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.session.headers.update({'User-Agent': DEFAULT_HEADERS['User-Agent']})
+
+    def fetch_captcha(self):
+        """
+        Load the recharge page and read its math CAPTCHA
+
+        Returns:
+            dict: {'equation', 'answer', 'source': 'dom' | 'ocr', 'elapsed_ms'}
+        """
+        start = time.perf_counter()
+        page = self.session.get(self.base_url + RECHARGE_PAGE, timeout=self.timeout)
+        page.raise_for_status()
+
+        equation = find_equation_text(page.text)
+        source = 'dom'
+
+        if not equation:
+            image_url = find_captcha_image_url(page.text, self.base_url)
+            if not image_url:
+                raise ValueError("No math CAPTCHA found on the recharge page")
+            if image_url.startswith('data:'):
+                image_bytes = base64.b64decode(image_url.split(',', 1)[1])
+            else:
+                image = self.session.get(image_url, timeout=self.timeout, headers={'Referer': page.url})
+                image.raise_for_status()
+                image_bytes = image.content
+            equation = read_equation_image(image_bytes)
+            source = 'ocr'
+
+        return {
+            'equation': equation,
+            'answer': solve_math_captcha(equation),
+            'source': source,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    def submit(self, phone_number, recharge_code, captcha_answer):
+        """
+        POST the topup mutation
+
+        Returns:
+            dict: Parsed GraphQL JSON
+        """
+        payload = {
+            'operationName': 'topupWithScratchCard',
+            'query': TOPUP_MUTATION,
+            'variables': {
+                'phone': phone_number.replace(' ', ''),
+                'code': recharge_code,
+                'captcha': str(captcha_answer)
+            }
+        }
+        headers = dict(DEFAULT_HEADERS, Origin=self.base_url, Referer=self.base_url + RECHARGE_PAGE)
+        response = self.session.post(self.base_url + GRAPHQL_PATH, json=payload, headers=headers, timeout=self.timeout)
+        try:
+            return response.json()
+        except ValueError:
+            return {'errors': [{'message': f'HTTP {response.status_code}: {response.text[:200]}'}], 'data': None}
+
+    def parse_response(self, result):
+        """
+        Map the GraphQL answer onto the Ooredoo result schema
+
+        Returns:
+            dict: {'status', 'messages', 'error_code', 'captcha_verdict', 'raw'}
+        """
+        response = {
+            'status': 'unknown',
+            'messages': [],
+            'error_code': None,
+            'captcha_verdict': 'unknown',
+            'raw': result
+        }
+
+        errors = result.get('errors') or []
+        if errors:
+            message = errors[0].get('message', '')
+            response['status'] = 'error'
+            response['messages'] = [message]
+            for key, (code, ui_message, verdict) in ORANGE_ERRORS.items():
+                if key.lower() in message.lower():
+                    response['error_code'] = code
+                    response['messages'] = [ui_message]
+                    response['captcha_verdict'] = verdict
+                    break
+            return response
+
+        data = (result.get('data') or {}).get('topupWithScratchCard')
+        if isinstance(data, dict):
+            if data.get('success'):
+                response['status'] = 'success'
+                response['messages'] = [data.get('message') or SUCCESS_MESSAGE]
+                response['balance'] = data.get('balance')
+            elif data.get('message'):
+                response['status'] = 'error'
+                response['messages'] = [data['message']]
+        elif data is True:
+            response['status'] = 'success'
+            response['messages'] = [SUCCESS_MESSAGE]
+        elif data is False:
+            response['status'] = 'error'
+
+        if response['status'] == 'success':
+            response['captcha_verdict'] = 'accepted'
+        return response
+
+    def recharge(self, phone_number, recharge_code, max_attempts=3):
+        """
+        Recharge a number, retrying rejected CAPTCHAs with a fresh one
+
+        Returns:
+            dict: parse_response() result plus 'operator' and 'attempts'
+        """
+        attempts = []
+        response = {'status': 'error', 'messages': ['CAPTCHA retry budget exhausted'], 'captcha_verdict': 'unknown'}
+
+        for number in range(1, max_attempts + 1):
+            metrics = {'attempt': number}
+            try:
+                captcha = self.fetch_captcha()
+            except (requests.RequestException, ValueError) as e:
+                metrics['error'] = str(e)
+                attempts.append(metrics)
+                response = {'status': 'error', 'messages': [str(e)], 'captcha_verdict': 'unknown'}
+                continue
+            metrics.update({k: captcha[k] for k in ('equation', 'answer', 'source')})
+            metrics['captcha_ms'] = captcha['elapsed_ms']
+
+            start = time.perf_counter()
+            try:
+                result = self.submit(phone_number, recharge_code, captcha['answer'])
+            except requests.RequestException as e:
+                metrics['error'] = str(e)
+                attempts.append(metrics)
+                response = {'status': 'error', 'messages': [str(e)], 'captcha_verdict': 'unknown'}
+                continue
+            metrics['submit_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+            response = self.parse_response(result)
+            metrics['verdict'] = response['captcha_verdict']
+            attempts.append(metrics)
+
+            if response['captcha_verdict'] != 'rejected':
+                break
+            print(f"   ❌ CAPTCHA rejected (attempt {number}/{max_attempts}), retrying with a new one...")
+
+        response['operator'] = 'orange'
+        response['attempts'] = attempts
+        return response
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'solve':
+        # Check the equation solver alone, e.g. on an OCR misread
+        try:
+            print(f"✅ {solve_math_captcha(' '.join(sys.argv[2:]))}")
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'train-ocr':
+        path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_MATH_BANK
+        print("🧠 Training digit/operator templates...")
+        print(json.dumps(train_math_bank(path=path), indent=2))
+        print(f"✅ Saved to {path}")
+        return
+
+    if len(sys.argv) < 3:
+        print("Orange Tunisia Recharge - HTTP ENGINE")
+        print()
+        print("Usage: python orange_recharge.py <PHONE> <14-DIGIT-CODE>")
+        print("       python orange_recharge.py train-ocr [bank_path]")
+        print('       python orange_recharge.py solve "10 + 7 = ?"')
+        print()
+        print("Example:")
+        print("  python orange_recharge.py 53028939 12345678901234")
+        print()
+        sys.exit(1)
+
+    phone_number = sys.argv[1]
+    recharge_code = sys.argv[2]
+
+    if len(recharge_code) != 14 or not recharge_code.isdigit():
+        print("❌ Error: Recharge code must be exactly 14 digits")
+        sys.exit(1)
+
+    print(f"🍊 Recharging {phone_number} (Orange, HTTP only)...")
+    response = OrangeRecharge().recharge(phone_number, recharge_code)
+
+    print("\n" + "="*60)
+    print("RESPONSE:")
+    print("="*60)
+    print(f"Status: {response['status']}")
+    for msg in response['messages']:
+        print(f"  • {msg}")
+    for attempt in response['attempts']:
+        print(f"  #{attempt['attempt']}: {attempt.get('equation')} = {attempt.get('answer')} "
+              f"({attempt.get('source')}) -> {attempt.get('verdict', attempt.get('error'))}")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Recharge Order Store (SQLite, WAL mode)
+Durable record of every API recharge job: order row, stage history and payment
+outcome, indexed for status lookups, reconciliation and analytics, plus the
+payment monitors a shutdown checkpointed for the next process to resume
+
+All writes go through one writer thread that commits queued changes in
+batches; readers use their own connections and never block it (WAL).
+"""
+
+import os
+import sys
+import json
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+
+ORDER_DB = os.getenv('ORDER_DB', 'orders.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    job_id          TEXT PRIMARY KEY,
+    account         TEXT,
+    beneficiary     TEXT,
+    amount          INTEGER,
+    status          TEXT NOT NULL,
+    stage           TEXT,
+    message         TEXT,
+    payment_url     TEXT,
+    order_id        TEXT,
+    transaction_id  TEXT,
+    queue_ms        REAL,
+    log_file        TEXT,
+    result          TEXT,
+    version         INTEGER NOT NULL DEFAULT 0,
+    created_at      TEXT NOT NULL,
+    updated_at      TEXT NOT NULL,
+    idempotency_key TEXT
+);
+
+CREATE TABLE IF NOT EXISTS stages (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id      TEXT NOT NULL,
+    status      TEXT,
+    stage       TEXT,
+    at          TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS payment_outcomes (
+    job_id            TEXT PRIMARY KEY,
+    status            TEXT,
+    payment_status    TEXT,
+    detection_method  TEXT,
+    order_id          TEXT,
+    transaction_id    TEXT,
+    amount            TEXT,
+    elapsed_seconds   REAL,
+    redirect_url      TEXT,
+    at                TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job_id       TEXT PRIMARY KEY,
+    order_id     TEXT,
+    payment_url  TEXT NOT NULL,
+    request      TEXT,
+    deadline     TEXT NOT NULL,
+    reason       TEXT,
+    at           TEXT NOT NULL,
+    resumed_at   TEXT,
+    resumed_by   TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders (order_id);
+CREATE INDEX IF NOT EXISTS idx_orders_transaction_id ON orders (transaction_id);
+CREATE INDEX IF NOT EXISTS idx_orders_beneficiary ON orders (beneficiary, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_account ON orders (account, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, updated_at);
+CREATE INDEX IF NOT EXISTS idx_stages_job ON stages (job_id, id);
+CREATE INDEX IF NOT EXISTS idx_checkpoints_open ON checkpoints (resumed_at, at);
+"""
+
+# Columns added after the first release: (name, type, index)
+MIGRATIONS = [
+    ('idempotency_key', 'TEXT', 'CREATE INDEX IF NOT EXISTS idx_orders_idempotency_key ON orders (idempotency_key)'),
+    ('owner', 'TEXT', 'CREATE INDEX IF NOT EXISTS idx_orders_owner ON orders (owner, status)'),
+]
+
+ORDER_COLUMNS = [
+    'job_id', 'account', 'beneficiary', 'amount', 'status', 'stage', 'message', 'payment_url',
+    'order_id', 'transaction_id', 'queue_ms', 'log_file', 'result', 'version', 'created_at', 'updated_at',
+    'idempotency_key', 'owner'
+]
+
+UPSERT_ORDER = (
+    f"INSERT INTO orders ({', '.join(ORDER_COLUMNS)}) VALUES ({', '.join('?' for _ in ORDER_COLUMNS)}) "
+    f"ON CONFLICT(job_id) DO UPDATE SET "
+    + ', '.join(f'{c} = excluded.{c}' for c in ORDER_COLUMNS[1:])
+    + " WHERE excluded.version >= orders.version"
+)
+
+INSERT_STAGE = "INSERT INTO stages (job_id, status, stage, at) VALUES (?, ?, ?, ?)"
+
+UPSERT_OUTCOME = (
+    "INSERT OR REPLACE INTO payment_outcomes (job_id, status, payment_status, detection_method, order_id, "
+    "transaction_id, amount, elapsed_seconds, redirect_url, at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+UPSERT_CHECKPOINT = (
+    "INSERT OR REPLACE INTO checkpoints (job_id, order_id, payment_url, request, deadline, reason, at, "
+    "resumed_at, resumed_by) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL)"
+)
+
+RELEASE_CHECKPOINT = "UPDATE checkpoints SET resumed_at = NULL, resumed_by = NULL WHERE job_id = ?"
+
+# Query filters accepted by find() -> SQL condition
+FIND_FILTERS = {
+    'account': 'account = ?',
+    'beneficiary': 'beneficiary = ?',
+    'status': 'status = ?',
+    'since': 'created_at >= ?',
+    'until': 'created_at < ?',
+}
+
+
+def connect(path, readonly=False):
+    """
+    Open a connection tuned for WAL
+
+    Args:
+        path (str): Database file
+        readonly (bool): Reader connection (query_only)
+
+    Returns:
+        sqlite3.Connection
+    """
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 10000')
+    if readonly:
+        conn.execute('PRAGMA query_only = 1')
+    else:
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
+class OrderStore:
+    """SQLite order store with a batching writer thread and per-thread readers"""
+
+    def __init__(self, path=None, batch_size=256, flush_ms=50):
+        """
+        Args:
+            path (str): Database file (ORDER_DB, default orders.db)
+            batch_size (int): Max queued writes per transaction
+            flush_ms (int): How long the writer gathers a batch after the first write
+        """
+        self.path = path or ORDER_DB
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.pending = queue.Queue()
+        self.local = threading.local()
+        self.stats = {'writes': 0, 'batches': 0, 'errors': 0}
+
+        conn = connect(self.path)
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        conn.close()
+
+        self.writer = threading.Thread(target=self._write_loop, name='order-store-writer', daemon=True)
+        self.writer.start()
+
+    def _migrate(self, conn):
+        """Add columns that databases created by older versions lack"""
+        existing = {row['name'] for row in conn.execute('PRAGMA table_info(orders)')}
+        for column, column_type, index_sql in MIGRATIONS:
+            if column not in existing:
+                conn.execute(f'ALTER TABLE orders ADD COLUMN {column} {column_type}')
+            conn.execute(index_sql)
+
+    # ---- writes (non-blocking, batched) ----
+
+    def save_job(self, job, stage_changed=True):
+        """
+        Queue an upsert of a job (JobStore dict), plus a stage row
+
+        Args:
+            job (dict): Job copy with request/result fields
+            stage_changed (bool): Also append to the stage history
+        """
+        request = job.get('request') or {}
+        row = (
+            job['job_id'], request.get('phone'), request.get('beneficiary'), request.get('amount'),
+            job['status'], job.get('stage'), job.get('message'), job.get('payment_url'),
+            job.get('order_id'), job.get('transaction_id'), job.get('queue_ms'), job.get('log_file'),
+            json.dumps(job['result']) if job.get('result') is not None else None,
+            job.get('version', 0), job['created_at'], job['updated_at'], job.get('idempotency_key'),
+            job.get('owner')
+        )
+        self.pending.put((UPSERT_ORDER, row))
+
+        if stage_changed:
+            self.pending.put((INSERT_STAGE, (job['job_id'], job['status'], job.get('stage'), job['updated_at'])))
+
+    def save_outcome(self, job_id, payment):
+        """
+        Queue the payment outcome of a job
+
+        Args:
+            job_id (str): Job ID
+            payment (dict): PaymentAPIMonitor response
+        """
+        data = payment.get('data') or {}
+        self.pending.put((UPSERT_OUTCOME, (
+            job_id, payment.get('status'), payment.get('payment_status'), data.get('detection_method'),
+            data.get('order_id'), data.get('transaction_id'),
+            str(data['amount']) if data.get('amount') is not None else None,
+            data.get('elapsed_seconds'), data.get('redirect_url'),
+            payment.get('timestamp') or datetime.now().isoformat()
+        )))
+
+    def save_checkpoint(self, job_id, payment_url, deadline, order_id=None, request=None, reason='shutdown'):
+        """
+        Queue a checkpoint of an unfinished payment monitor
+
+        Args:
+            job_id (str): Job ID
+            payment_url (str): ClicToPay payment URL to monitor again
+            deadline (str): ISO time the monitoring timeout runs out
+            order_id (str): Portal / ClicToPay order ID
+            request (dict): Job request (callback URL, checkout lines, ...)
+            reason (str): Why monitoring stopped
+        """
+        self.pending.put((UPSERT_CHECKPOINT, (
+            job_id, order_id, payment_url, json.dumps(request) if request is not None else None,
+            deadline, reason, datetime.now().isoformat()
+        )))
+
+    def claim_checkpoint(self, job_id, owner):
+        """
+        Take an open checkpoint for resuming (synchronous, atomic across
+        processes sharing the database: only one claim succeeds)
+
+        Args:
+            job_id (str): Job ID
+            owner (str): Resuming process (host:pid)
+
+        Returns:
+            bool: True if this caller claimed it
+        """
+        conn = connect(self.path)
+        try:
+            cursor = conn.execute(
+                "UPDATE checkpoints SET resumed_at = ?, resumed_by = ? WHERE job_id = ? AND resumed_at IS NULL",
+                (datetime.now().isoformat(), owner, job_id)
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def release_checkpoint(self, job_id):
+        """Queue reopening a claimed checkpoint (its resume failed)"""
+        self.pending.put((RELEASE_CHECKPOINT, (job_id,)))
+
+    def flush(self, timeout=10):
+        """
+        Block until everything queued so far is committed
+
+        Returns:
+            bool: True if flushed within timeout
+        """
+        done = threading.Event()
+        self.pending.put((None, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        """Flush and stop the writer"""
+        self.flush(timeout)
+        self.pending.put((None, None))
+        self.writer.join(timeout)
+
+    def _write_loop(self):
+        conn = connect(self.path)
+
+        while True:
+            batch = [self.pending.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.pending.get(timeout=self.flush_ms / 1000))
+            except queue.Empty:
+                pass
+
+            statements = [(sql, params) for sql, params in batch if sql is not None]
+            if statements:
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    for sql, params in statements:
+                        conn.execute(sql, params)
+                    conn.execute('COMMIT')
+                    self.stats['writes'] += len(statements)
+                    self.stats['batches'] += 1
+                except sqlite3.Error as e:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    self.stats['errors'] += 1
+                    print(f"❌ Order store write failed ({len(statements)} rows dropped): {e}")
+
+            stop = False
+            for sql, marker in batch:
+                if sql is None:
+                    if marker is None:
+                        stop = True
+                    else:
+                        marker.set()
+
+            if stop:
+                conn.close()
+                return
+
+    # ---- reads (concurrent with the writer) ----
+
+    def _reader(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path, readonly=True)
+        return conn
+
+    def get(self, any_id):
+        """
+        Look up an order by job ID, portal order ID or transaction ID
+
+        Returns:
+            dict: Order row in JobStore job shape (None if unknown)
+        """
+        row = self._reader().execute(
+            "SELECT * FROM orders WHERE job_id = ? "
+            "UNION ALL SELECT * FROM orders WHERE order_id = ? "
+            "UNION ALL SELECT * FROM orders WHERE transaction_id = ? LIMIT 1",
+            (any_id, any_id, any_id)
+        ).fetchone()
+        return self._to_job(row) if row else None
+
+    def get_by_key(self, idempotency_key):
+        """
+        Most recent order created under an idempotency key
+
+        Returns:
+            dict: Order in JobStore job shape (None if unknown)
+        """
+        row = self._reader().execute(
+            "SELECT * FROM orders WHERE idempotency_key = ? ORDER BY created_at DESC LIMIT 1", (idempotency_key,)
+        ).fetchone()
+        return self._to_job(row) if row else None
+
+    def find(self, limit=100, **filters):
+        """
+        Query orders, newest first
+
+        Args:
+            limit (int): Max rows
+            **filters: account, beneficiary, status, since, until (ISO timestamps)
+
+        Returns:
+            list: Orders in JobStore job shape
+        """
+        conditions = []
+        params = []
+        for key, value in filters.items():
+            if key not in FIND_FILTERS:
+                raise ValueError(f"Unknown filter: {key} (use {', '.join(FIND_FILTERS)})")
+            if value is not None:
+                conditions.append(FIND_FILTERS[key])
+                params.append(value)
+
+        sql = "SELECT * FROM orders"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+
+        rows = self._reader().execute(sql, params + [int(limit)]).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def stages(self, job_id):
+        """Stage history of a job, oldest first"""
+        rows = self._reader().execute(
+            "SELECT status, stage, at FROM stages WHERE job_id = ? ORDER BY id", (job_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def outcome(self, job_id):
+        """Payment outcome of a job (None if not finished)"""
+        row = self._reader().execute("SELECT * FROM payment_outcomes WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def checkpoints(self):
+        """Checkpoints not resumed yet, oldest first"""
+        rows = self._reader().execute(
+            "SELECT * FROM checkpoints WHERE resumed_at IS NULL ORDER BY at"
+        ).fetchall()
+        checkpoints = []
+        for row in rows:
+            checkpoint = dict(row)
+            checkpoint['request'] = json.loads(checkpoint['request']) if checkpoint['request'] else None
+            checkpoints.append(checkpoint)
+        return checkpoints
+
+    def status_counts(self, since=None):
+        """
+        Orders per status (for reconciliation / dashboards)
+
+        Args:
+            since (str): Only orders created at or after this ISO timestamp
+
+        Returns:
+            dict: status -> count
+        """
+        sql = "SELECT status, COUNT(*) AS n FROM orders"
+        params = ()
+        if since:
+            sql += " WHERE created_at >= ?"
+            params = (since,)
+        rows = self._reader().execute(sql + " GROUP BY status", params).fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def _to_job(self, row):
+        job = dict(row)
+        job['request'] = {
+            'phone': job.pop('account'),
+            'beneficiary': job.pop('beneficiary'),
+            'amount': job.pop('amount')
+        }
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('get', 'find', 'stats', 'checkpoints'):
+        print("Usage:")
+        print("  python order_store.py get <job_id|order_id|transaction_id>")
+        print("  python order_store.py find [account=..] [beneficiary=..] [status=..] [since=..] [limit=..]")
+        print("  python order_store.py stats [since]")
+        print("  python order_store.py checkpoints    # payment monitors waiting to be resumed")
+        print()
+        print(f"Database: {ORDER_DB} (set ORDER_DB to change)")
+        sys.exit(1)
+
+    store = OrderStore()
+    command = sys.argv[1]
+
+    if command == 'get':
+        order = store.get(sys.argv[2])
+        if order is None:
+            print(f"❌ Unknown order: {sys.argv[2]}")
+            sys.exit(1)
+        order['stages'] = store.stages(order['job_id'])
+        order['outcome'] = store.outcome(order['job_id'])
+        print(json.dumps(order, indent=2))
+
+    elif command == 'find':
+        filters = dict(arg.split('=', 1) for arg in sys.argv[2:])
+        for order in store.find(**filters):
+            print(f"{order['created_at'][:19]}  {order['job_id']}  {order['status']:<16} "
+                  f"{order['request']['phone']} -> {order['request']['beneficiary']}  {order['request']['amount']} TND")
+
+    elif command == 'checkpoints':
+        for checkpoint in store.checkpoints():
+            print(f"{checkpoint['at'][:19]}  {checkpoint['job_id']}  order {checkpoint['order_id'] or '-'}  "
+                  f"until {checkpoint['deadline'][:19]}  {checkpoint['payment_url'][:60]}")
+
+    else:
+        print(json.dumps(store.status_counts(sys.argv[2] if len(sys.argv) > 2 else None), indent=2))
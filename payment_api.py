@@ -7,25 +7,38 @@ Monitors payment flow and returns structured API response
 import time
 import json
 import logging
+import threading
+import browsers
+import metrics
 from datetime import datetime
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from urllib.parse import urlparse, parse_qs
 
 
+# URL fragments of 3-D Secure / ACS authentication pages
+THREE_DS_MARKERS = ['3ds', 'threeds', 'acs.', '/acs', 'securecode', 'verifiedbyvisa', 'authentication', 'challenge']
+
+
 class PaymentFlowLogger:
     """Comprehensive logging of payment flow"""
     
-    def __init__(self, log_file='payment_flow.log'):
+    def __init__(self, log_file='payment_flow.log', on_event=None):
+        """
+        Args:
+            log_file (str): Path to log file (None: console only, e.g. when
+                on_event already writes the events to a LogStore)
+            on_event (callable): Called with each event dict as it is logged
+        """
         self.log_file = log_file
+        self.on_event = on_event
         self.events = []
         
         # Setup structured logging
         logging.basicConfig(
             level=logging.DEBUG,
             format='%(asctime)s [%(levelname)s] %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
+            handlers=([logging.FileHandler(log_file)] if log_file else []) + [
                 logging.StreamHandler()
             ]
         )
@@ -43,6 +56,13 @@ class PaymentFlowLogger:
         # Pretty print for console
         self.logger.info(f"[{event_type}] {json.dumps(data, indent=2)}")
         
+        # Live subscribers (never let them break monitoring)
+        if self.on_event:
+            try:
+                self.on_event(event)
+            except Exception as e:
+                self.logger.warning(f"Event listener failed: {e}")
+        
         return event
     
     def get_summary(self):
@@ -56,9 +76,21 @@ class PaymentFlowLogger:
 class PaymentAPIMonitor:
     """Monitor ICPay payment and return API response"""
     
-    def __init__(self, log_file='payment_flow.log'):
-        self.logger = PaymentFlowLogger(log_file)
+    def __init__(self, log_file='payment_flow.log', on_event=None, include_logs=False, stop=None):
+        """
+        Args:
+            log_file (str): Path to log file
+            on_event (callable): Receives every PaymentFlowLogger event live
+            include_logs (bool): Attach every logged event to the response
+                ('log_summary'); off by default, the log file has them
+            stop (threading.Event): Set to end monitoring early (shutdown);
+                the response is then 'interrupted' with the time left
+        """
+        self.logger = PaymentFlowLogger(log_file, on_event=on_event)
+        self.include_logs = include_logs
+        self.stop = stop or threading.Event()
         self.driver = None
+        self.three_ds_detected = False
         
     def monitor_payment(self, payment_url, timeout_seconds=300):
         """
@@ -74,32 +106,44 @@ class PaymentAPIMonitor:
             'timeout_seconds': timeout_seconds
         })
         
-        # Setup browser
-        try:
-            self._setup_browser()
-            self.logger.log_event('BROWSER_SETUP', {'status': 'success'})
-        except Exception as e:
-            return self._error_response('BROWSER_SETUP_FAILED', str(e))
+        # Already shutting down: hand the payment back without opening a browser
+        if self.stop.is_set():
+            return self._interrupted_response(payment_url, 0, timeout_seconds)
         
-        # Open payment page
         try:
-            self.logger.log_event('OPENING_PAYMENT_PAGE', {'url': payment_url})
-            self.driver.get(payment_url)
+            # Setup browser
+            try:
+                self._setup_browser()
+                self.logger.log_event('BROWSER_SETUP', {'status': 'success'})
+            except Exception as e:
+                return self._error_response('BROWSER_SETUP_FAILED', str(e))
+            
+            # Open payment page
+            try:
+                self.logger.log_event('OPENING_PAYMENT_PAGE', {'url': payment_url})
+                self.driver.get(payment_url)
+                
+                # Log initial page state
+                self._log_page_state('INITIAL_PAGE_LOAD')
+                
+            except Exception as e:
+                return self._error_response('PAGE_LOAD_FAILED', str(e))
             
-            # Log initial page state
-            self._log_page_state('INITIAL_PAGE_LOAD')
+            # Monitor for completion
+            metrics.gauge_add('recharge_active_monitors', 1)
+            try:
+                with metrics.timed('payment_detection', flow='creditcard'):
+                    result = self._monitor_loop(payment_url, timeout_seconds)
+            finally:
+                metrics.gauge_add('recharge_active_monitors', -1)
+            metrics.inc('recharge_outcomes_total', outcome=result.get('status', 'unknown'),
+                        detection_method=result.get('data', {}).get('detection_method', 'none'), flow='creditcard')
             
-        except Exception as e:
-            return self._error_response('PAGE_LOAD_FAILED', str(e))
-        
-        # Monitor for completion
-        result = self._monitor_loop(payment_url, timeout_seconds)
-        
-        # Cleanup
-        self._cleanup_browser()
-        
-        # Return API response
-        return result
+            # Return API response
+            return result
+        finally:
+            # Cleanup on every path (a failed page load used to leave Chrome open)
+            self._cleanup_browser()
     
     def _setup_browser(self):
         """Setup Chrome browser"""
@@ -108,7 +152,15 @@ class PaymentAPIMonitor:
         chrome_options.add_argument('--disable-dev-shm-usage')
         # chrome_options.add_argument('--headless')  # Uncomment for headless mode
         
-        self.driver = webdriver.Chrome(options=chrome_options)
+        started = time.perf_counter()
+        try:
+            self.driver = webdriver.Chrome(options=chrome_options)
+        except Exception:
+            metrics.stage_error('browser_launch', flow='payment_monitor')
+            raise
+        metrics.observe('browser_launch', time.perf_counter() - started, flow='payment_monitor')
+        metrics.gauge_add('recharge_live_browsers', 1)
+        browsers.register(self.driver, 'payment_monitor')
         self.driver.set_page_load_timeout(30)
         
     def _monitor_loop(self, initial_url, timeout_seconds):
@@ -127,8 +179,12 @@ class PaymentAPIMonitor:
         seen_urls = set([initial_url])
         
         while time.time() - start_time < timeout_seconds:
+            # Shutdown: stop here, the caller checkpoints the payment
+            if self.stop.is_set():
+                return self._interrupted_response(initial_url, time.time() - start_time, timeout_seconds)
+            
             check_count += 1
-            time.sleep(1)  # Check every 1 second (faster polling)
+            self.stop.wait(1)  # Check every 1 second (faster polling), wakes at once on stop
             
             elapsed = time.time() - start_time
             
@@ -176,6 +232,10 @@ class PaymentAPIMonitor:
                 except Exception as iframe_error:
                     pass  # Iframe check failed, continue
                 
+                # 3-D Secure step (top window or an iframe), reported once
+                if not self.three_ds_detected:
+                    self._check_3ds(new_url, elapsed)
+                
                 # URL changed - redirect detected
                 if new_url != current_url and new_url not in seen_urls:
                     self.logger.log_event('REDIRECT_DETECTED', {
@@ -221,6 +281,25 @@ class PaymentAPIMonitor:
         # Timeout
         return self._timeout_response(timeout_seconds)
     
+    def _check_3ds(self, current_url, elapsed):
+        """Log THREE_DS_DETECTED when the card holder reaches the 3DS/ACS page"""
+        try:
+            urls = [current_url] + (self.driver.execute_script(
+                "return Array.from(document.getElementsByTagName('iframe')).map(function(f) { return f.src || ''; });"
+            ) or [])
+        except Exception:
+            urls = [current_url]
+        
+        for url in urls:
+            host_and_path = urlparse(url).netloc.lower() + urlparse(url).path.lower()
+            if any(marker in host_and_path for marker in THREE_DS_MARKERS):
+                self.three_ds_detected = True
+                self.logger.log_event('THREE_DS_DETECTED', {
+                    'url': url[:100] + '...' if len(url) > 100 else url,
+                    'elapsed_seconds': round(elapsed, 1)
+                })
+                return
+    
     def _parse_redirect(self, url):
         """Parse redirect URL for payment status"""
         
@@ -408,7 +487,8 @@ class PaymentAPIMonitor:
         })
         
         # Add log summary at the end (after logging completion)
-        response['log_summary'] = self.logger.get_summary()
+        if self.include_logs:
+            response['log_summary'] = self.logger.get_summary()
         
         return response
     
@@ -431,21 +511,30 @@ class PaymentAPIMonitor:
         })
         
         # Add log summary at the end
-        response['log_summary'] = self.logger.get_summary()
+        if self.include_logs:
+            response['log_summary'] = self.logger.get_summary()
         
         return response
     
-    def _timeout_response(self, timeout_seconds):
-        """Format timeout response"""
+    def _final_url_check(self, reason):
+        """
+        Last look at the browser's URL before giving up on a payment
         
+        Args:
+            reason (str): Event prefix ('TIMEOUT', 'INTERRUPTED')
+        
+        Returns:
+            tuple: (last_url, redirect_result) - redirect_result is None
+                unless the page already shows the payment outcome
+        """
         last_url = None
         try:
             if self.driver:
                 last_url = self.driver.execute_script("return window.location.href;")
                 
-                # If we timed out but we're on Ooredoo's page, try to parse it
+                # If we stopped but we're on Ooredoo's page, try to parse it
                 if last_url and 'espaceclient.ooredoo' in last_url:
-                    self.logger.log_event('TIMEOUT_ON_OOREDOO_PAGE', {
+                    self.logger.log_event(f'{reason}_ON_OOREDOO_PAGE', {
                         'url': last_url,
                         'attempting_parse': True
                     })
@@ -453,10 +542,51 @@ class PaymentAPIMonitor:
                     # Try to parse the URL we ended up on
                     redirect_result = self._parse_redirect(last_url)
                     if redirect_result['status'] != 'unknown':
-                        # We found the status even though we timed out!
-                        return self._success_response(redirect_result, timeout_seconds)
+                        return last_url, redirect_result
         except Exception as e:
-            self.logger.log_event('TIMEOUT_URL_CHECK_ERROR', {'error': str(e)})
+            self.logger.log_event(f'{reason}_URL_CHECK_ERROR', {'error': str(e)})
+        
+        return last_url, None
+    
+    def _interrupted_response(self, payment_url, elapsed_seconds, timeout_seconds):
+        """Format interrupted response (monitoring stopped by shutdown, payment may still complete)"""
+        
+        last_url, redirect_result = self._final_url_check('INTERRUPTED')
+        if redirect_result:
+            return self._success_response(redirect_result, elapsed_seconds)
+        
+        response = {
+            'success': False,
+            'status': 'interrupted',
+            'payment_status': 'pending',
+            'message': f'Payment monitoring interrupted after {round(elapsed_seconds)} seconds (shutdown)',
+            'data': {
+                'payment_url': payment_url,
+                'elapsed_seconds': round(elapsed_seconds, 1),
+                'remaining_seconds': max(0, round(timeout_seconds - elapsed_seconds)),
+                'last_url': last_url
+            },
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        self.logger.log_event('MONITORING_INTERRUPTED', {
+            'elapsed_seconds': response['data']['elapsed_seconds'],
+            'remaining_seconds': response['data']['remaining_seconds']
+        })
+        
+        # Add log summary at the end
+        if self.include_logs:
+            response['log_summary'] = self.logger.get_summary()
+        
+        return response
+    
+    def _timeout_response(self, timeout_seconds):
+        """Format timeout response"""
+        
+        last_url, redirect_result = self._final_url_check('TIMEOUT')
+        if redirect_result:
+            # We found the status even though we timed out!
+            return self._success_response(redirect_result, timeout_seconds)
         
         response = {
             'success': False,
@@ -477,7 +607,8 @@ class PaymentAPIMonitor:
         })
         
         # Add log summary at the end
-        response['log_summary'] = self.logger.get_summary()
+        if self.include_logs:
+            response['log_summary'] = self.logger.get_summary()
         
         return response
     
@@ -486,10 +617,14 @@ class PaymentAPIMonitor:
         if self.driver:
             try:
                 self.logger.log_event('CLEANUP', {'status': 'closing_browser'})
-                time.sleep(3)  # Keep open briefly so user can see final state
+                browsers.unregister(self.driver)
+                if not self.stop.is_set():
+                    time.sleep(3)  # Keep open briefly so user can see final state
                 self.driver.quit()
             except Exception as e:
                 self.logger.log_event('CLEANUP_ERROR', {'error': str(e)})
+            metrics.gauge_add('recharge_live_browsers', -1)
+            self.driver = None
 
 
 def monitor_payment_api(payment_url, timeout_seconds=300, log_file='payment_flow.log'):
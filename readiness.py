@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Liveness and Readiness Probes
+What the load balancer asks before sending this node more recharges
+
+- live:  the process can still make progress (worker threads and store
+         writers are running); a failure means "restart me"
+- ready: the node has capacity for new work; a failure means "send the
+         next request elsewhere", and clears by itself as load drains
+
+Readiness checks, each against a threshold (environment variables):
+    free_slots      idle workers                 >= READY_MIN_FREE_SLOTS (1)
+    queue_depth     jobs waiting for a worker    <= READY_MAX_QUEUE_DEPTH (worker count)
+    memory          MemAvailable in MB           >= READY_MIN_MEMORY_MB (RECHARGE_BROWSER_MB)
+    portal_latency  p95 login/navigation seconds <= READY_MAX_PORTAL_SECONDS (30)
+                    over the last READY_WINDOW_SECONDS (300)
+    browser         Chrome launch failures       <  READY_MAX_BROWSER_FAILURES (3)
+                    over the same window
+    ocr_service     CAPTCHA service /health ok   (only when CAPTCHA_SERVICE_URL is set)
+    accepting       scheduler not shutting down
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+
+import metrics
+from job_scheduler import BROWSER_MB, available_memory_mb
+
+
+# Stages that are mostly portal round-trips
+PORTAL_STAGES = ('login', 'navigation')
+
+# Seconds a CAPTCHA service health answer is reused
+OCR_CHECK_SECONDS = 10
+
+
+def default_thresholds(workers, max_queue):
+    """
+    Readiness thresholds from the environment
+
+    Args:
+        workers (int): Scheduler worker count (default queue depth limit)
+        max_queue (int): Scheduler queue capacity (caps the queue depth limit)
+
+    Returns:
+        dict: Threshold per check
+    """
+    return {
+        'min_free_slots': int(os.getenv('READY_MIN_FREE_SLOTS', '1')),
+        'max_queue_depth': min(int(os.getenv('READY_MAX_QUEUE_DEPTH', str(workers))), max_queue),
+        'min_memory_mb': int(os.getenv('READY_MIN_MEMORY_MB', str(BROWSER_MB))),
+        'max_portal_seconds': float(os.getenv('READY_MAX_PORTAL_SECONDS', '30')),
+        'max_browser_failures': int(os.getenv('READY_MAX_BROWSER_FAILURES', '3')),
+        'window_seconds': int(os.getenv('READY_WINDOW_SECONDS', '300')),
+    }
+
+
+class ReadinessProbe:
+    """Liveness and capacity checks over a RechargeJobs instance"""
+
+    def __init__(self, jobs, thresholds=None, captcha_url=None):
+        """
+        Args:
+            jobs (RechargeJobs): Job runner (scheduler, stores)
+            thresholds (dict): Overrides for default_thresholds()
+            captcha_url (str): CAPTCHA service to check (CAPTCHA_SERVICE_URL;
+                no OCR check if unset)
+        """
+        self.jobs = jobs
+        self.thresholds = default_thresholds(jobs.scheduler.workers, jobs.scheduler.max_queue)
+        self.thresholds.update(thresholds or {})
+        self.captcha_url = captcha_url if captcha_url is not None else os.getenv('CAPTCHA_SERVICE_URL')
+        self.ocr_lock = threading.Lock()
+        self.ocr_state = None  # (checked_at, check)
+
+    def live(self):
+        """
+        Liveness: worker threads and store writer threads are running
+
+        Returns:
+            tuple: (ok, body)
+        """
+        threads = {'workers': self.jobs.scheduler.threads}
+        if self.jobs.store.orders is not None:
+            threads['order_store_writer'] = [self.jobs.store.orders.writer]
+        threads['log_store_writer'] = [self.jobs.logs.writer]
+
+        checks = {}
+        for name, group in threads.items():
+            alive = sum(1 for thread in group if thread.is_alive())
+            checks[name] = {'ok': alive == len(group), 'alive': alive, 'expected': len(group)}
+
+        return self._body(checks, 'alive', 'dead')
+
+    def ready(self):
+        """
+        Readiness: every capacity check is within its threshold
+
+        Returns:
+            tuple: (ok, body) - body lists each check's value and threshold
+        """
+        limits = self.thresholds
+        snapshot = self.jobs.scheduler.snapshot()
+        free_slots = snapshot['workers'] - snapshot['running']
+        memory_mb = available_memory_mb()
+        portal = metrics.recent(PORTAL_STAGES, limits['window_seconds'])
+        browser = metrics.recent(('browser_launch',), limits['window_seconds'])
+
+        checks = {
+            'accepting': {'ok': snapshot['accepting'], 'value': snapshot['accepting']},
+            'free_slots': {
+                'ok': free_slots >= limits['min_free_slots'],
+                'value': free_slots,
+                'threshold': limits['min_free_slots']
+            },
+            'queue_depth': {
+                'ok': snapshot['queued'] <= limits['max_queue_depth'],
+                'value': snapshot['queued'],
+                'threshold': limits['max_queue_depth']
+            },
+            'memory': {
+                # Unknown memory (non-Linux without sysconf) never blocks traffic
+                'ok': memory_mb is None or memory_mb >= limits['min_memory_mb'],
+                'value': memory_mb,
+                'threshold': limits['min_memory_mb']
+            },
+            'portal_latency': {
+                'ok': portal['p95'] is None or portal['p95'] <= limits['max_portal_seconds'],
+                'value': portal['p95'],
+                'threshold': limits['max_portal_seconds'],
+                'samples': portal['count']
+            },
+            'browser': {
+                'ok': browser['errors'] < limits['max_browser_failures'],
+                'value': browser['errors'],
+                'threshold': limits['max_browser_failures'],
+                'launches': browser['count']
+            },
+        }
+        if self.captcha_url:
+            checks['ocr_service'] = self._ocr_check()
+
+        return self._body(checks, 'ready', 'not_ready')
+
+    def _ocr_check(self):
+        """CAPTCHA service health, cached for OCR_CHECK_SECONDS"""
+        with self.ocr_lock:
+            if self.ocr_state and time.time() - self.ocr_state[0] < OCR_CHECK_SECONDS:
+                return self.ocr_state[1]
+
+        from captcha_service import CaptchaServiceClient
+        try:
+            health = CaptchaServiceClient(self.captcha_url, timeout=2, max_retries=0).health()
+            check = {'ok': health.get('status') == 'ok', 'value': health.get('status'),
+                     'solvers': health.get('solvers')}
+        except Exception as e:
+            check = {'ok': False, 'value': 'unreachable', 'error': str(e)[:120]}
+
+        with self.ocr_lock:
+            self.ocr_state = (time.time(), check)
+        return check
+
+    def _body(self, checks, good, bad):
+        ok = all(check['ok'] for check in checks.values())
+        return ok, {
+            'status': good if ok else bad,
+            'failing': [name for name, check in checks.items() if not check['ok']],
+            'checks': checks,
+            'timestamp': datetime.now().isoformat()
+        }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print("Usage: python readiness.py")
+        print("Prints the readiness thresholds this node would use")
+        sys.exit(0)
+
+    from job_scheduler import default_workers
+    workers = default_workers()
+    print(json.dumps(default_thresholds(workers, int(os.getenv('RECHARGE_QUEUE', str(workers * 2)))), indent=2))
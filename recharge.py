@@ -7,8 +7,6 @@ Fully automated recharge with AI CAPTCHA solving
 import os
 import sys
 import time
-import base64
-import requests
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -16,6 +14,11 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from bs4 import BeautifulSoup
 
+import metrics
+from captcha_capture import capture_captcha
+from captcha_retry import CaptchaRetryEngine
+from captcha_solvers import BackgroundSolve, join_captcha, solve_vision
+
 class OoredooRecharge:
     def __init__(self, headless=True, vision_api_key=None):
         self.headless = headless
@@ -23,6 +26,7 @@ class OoredooRecharge:
         self.driver = None
         self.setup_driver()
         
+    @metrics.timed('browser_launch', flow='voucher')
     def setup_driver(self):
         """Initialize Chrome driver"""
         chrome_options = Options()
@@ -35,9 +39,11 @@ class OoredooRecharge:
         chrome_options.add_experimental_option('useAutomationExtension', False)
         
         self.driver = webdriver.Chrome(options=chrome_options)
+        metrics.gauge_add('recharge_live_browsers', 1)
         self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
         print("✅ Browser initialized")
         
+    @metrics.timed('login', flow='voucher')
     def login(self, username="27865121", password="espaceclient.ooredoo.tn%2F"):
         """Login to Ooredoo portal"""
         print(f"🔐 Logging in as {username}...")
@@ -64,6 +70,7 @@ class OoredooRecharge:
         time.sleep(3)
         print("✅ Logged in")
         
+    @metrics.timed('navigation', flow='voucher')
     def navigate_to_recharge(self):
         """Navigate to recharge card page"""
         print("📱 Navigating to recharge page...")
@@ -71,57 +78,27 @@ class OoredooRecharge:
         time.sleep(2)
         print("✅ On recharge page")
         
-    def solve_captcha_vision(self):
-        """Solve CAPTCHA using OpenAI Vision API"""
+    @metrics.timed('captcha_solve', flow='voucher')
+    def solve_captcha_vision(self, captcha_png=None):
+        """
+        Solve CAPTCHA using OpenAI Vision API
+
+        Args:
+            captcha_png (bytes): Already captured image (captured now if None;
+                safe to call from a worker thread when given)
+        """
         print("🔍 Solving CAPTCHA...")
         
-        # Find and screenshot captcha
-        captcha_img = self.driver.find_element(By.CSS_SELECTOR, 'img[alt="captcha"]')
-        captcha_png = captcha_img.screenshot_as_png
-        captcha_b64 = base64.b64encode(captcha_png).decode('utf-8')
-        
-        # Call OpenAI Vision
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.vision_api_key}'
-        }
-        
-        payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Read the text shown in this CAPTCHA image. Return ONLY the characters you see, no explanation, no quotes, just the text."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{captcha_b64}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 50
-        }
-        
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers=headers,
-            json=payload
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            captcha_text = result['choices'][0]['message']['content'].strip()
-            print(f"✅ CAPTCHA solved: {captcha_text}")
-            return captcha_text
-        else:
-            raise Exception(f"Vision API error: {response.text}")
+        # Read the original CAPTCHA bytes (element screenshot only as fallback)
+        if captcha_png is None:
+            capture = capture_captcha(self.driver)
+            captcha_png = capture['image']
+            print(f"   Captured via {capture['method']} ({capture['elapsed_ms']}ms)")
+        captcha_text = solve_vision(captcha_png, api_key=self.vision_api_key)
+        print(f"✅ CAPTCHA solved: {captcha_text}")
+        return captcha_text
             
+    @metrics.timed('submit', flow='voucher')
     def submit_recharge(self, phone_number, recharge_code, captcha_text=None):
         """Submit recharge form"""
         print(f"\n📝 Submitting recharge...")
@@ -130,11 +107,12 @@ class OoredooRecharge:
         
         wait = WebDriverWait(self.driver, 10)
         
-        # Auto-solve captcha if not provided
+        # Auto-solve captcha if not provided: grab the image now and solve it
+        # on a worker thread while this thread fills the rest of the form
         if not captcha_text:
-            captcha_text = self.solve_captcha_vision()
-        
-        print(f"   CAPTCHA: {captcha_text}")
+            capture = capture_captcha(self.driver)
+            print(f"   Captured CAPTCHA via {capture['method']} ({capture['elapsed_ms']}ms)")
+            captcha_text = BackgroundSolve(self.solve_captcha_vision, capture['image'])
         
         # Select phone number radio (my number)
         try:
@@ -161,8 +139,15 @@ class OoredooRecharge:
                 print("   ✅ Filled recharge code")
                 break
         
-        # Fill captcha (second input)
         time.sleep(0.5)
+        
+        # Join the CAPTCHA solve only now that it is needed
+        captcha_text, captcha_timing = join_captcha(captcha_text)
+        print(f"   CAPTCHA: {captcha_text}")
+        if captcha_timing:
+            print(f"   ⏱️  Solve {captcha_timing['solve_ms']}ms, {captcha_timing['hidden_ms']}ms hidden behind form filling")
+        
+        # Fill captcha (second input)
         captcha_inputs = self.driver.find_elements(By.CSS_SELECTOR, 'input[type="text"]')
         if len(captcha_inputs) >= 2:
             captcha_input = captcha_inputs[-1]  # Last text input
@@ -180,7 +165,9 @@ class OoredooRecharge:
         time.sleep(3)
         
         # Get response
-        return self.parse_response()
+        response = self.parse_response()
+        response['captcha_timing'] = captcha_timing
+        return response
         
     def parse_response(self):
         """Parse page response (success or error)"""
@@ -224,6 +211,8 @@ class OoredooRecharge:
         """Close browser"""
         if self.driver:
             self.driver.quit()
+            metrics.gauge_add('recharge_live_browsers', -1)
+            self.driver = None
             print("🔒 Browser closed")
 
 def main():
@@ -250,8 +239,12 @@ def main():
         # Navigate to recharge
         bot.navigate_to_recharge()
         
-        # Submit recharge (auto-solves captcha)
-        response = bot.submit_recharge("27865121", recharge_code)
+        # Submit recharge (auto-solves captcha, retries wrong CAPTCHAs in-session)
+        engine = CaptchaRetryEngine(
+            bot, lambda image: solve_vision(image, api_key=bot.vision_api_key), max_attempts=3
+        )
+        response = engine.submit("27865121", recharge_code)
+        print(f"\n🔁 CAPTCHA attempts: {len(response['attempts'])}")
         
         # Print response
         print("\n" + "="*60)
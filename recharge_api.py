@@ -15,10 +15,21 @@ from payment_api import PaymentAPIMonitor
 class RechargeAPI:
     """Complete recharge API with logging and structured responses"""
     
-    def __init__(self, log_file='recharge_api.log'):
+    def __init__(self, log_file='recharge_api.log', include_logs=False, stop=None):
+        """
+        Args:
+            log_file (str): Payment monitoring log file (None: console only)
+            include_logs (bool): Put every monitoring event in the response's
+                'logs' list (it stays empty by default)
+            stop (threading.Event): Set at shutdown to end payment monitoring
+                early (stage 'payment_interrupted')
+        """
         self.log_file = log_file
+        self.include_logs = include_logs
+        self.stop = stop
         
-    def execute_recharge(self, phone, password, beneficiary, amount, timeout_seconds=300):
+    def execute_recharge(self, phone, password, beneficiary, amount, timeout_seconds=300, on_created=None, on_event=None,
+                         recharger=None, lines=None):
         """
         Execute complete recharge flow
         
@@ -28,9 +39,20 @@ class RechargeAPI:
             beneficiary (str): Number to recharge
             amount (int): Amount in TND
             timeout_seconds (int): Payment monitoring timeout
+            on_created (callable): Called with the recharge dict as soon as
+                the payment URL is known, before monitoring starts
+            on_event (callable): Called with (event_type, data) for creation
+                milestones and every payment monitoring event
+            recharger (OoredooCreditCardRecharge): Long-lived instance whose
+                logged-in session is reused (and kept open) when it belongs
+                to the same account
+            lines (list): Multi-line checkout - dicts with 'amount' and
+                'beneficiaries', all paid with one payment (beneficiary and
+                amount then only describe the order)
         
         Returns:
-            dict: Complete API response
+            dict: Complete API response ('lines' with each line's outcome
+                for a checkout)
         """
         
         api_response = {
@@ -40,6 +62,7 @@ class RechargeAPI:
                 'amount': amount,
                 'timestamp': datetime.now().isoformat()
             },
+            **({'lines': lines} if lines else {}),
             'recharge': None,
             'payment': None,
             'success': False,
@@ -53,13 +76,35 @@ class RechargeAPI:
         print("=" * 70)
         
         try:
-            recharger = OoredooCreditCardRecharge()
-            recharge_result = recharger.recharge(
-                username=phone,
-                password=password,
-                beneficiary_number=beneficiary,
-                amount=amount
-            )
+            if lines:
+                if recharger is None:
+                    recharger = OoredooCreditCardRecharge(on_event=on_event)
+                    keep_session = False
+                else:
+                    recharger.on_event = on_event
+                    keep_session = True
+                recharge_result = recharger.checkout(
+                    username=phone,
+                    password=password,
+                    lines=lines,
+                    keep_session=keep_session
+                )
+            elif recharger is None:
+                recharge_result = OoredooCreditCardRecharge(on_event=on_event).recharge(
+                    username=phone,
+                    password=password,
+                    beneficiary_number=beneficiary,
+                    amount=amount
+                )
+            else:
+                recharger.on_event = on_event
+                recharge_result = recharger.recharge(
+                    username=phone,
+                    password=password,
+                    beneficiary_number=beneficiary,
+                    amount=amount,
+                    keep_session=True
+                )
             
             api_response['recharge'] = {
                 'status': recharge_result.get('status'),
@@ -80,6 +125,9 @@ class RechargeAPI:
             print(f"✅ Recharge created successfully")
             print(f"   Payment URL: {payment_url[:70]}...")
             
+            if on_created:
+                on_created(api_response['recharge'])
+            
         except Exception as e:
             api_response['success'] = False
             api_response['message'] = f"Recharge creation error: {str(e)}"
@@ -89,6 +137,37 @@ class RechargeAPI:
             return api_response
         
         # Step 2: Monitor payment
+        return self.monitor_payment(payment_url, timeout_seconds, on_event=on_event, api_response=api_response,
+                                    lines=lines, total=amount)
+    
+    def monitor_payment(self, payment_url, timeout_seconds=300, on_event=None, api_response=None, lines=None,
+                        total=None):
+        """
+        Monitor an already created payment (step 2 of execute_recharge)
+        
+        Args:
+            payment_url (str): ClicToPay payment URL
+            timeout_seconds (int): Payment monitoring timeout
+            on_event (callable): Called with (event_type, data) for every
+                payment monitoring event
+            api_response (dict): Response to complete (a new one if None)
+            lines (list): Checkout lines the payment covers (adds 'lines'
+                and 'amount_verified')
+            total (int): Checkout total in TND (with lines)
+        
+        Returns:
+            dict: Complete API response ('payment', 'stage', 'success', ...)
+        """
+        if api_response is None:
+            api_response = {
+                'request': {'payment_url': payment_url, 'timestamp': datetime.now().isoformat()},
+                'recharge': {'status': 'success', 'payment_url': payment_url},
+                'payment': None,
+                'success': False,
+                'message': None,
+                'logs': []
+            }
+        
         print("\n" + "=" * 70)
         print("STEP 2: MONITORING PAYMENT")
         print("=" * 70)
@@ -97,8 +176,16 @@ class RechargeAPI:
         print()
         
         try:
-            monitor = PaymentAPIMonitor(log_file=self.log_file)
+            monitor = PaymentAPIMonitor(
+                log_file=self.log_file,
+                on_event=(lambda event: on_event(event['event_type'], event['data'])) if on_event else None,
+                include_logs=self.include_logs,
+                stop=self.stop
+            )
             payment_result = monitor.monitor_payment(payment_url, timeout_seconds)
+            if 'log_summary' in payment_result:
+                # Once, at the top level, instead of nested in the payment result
+                api_response['logs'] = payment_result.pop('log_summary')['events']
             
             api_response['payment'] = payment_result
             
@@ -124,6 +211,13 @@ class RechargeAPI:
                 
                 print("\n⏱️  PAYMENT TIMEOUT!")
                 
+            elif payment_result.get('status') == 'interrupted':
+                api_response['success'] = False
+                api_response['message'] = 'Payment monitoring interrupted by shutdown'
+                api_response['stage'] = 'payment_interrupted'
+                
+                print("\n⏸️  PAYMENT MONITORING INTERRUPTED!")
+                
             else:
                 api_response['success'] = False
                 api_response['message'] = f"Unknown payment status: {payment_result.get('status')}"
@@ -142,9 +236,72 @@ class RechargeAPI:
         # Add timestamp
         api_response['completed_at'] = datetime.now().isoformat()
         
+        if lines:
+            api_response['lines'] = line_outcomes(lines, api_response.get('payment'))
+            paid = (api_response.get('payment') or {}).get('data', {}).get('amount')
+            api_response['amount_verified'] = amount_matches(paid, total)
+            if api_response['success'] and not api_response['amount_verified']:
+                # Paid, but not what was ordered: no line can be reported as recharged
+                api_response['success'] = False
+                api_response['stage'] = 'amount_mismatch'
+                api_response['message'] = f"Paid amount {paid} does not match checkout total {total} TND"
+                for line in api_response['lines']:
+                    line['status'] = 'unverified'
+                    for beneficiary in line['beneficiaries']:
+                        beneficiary['status'] = 'unverified'
+                print(f"\n⚠️  {api_response['message']}")
+        
         return api_response
 
 
+def amount_matches(paid, total):
+    """
+    True if a reported payment amount equals the order total (or is unknown)
+    
+    ClicToPay reports either TND ("20.000") or millimes ("20000").
+    """
+    if paid in (None, ''):
+        return True
+    try:
+        value = float(str(paid).replace(',', '.'))
+    except ValueError:
+        return False
+    return abs(value - total) < 0.001 or abs(value - total * 1000) < 0.5
+
+
+def line_outcomes(lines, payment):
+    """
+    Map the single checkout payment back to each line and beneficiary
+    
+    Args:
+        lines (list): Checkout lines ('amount', 'beneficiaries')
+        payment (dict): Payment monitoring result (None if never monitored)
+    
+    Returns:
+        list: One dict per line with its status and per-beneficiary entries
+    """
+    payment = payment or {}
+    status = payment.get('status') or 'error'
+    data = payment.get('data') or {}
+    outcomes = []
+    for number, line in enumerate(lines, 1):
+        outcomes.append({
+            'line': number,
+            'amount': line['amount'],
+            'status': status,
+            'beneficiaries': [
+                {
+                    'beneficiary': beneficiary,
+                    'amount': line['amount'],
+                    'status': status,
+                    'transaction_id': data.get('transaction_id')
+                }
+                for beneficiary in line['beneficiaries']
+            ]
+        })
+    return outcomes
+
+
 def api_recharge(phone, password, beneficiary, amount, timeout_seconds=300, log_file='recharge_api.log'):
     """
     Convenience function for API recharge
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Async Recharge Layer
+Coroutine front-end of RechargeJobs for event-loop servers (asgi_server.py)
+
+Nothing here blocks the loop:
+- the Selenium flows (creation + payment monitoring) already run on the
+  JobScheduler's worker threads, the dedicated browser executor
+- short blocking calls (job submit, SQLite lookups) go to a small thread
+  pool of their own, so a slow disk never stalls open connections
+- waiting for a job to change parks a one-shot EventBus callback that
+  resolves a future, so an idle client costs one future, not a thread
+
+Cancelling a coroutine (client disconnected) removes its bus callback; a
+job that is still queued can be withdrawn with cancel().
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from recharge_jobs import MAX_WAIT_SECONDS, TERMINAL_STATUSES
+
+
+# Threads for short blocking calls (SQLite reads, job submission)
+IO_THREADS = int(os.getenv('ASYNC_IO_THREADS', '8'))
+
+
+class AsyncRechargeJobs:
+    """Awaitable submit / lookup / wait on top of RechargeJobs and its EventBus"""
+
+    def __init__(self, jobs, io_threads=None):
+        """
+        Args:
+            jobs (RechargeJobs): Job runner whose store has an EventBus
+            io_threads (int): Threads for blocking store calls (ASYNC_IO_THREADS)
+        """
+        if jobs.store.bus is None:
+            raise ValueError('AsyncRechargeJobs needs a JobStore with an EventBus')
+        self.jobs = jobs
+        self.bus = jobs.store.bus
+        self.executor = ThreadPoolExecutor(max_workers=io_threads or IO_THREADS, thread_name_prefix='recharge-io')
+
+    async def _offload(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def submit(self, **params):
+        """
+        Queue a recharge (RechargeJobs.submit() arguments)
+
+        Returns:
+            tuple: (job, created)
+        """
+        return await self._offload(self.jobs.submit, **params)
+
+    async def submit_batch(self, **params):
+        """
+        Queue a batch (RechargeJobs.submit_batch() arguments)
+
+        Returns:
+            tuple: (batch job, created)
+        """
+        return await self._offload(self.jobs.submit_batch, **params)
+
+    async def submit_checkout(self, **params):
+        """
+        Queue a multi-line checkout (RechargeJobs.submit_checkout() arguments)
+
+        Returns:
+            tuple: (job, created)
+        """
+        return await self._offload(self.jobs.submit_checkout, **params)
+
+    async def get(self, any_id):
+        """Job by job ID, order ID or transaction ID (None if unknown)"""
+        return await self._offload(self.jobs.store.get, any_id)
+
+    async def find(self, limit=100, **filters):
+        """Stored orders, newest first (OrderStore.find())"""
+        return await self._offload(self.jobs.store.orders.find, limit=limit, **filters)
+
+    async def history(self, job_id):
+        """Stage history and payment outcome of a stored order"""
+        orders = self.jobs.store.orders
+        return await self._offload(lambda: (orders.stages(job_id), orders.outcome(job_id)))
+
+    async def logs(self, any_id, event=None, limit=None):
+        """Log records of a job (LogStore.read())"""
+        return await self._offload(self.jobs.logs.read, any_id, event=event, limit=limit)
+
+    def cancel(self, job_id, reason='Client disconnected before start'):
+        """Withdraw a queued job (quick; safe to call while being cancelled)"""
+        return self.jobs.cancel(job_id, reason)
+
+    async def wait_events(self, topic, after_id=0, timeout=25):
+        """
+        Events after a cursor, awaiting the next publish if there are none
+
+        Returns:
+            tuple: (events, closed) - empty events on timeout
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        while True:
+            events, closed = self.bus.read(topic, after_id)
+            if events or closed:
+                return events, closed
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return [], False
+
+            woken = loop.create_future()
+
+            def wake():
+                loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+
+            if not self.bus.subscribe(topic, after_id, wake):
+                continue
+            try:
+                await asyncio.wait({woken}, timeout=remaining)
+            finally:
+                self.bus.unsubscribe(topic, wake)
+
+    async def _wait_until(self, any_id, ready, timeout):
+        """Re-read the job after each of its bus events until ready(job) or timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        job = await self.get(any_id)
+        cursor = None
+
+        while job is not None and not ready(job):
+            remaining = deadline - loop.time()
+            if remaining <= 0 or not self.bus.has_topic(job['job_id']):
+                break
+            if cursor is not None:
+                await self.wait_events(job['job_id'], cursor, remaining)
+            # Cursor first, then the job: a change in between is not missed
+            cursor = self.bus.cursor(job['job_id'])
+            job = await self.get(job['job_id'])
+
+        return job
+
+    async def wait(self, any_id, since_version=-1, timeout=MAX_WAIT_SECONDS):
+        """
+        Long-poll: the job once its version passes since_version (or it is
+        finished, or timeout passes); wakes on the job's status/stage events
+
+        Returns:
+            dict: Job (None if unknown)
+        """
+        return await self._wait_until(
+            any_id,
+            lambda job: job['version'] > since_version or job['status'] in TERMINAL_STATUSES,
+            min(timeout, MAX_WAIT_SECONDS)
+        )
+
+    async def wait_done(self, job_id, timeout):
+        """
+        Wait for a job to finish
+
+        Returns:
+            dict: Latest job (finished unless timeout passed)
+        """
+        return await self._wait_until(job_id, lambda job: job['status'] in TERMINAL_STATUSES, timeout)
+
+    def close(self):
+        """Stop the IO threads (queued calls still finish)"""
+        self.executor.shutdown(wait=False)
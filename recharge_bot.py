@@ -8,7 +8,6 @@ import os
 import sys
 import time
 import json
-import base64
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -17,12 +16,16 @@ from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException
 import requests
 
+import metrics
+from captcha_capture import capture_captcha
+
 class OoredooRechargeBot:
     def __init__(self, headless=True):
         self.headless = headless
         self.driver = None
         self.setup_driver()
         
+    @metrics.timed('browser_launch', flow='voucher')
     def setup_driver(self):
         """Initialize Chrome driver"""
         chrome_options = Options()
@@ -35,8 +38,10 @@ class OoredooRechargeBot:
         chrome_options.add_experimental_option('useAutomationExtension', False)
         
         self.driver = webdriver.Chrome(options=chrome_options)
+        metrics.gauge_add('recharge_live_browsers', 1)
         self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
         
+    @metrics.timed('login', flow='voucher')
     def login(self, username="27865121", password="espaceclient.ooredoo.tn%2F"):
         """Login to Ooredoo portal"""
         print(f"🔐 Logging in as {username}...")
@@ -63,6 +68,7 @@ class OoredooRechargeBot:
         time.sleep(2)
         print("✅ Logged in successfully")
         
+    @metrics.timed('navigation', flow='voucher')
     def navigate_to_recharge(self):
         """Navigate to recharge card page"""
         print("📱 Navigating to recharge page...")
@@ -70,28 +76,20 @@ class OoredooRechargeBot:
         time.sleep(1)
         print("✅ On recharge page")
         
+    @metrics.timed('captcha_solve', flow='voucher')
     def solve_captcha_with_vision(self):
         """Extract captcha image and solve using AI vision"""
         print("🔍 Solving CAPTCHA...")
         
-        # Find captcha image
-        captcha_img = self.driver.find_element(By.CSS_SELECTOR, 'img[alt="captcha"]')
-        
-        # Get captcha image as base64
-        captcha_src = captcha_img.get_attribute('src')
-        
-        if captcha_src.startswith('data:image'):
-            # Already base64
-            img_data = captcha_src.split(',')[1]
-        else:
-            # Download image
-            img_data = base64.b64encode(self.driver.get_screenshot_as_png()).decode()
+        # Read the original CAPTCHA bytes (data URI / browser cache / session
+        # download), falling back to an element screenshot
+        capture = capture_captcha(self.driver)
+        print(f"   Captured via {capture['method']} ({capture['elapsed_ms']}ms)")
         
         # Save captcha for vision analysis
         captcha_path = '/tmp/captcha.png'
-        captcha_screenshot = captcha_img.screenshot_as_png
         with open(captcha_path, 'wb') as f:
-            f.write(captcha_screenshot)
+            f.write(capture['image'])
         
         print(f"💾 Captcha saved to {captcha_path}")
         
@@ -99,6 +97,7 @@ class OoredooRechargeBot:
         # For now, return the path so we can call image tool externally
         return captcha_path
         
+    @metrics.timed('submit', flow='voucher')
     def submit_recharge(self, phone_number, recharge_code, captcha_text):
         """Submit recharge with code and solved captcha"""
         print(f"📝 Submitting recharge...")
@@ -163,6 +162,8 @@ class OoredooRechargeBot:
         """Close browser"""
         if self.driver:
             self.driver.quit()
+            metrics.gauge_add('recharge_live_browsers', -1)
+            self.driver = None
             print("🔒 Browser closed")
 
 def main():
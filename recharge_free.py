@@ -13,16 +13,17 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from bs4 import BeautifulSoup
-from PIL import Image
-import io
 
-# Import free OCR library
-try:
-    import easyocr
-    READER = easyocr.Reader(['en'], gpu=False)  # CPU mode, no GPU needed
-except ImportError:
-    print("❌ EasyOCR not installed. Install with: pip install easyocr")
-    sys.exit(1)
+import metrics
+from captcha_capture import capture_captcha
+from captcha_retry import CaptchaRetryEngine
+from captcha_solvers import (
+    SERVICE_URL, BackgroundSolve, CaptchaUnsolved, configured_solvers, get_solver, join_captcha, solve_candidates
+)
+
+# Free local solvers, in order (CAPTCHA_SOLVERS overrides, e.g. "cnn"); the
+# EasyOCR model is only loaded on the first solve that uses it
+DEFAULT_SOLVERS = ('easyocr',)
 
 class OoredooRecharge:
     def __init__(self, headless=True):
@@ -30,6 +31,7 @@ class OoredooRecharge:
         self.driver = None
         self.setup_driver()
         
+    @metrics.timed('browser_launch', flow='voucher')
     def setup_driver(self):
         """Initialize Chrome driver"""
         chrome_options = Options()
@@ -42,9 +44,11 @@ class OoredooRecharge:
         chrome_options.add_experimental_option('useAutomationExtension', False)
         
         self.driver = webdriver.Chrome(options=chrome_options)
+        metrics.gauge_add('recharge_live_browsers', 1)
         self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
         print("✅ Browser initialized")
         
+    @metrics.timed('login', flow='voucher')
     def login(self, username="27865121", password="espaceclient.ooredoo.tn%2F"):
         """Login to Ooredoo portal"""
         print(f"🔐 Logging in as {username}...")
@@ -71,6 +75,7 @@ class OoredooRecharge:
         time.sleep(3)
         print("✅ Logged in")
         
+    @metrics.timed('navigation', flow='voucher')
     def navigate_to_recharge(self):
         """Navigate to recharge card page"""
         print("📱 Navigating to recharge page...")
@@ -78,31 +83,34 @@ class OoredooRecharge:
         time.sleep(2)
         print("✅ On recharge page")
         
-    def solve_captcha_easyocr(self):
-        """Solve CAPTCHA using FREE EasyOCR"""
-        print("🔍 Solving CAPTCHA with EasyOCR (FREE)...")
-        
-        # Find and screenshot captcha
-        captcha_img = self.driver.find_element(By.CSS_SELECTOR, 'img[alt="captcha"]')
-        captcha_png = captcha_img.screenshot_as_png
-        
-        # Save temp image
-        temp_path = '/tmp/captcha.png'
-        with open(temp_path, 'wb') as f:
-            f.write(captcha_png)
-        
-        # Use EasyOCR to read text
-        result = READER.readtext(temp_path, detail=0)
-        
-        if result:
-            captcha_text = ''.join(result).strip()
-            # Clean up common OCR mistakes
-            captcha_text = captcha_text.replace(' ', '').replace('\n', '')
+    @metrics.timed('captcha_solve', flow='voucher')
+    def solve_captcha_easyocr(self, captcha_png=None):
+        """
+        Solve CAPTCHA using FREE EasyOCR (or the first solver in CAPTCHA_SOLVERS)
+
+        Args:
+            captcha_png (bytes): Already captured image (captured now if None;
+                safe to call from a worker thread when given)
+        """
+        print(f"🔍 Solving CAPTCHA with {configured_solvers(DEFAULT_SOLVERS)[0]} (FREE)...")
+        
+        # Read the original CAPTCHA bytes (element screenshot only as fallback)
+        if captcha_png is None:
+            capture = capture_captcha(self.driver)
+            captcha_png = capture['image']
+            print(f"   Captured via {capture['method']} ({capture['elapsed_ms']}ms)")
+        
+        # First configured solver (EasyOCR unless CAPTCHA_SOLVERS says
+        # otherwise); runs in the CAPTCHA service when CAPTCHA_SERVICE_URL is set
+        captcha_text = get_solver(configured_solvers(DEFAULT_SOLVERS)[0])(captcha_png)
+        
+        if captcha_text:
             print(f"✅ CAPTCHA solved: {captcha_text}")
             return captcha_text
         else:
-            raise Exception("Could not read CAPTCHA text")
+            raise CaptchaUnsolved("Could not read CAPTCHA text")
             
+    @metrics.timed('submit', flow='voucher')
     def submit_recharge(self, phone_number, recharge_code, captcha_text=None):
         """Submit recharge form"""
         print(f"\n📝 Submitting recharge...")
@@ -111,11 +119,12 @@ class OoredooRecharge:
         
         wait = WebDriverWait(self.driver, 10)
         
-        # Auto-solve captcha if not provided
+        # Auto-solve captcha if not provided: grab the image now and solve it
+        # on a worker thread while this thread fills the rest of the form
         if not captcha_text:
-            captcha_text = self.solve_captcha_easyocr()
-        
-        print(f"   CAPTCHA: {captcha_text}")
+            capture = capture_captcha(self.driver)
+            print(f"   Captured CAPTCHA via {capture['method']} ({capture['elapsed_ms']}ms)")
+            captcha_text = BackgroundSolve(self.solve_captcha_easyocr, capture['image'])
         
         # Select phone number radio (my number)
         try:
@@ -142,8 +151,15 @@ class OoredooRecharge:
                 print("   ✅ Filled recharge code")
                 break
         
-        # Fill captcha (second input)
         time.sleep(0.5)
+        
+        # Join the CAPTCHA solve only now that it is needed
+        captcha_text, captcha_timing = join_captcha(captcha_text)
+        print(f"   CAPTCHA: {captcha_text}")
+        if captcha_timing:
+            print(f"   ⏱️  Solve {captcha_timing['solve_ms']}ms, {captcha_timing['hidden_ms']}ms hidden behind form filling")
+        
+        # Fill captcha (second input)
         captcha_inputs = self.driver.find_elements(By.CSS_SELECTOR, 'input[type="text"]')
         if len(captcha_inputs) >= 2:
             captcha_input = captcha_inputs[-1]  # Last text input
@@ -161,7 +177,9 @@ class OoredooRecharge:
         time.sleep(3)
         
         # Get response
-        return self.parse_response()
+        response = self.parse_response()
+        response['captcha_timing'] = captcha_timing
+        return response
         
     def parse_response(self):
         """Parse page response (success or error)"""
@@ -205,6 +223,8 @@ class OoredooRecharge:
         """Close browser"""
         if self.driver:
             self.driver.quit()
+            metrics.gauge_add('recharge_live_browsers', -1)
+            self.driver = None
             print("🔒 Browser closed")
 
 def main():
@@ -222,6 +242,15 @@ def main():
         print(f"   You provided: {len(recharge_code)} characters")
         sys.exit(1)
     
+    # Free OCR library (not needed when the shared CAPTCHA service owns it)
+    if 'easyocr' in configured_solvers(DEFAULT_SOLVERS) and not SERVICE_URL:
+        try:
+            import easyocr
+        except ImportError:
+            print("❌ EasyOCR not installed. Install with: pip install easyocr")
+            print("   (or pick another solver, e.g. CAPTCHA_SOLVERS=cnn)")
+            sys.exit(1)
+    
     bot = OoredooRecharge(headless=False)
     
     try:
@@ -231,8 +260,13 @@ def main():
         # Navigate to recharge
         bot.navigate_to_recharge()
         
-        # Submit recharge (auto-solves captcha with FREE EasyOCR)
-        response = bot.submit_recharge("27865121", recharge_code)
+        # Submit recharge (auto-solves captcha with FREE EasyOCR, retries
+        # wrong CAPTCHAs in-session with the next-best ensemble candidate)
+        engine = CaptchaRetryEngine(
+            bot, lambda image: solve_candidates(image, solvers=configured_solvers(DEFAULT_SOLVERS)), max_attempts=3
+        )
+        response = engine.submit("27865121", recharge_code)
+        print(f"\n🔁 CAPTCHA attempts: {len(response['attempts'])}")
         
         # Print response
         print("\n" + "="*60)
@@ -0,0 +1,1241 @@
+#!/usr/bin/env python3
+"""
+Background Recharge Jobs
+Runs RechargeAPI flows off the HTTP request thread and keeps their state in an
+indexed job store, so the API can answer immediately and serve status later
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+
+import browsers
+import metrics
+from job_scheduler import JobScheduler, worker_state
+from log_store import LogStore
+from ooredoo_creditcard import OoredooCreditCardRecharge
+from recharge_api import RechargeAPI
+
+
+# Job lifecycle: queued -> creating -> awaiting_payment -> success/failed/timeout/error
+# ('rejected' = refused by the scheduler, 'cancelled' = withdrawn while
+# queued; neither ever started; 'partial' = batch with some items failed;
+# 'amount_mismatch' = checkout paid, but not the amount ordered)
+# A monitor stopped by shutdown stays awaiting_payment, stage 'checkpointed',
+# until the next process resumes it
+TERMINAL_STATUSES = {'success', 'failed', 'timeout', 'error', 'rejected', 'cancelled', 'partial', 'amount_mismatch'}
+
+# Map RechargeAPI stages onto job statuses
+STAGE_STATUS = {
+    'completed': 'success',
+    'payment_failed': 'failed',
+    'payment_timeout': 'timeout',
+    'amount_mismatch': 'amount_mismatch',
+}
+
+MAX_WAIT_SECONDS = 30
+
+# Largest accepted batch (items are created one after another per account)
+MAX_BATCH_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+
+# Requests without an Idempotency-Key that repeat the same account,
+# beneficiary and amount within this many seconds are treated as retries
+IDEMPOTENCY_WINDOW = int(os.getenv('IDEMPOTENCY_WINDOW', '120'))
+
+# Seconds running jobs get to finish once shutdown starts, and then how long
+# stopped payment monitors get to checkpoint before browsers are quit
+SHUTDOWN_DEADLINE = float(os.getenv('SHUTDOWN_DEADLINE', '60'))
+SHUTDOWN_GRACE = float(os.getenv('SHUTDOWN_GRACE', '15'))
+
+# A resumed monitor watches at least this long, even if its timeout ran out
+# while no process was running (the outcome may be waiting on the page)
+RESUME_MIN_SECONDS = 60
+
+# An unfinished job in the order store whose owner runs on another host
+# (or is unknown) and has not touched it for this long is abandoned
+STALE_JOB_SECONDS = int(os.getenv('STALE_JOB_SECONDS', '1800'))
+
+# Process that creates (and runs) this process's jobs, stored with each job
+PROCESS_OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
+# Portal / payment monitor milestones published to live subscribers
+EVENT_STAGES = {
+    'LOGGED_IN': 'logged_in',
+    'LOGIN_FAILED': 'login_failed',
+    'PAYMENT_URL_READY': 'payment_url_ready',
+    'INITIAL_PAGE_LOAD': 'payment_page_loaded',
+    'THREE_DS_DETECTED': '3ds_detected',
+    'REDIRECT_DETECTED': 'redirect_detected',
+    'PAYMENT_COMPLETED': 'payment_detected',
+    'TIMEOUT': 'payment_timeout',
+}
+
+
+class IdempotencyConflict(Exception):
+    """Idempotency-Key reused with different request parameters"""
+
+
+def idempotency_keys(phone, beneficiary, amount, header_key=None, window=IDEMPOTENCY_WINDOW, now=None):
+    """
+    Keys under which a recharge request is deduplicated
+
+    An explicit Idempotency-Key is scoped to the login account. Without one,
+    the key is derived from account, beneficiary, amount and a time bucket;
+    the previous bucket is returned too so a retry just after a bucket
+    boundary still matches.
+
+    Returns:
+        list: Keys to look up, the first one is used for a new job
+    """
+    if header_key:
+        return [f'key:{phone}:{header_key}']
+
+    bucket = int((now or time.time()) // window)
+    return [
+        'auto:' + hashlib.sha256(f'{phone}|{beneficiary}|{amount}|{b}'.encode()).hexdigest()[:32]
+        for b in (bucket, bucket - 1)
+    ]
+
+
+def abandoned(job):
+    """
+    True for an unfinished job from the order store that no live process
+    will finish (its process crashed or was killed)
+
+    Checkpointed jobs are never abandoned: the next process resumes them.
+    The caller only asks about jobs that are not in its own memory, so a
+    row owned by this very host:pid is an earlier incarnation (e.g. a
+    restarted container, where the PID is reused).
+    """
+    if job['status'] in TERMINAL_STATUSES or job.get('stage') == 'checkpointed':
+        return False
+
+    owner = job.get('owner') or ''
+    host, _, pid = owner.rpartition(':')
+    if host == socket.gethostname() and pid.isdigit():
+        if owner == PROCESS_OWNER:
+            return True
+        try:
+            os.kill(int(pid), 0)
+            return False
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False  # exists, owned by another user
+
+    try:
+        age = (datetime.now() - datetime.fromisoformat(job['updated_at'])).total_seconds()
+    except (TypeError, ValueError):
+        return False
+    return age > STALE_JOB_SECONDS
+
+
+class JobStore:
+    """
+    Thread-safe in-memory job table
+
+    Jobs are indexed by job ID and, once the portal reports them, by the
+    payment order ID and transaction ID, so /status/<id> accepts any of them.
+    Every update bumps the job's version and wakes long-poll waiters.
+
+    With an OrderStore attached, every change is also queued for SQLite and
+    lookups fall back to it for evicted jobs or jobs from earlier runs. With
+    an EventBus attached, status changes are published on the job's topic.
+    """
+
+    def __init__(self, max_jobs=10000, orders=None, bus=None):
+        """
+        Args:
+            max_jobs (int): Finished jobs beyond this count are evicted (oldest first)
+            orders (OrderStore): Durable copy of every job (optional)
+            bus (EventBus): Live status events per job (optional)
+        """
+        self.max_jobs = max_jobs
+        self.orders = orders
+        self.bus = bus
+        self.jobs = OrderedDict()
+        self.index = {}
+        self.keys = {}
+        self.changed = threading.Condition()
+
+    def create(self, request, keys=(), reuse=None):
+        """
+        Register a new queued job, unless one already exists under a key
+
+        The order store is read first; the in-memory lookup and the insert
+        then happen under one lock, so concurrent duplicates always resolve
+        to the same job. A stored job that is unfinished but abandoned (see
+        abandoned()) is closed as an error and the request runs again.
+
+        Args:
+            request (dict): Public request fields (never the password)
+            keys (list): Idempotency keys (first one is stored on a new job)
+            reuse (callable): reuse(existing_job) -> bool, whether a job found
+                under a key is returned instead of creating one (default: always)
+
+        Returns:
+            tuple: (job copy, created)
+        """
+        # Disk reads happen before taking the lock (it guards every get/update)
+        stored = {key: self.orders.get_by_key(key) for key in keys} if self.orders else {}
+
+        with self.changed:
+            for key in keys:
+                existing = self._lookup_key(key, stored.get(key))
+                if existing and (reuse is None or reuse(existing)):
+                    return dict(existing), False
+
+            job = self._new_job(request, keys[0] if keys else None)
+            self.jobs[job['job_id']] = job
+            if job['idempotency_key']:
+                self.keys[job['idempotency_key']] = job['job_id']
+            self._evict()
+            job = dict(job)
+
+        if self.orders:
+            for row in {row['job_id']: row for row in stored.values() if row}.values():
+                if abandoned(row):
+                    # Close the dead process's row so it stops showing as running
+                    self.orders.save_job(dict(row, status='error', stage='abandoned', version=row['version'] + 1,
+                                              message=f"Process ended before the job finished (retried as {job['job_id']})",
+                                              updated_at=job['created_at']))
+            self.orders.save_job(job)
+        self._publish(job)
+        return job, True
+
+    def _new_job(self, request, idempotency_key):
+        now = datetime.now().isoformat()
+        job = {
+            'job_id': uuid.uuid4().hex[:16],
+            'status': 'queued',
+            'stage': 'queued',
+            'request': request,
+            'payment_url': None,
+            'order_id': None,
+            'transaction_id': None,
+            'message': None,
+            'result': None,
+            'idempotency_key': idempotency_key,
+            'owner': PROCESS_OWNER,
+            'created_at': now,
+            'updated_at': now,
+            'version': 0
+        }
+        return job
+
+    def update(self, job_id, **fields):
+        """
+        Update a job and notify waiters
+
+        Returns:
+            dict: Copy of the updated job (None if unknown)
+        """
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+
+            stage_changed = any(key in fields and fields[key] != job.get(key) for key in ('status', 'stage'))
+            job.update(fields)
+            job['updated_at'] = datetime.now().isoformat()
+            job['version'] += 1
+
+            for key in ('order_id', 'transaction_id'):
+                if job.get(key):
+                    self.index[str(job[key])] = job_id
+
+            self.changed.notify_all()
+            job = dict(job)
+
+        if self.orders:
+            self.orders.save_job(job, stage_changed)
+        if stage_changed:
+            self._publish(job)
+        return job
+
+    def get(self, any_id):
+        """
+        Look up a job by job ID, portal order ID or transaction ID
+
+        Returns:
+            dict: Copy of the job (None if unknown)
+        """
+        with self.changed:
+            job = self._lookup(any_id)
+            if job:
+                return dict(job)
+
+        return self.orders.get(any_id) if self.orders else None
+
+    def wait(self, any_id, since_version=-1, timeout=MAX_WAIT_SECONDS):
+        """
+        Long-poll: block until the job's version passes since_version
+
+        Returns immediately for finished jobs or when since_version is behind.
+
+        Returns:
+            dict: Copy of the job (None if unknown)
+        """
+        deadline = time.time() + min(timeout, MAX_WAIT_SECONDS)
+
+        with self.changed:
+            while True:
+                job = self._lookup(any_id)
+                if job is None:
+                    break
+
+                remaining = deadline - time.time()
+                if job['version'] > since_version or job['status'] in TERMINAL_STATUSES or remaining <= 0:
+                    return dict(job)
+
+                self.changed.wait(remaining)
+
+        # Not live in this process: answer from the order store
+        return self.orders.get(any_id) if self.orders else None
+
+    def adopt(self, job):
+        """
+        Load a job from the order store back into memory (resumed after a restart)
+
+        Returns:
+            dict: Copy of the job
+        """
+        with self.changed:
+            job = dict(job, owner=PROCESS_OWNER)
+            self.jobs[job['job_id']] = job
+            for key in ('order_id', 'transaction_id'):
+                if job.get(key):
+                    self.index[str(job[key])] = job['job_id']
+            if job.get('idempotency_key'):
+                self.keys[job['idempotency_key']] = job['job_id']
+            self._evict()
+            return dict(job)
+
+    def active(self):
+        """Copies of the in-memory jobs that have not finished"""
+        with self.changed:
+            return [dict(job) for job in self.jobs.values() if job['status'] not in TERMINAL_STATUSES]
+
+    def discard(self, job_id):
+        """Forget a job that was never started (e.g. rejected by the scheduler)"""
+        with self.changed:
+            job = self.jobs.pop(job_id, None)
+            if job and job.get('idempotency_key'):
+                self.keys.pop(job['idempotency_key'], None)
+
+    def counts(self):
+        """Number of jobs per status"""
+        with self.changed:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return counts
+
+    def _publish(self, job):
+        """Publish the job's status on its topic (closes it when finished)"""
+        if self.bus:
+            self.bus.publish(job['job_id'], job['status'], {
+                'status': job['status'],
+                'stage': job['stage'],
+                'message': job['message'],
+                'payment_url': job['payment_url'],
+                'order_id': job['order_id'],
+                'transaction_id': job['transaction_id']
+            }, close=job['status'] in TERMINAL_STATUSES)
+
+    def _lookup_key(self, key, stored=None):
+        """
+        Job under an idempotency key: in memory, else the order store row
+        read before the lock (ignored if abandoned, so the request runs again)
+        """
+        job_id = self.keys.get(key)
+        if job_id and job_id in self.jobs:
+            return self.jobs[job_id]
+        if stored is not None and not abandoned(stored):
+            return stored
+        return None
+
+    def _lookup(self, any_id):
+        any_id = str(any_id)
+        job = self.jobs.get(any_id)
+        if job is None and any_id in self.index:
+            job = self.jobs.get(self.index[any_id])
+        return job
+
+    def _evict(self):
+        """Drop the oldest finished jobs once over max_jobs"""
+        excess = len(self.jobs) - self.max_jobs
+        if excess <= 0:
+            return
+
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            job = self.jobs[job_id]
+            if job['status'] in TERMINAL_STATUSES:
+                del self.jobs[job_id]
+                for key in ('order_id', 'transaction_id'):
+                    if job.get(key):
+                        self.index.pop(str(job[key]), None)
+                if job.get('idempotency_key'):
+                    self.keys.pop(job['idempotency_key'], None)
+                excess -= 1
+
+
+def summarize_result(result):
+    """
+    Reduce a RechargeAPI response to the job fields clients need
+
+    Args:
+        result (dict): RechargeAPI.execute_recharge() response
+
+    Returns:
+        dict: Job update fields (status, stage, message, IDs, result data)
+    """
+    payment = result.get('payment') or {}
+    data = payment.get('data') or {}
+    stage = result.get('stage')
+
+    summary = {
+        'status': STAGE_STATUS.get(stage, 'error'),
+        'stage': stage,
+        'message': result.get('message'),
+        'order_id': data.get('order_id'),
+        'transaction_id': data.get('transaction_id'),
+        'result': {
+            'success': result.get('success', False),
+            'order_id': data.get('order_id'),
+            'transaction_id': data.get('transaction_id'),
+            'elapsed_seconds': data.get('elapsed_seconds'),
+            'detection_method': data.get('detection_method'),
+            'details': payment.get('message'),
+            'completed_at': result.get('completed_at')
+        }
+    }
+    if 'lines' in result:
+        summary['result']['lines'] = result['lines']
+        summary['result']['amount_verified'] = result.get('amount_verified')
+    return summary
+
+
+def payment_order_id(payment_url):
+    """ClicToPay order ID (mdOrder) of a payment URL, None if it has none"""
+    values = parse_qs(urlparse(payment_url or '').query).get('mdOrder')
+    return values[0] if values else None
+
+
+# Optional job_view() sections (?include=request,timing,logs)
+INCLUDE_OPTIONS = ('request', 'timing', 'logs')
+
+
+def parse_include(value):
+    """
+    Parse an ?include= list ("logs", "request,timing", "all")
+
+    Returns:
+        tuple: Included sections
+
+    Raises:
+        ValueError: Unknown section name
+    """
+    names = {name.strip() for name in (value or '').split(',') if name.strip()}
+    if 'all' in names:
+        return INCLUDE_OPTIONS
+    unknown = names - set(INCLUDE_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(sorted(unknown))} (use {', '.join(INCLUDE_OPTIONS)} or all)")
+    return tuple(name for name in INCLUDE_OPTIONS if name in names)
+
+
+def job_view(job, include=(), logs=None):
+    """
+    Public JSON shape of a job for the status endpoint and callbacks
+
+    The default is compact: status, IDs, payment URL and the summarized
+    result. 'request' adds the original request, 'timing' the queue time
+    and creation timestamp, 'logs' the job's log records (passed in by the
+    caller, which owns the LogStore).
+    """
+    view = {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'done': job['status'] in TERMINAL_STATUSES,
+        'message': job['message'],
+        'payment_url': job['payment_url'],
+        'order_id': job['order_id'],
+        'transaction_id': job['transaction_id'],
+        'result': job['result'],
+        'updated_at': job['updated_at'],
+        'version': job['version'],
+        'status_url': f"/api/v1/status/{job['job_id']}"
+    }
+    if 'request' in include:
+        view['request'] = job['request']
+    if 'timing' in include:
+        view['queue_ms'] = job.get('queue_ms')
+        view['created_at'] = job['created_at']
+    if 'logs' in include:
+        view['logs'] = logs or []
+    else:
+        view['logs_url'] = f"/api/v1/logs/{job['job_id']}"
+    return view
+
+
+class RechargeJobs:
+    """Run recharge flows on a bounded JobScheduler and track them in a JobStore"""
+
+    def __init__(self, store=None, scheduler=None, log_dir='api_logs', callback_timeout=5, logs=None):
+        """
+        Args:
+            store (JobStore): Job table (a new one if None)
+            scheduler (JobScheduler): Worker pool (sized from CPU/memory if None)
+            log_dir (str): Directory of the job event log (used if logs is None)
+            callback_timeout (float): Seconds allowed per callback POST
+            logs (LogStore): Job event log (a new one in log_dir if None)
+        """
+        self.store = store or JobStore()
+        self.scheduler = scheduler or JobScheduler()
+        self.logs = logs or LogStore(log_dir)
+        self.callback_timeout = callback_timeout
+        self.batch_lock = threading.Lock()
+        self.batches = {}
+        # Set when the shutdown deadline passes: payment monitors stop and checkpoint
+        self.stopping = threading.Event()
+        self.checkpointed = set()
+
+    def submit(self, phone, password, beneficiary, amount, timeout_seconds=300, callback_url=None,
+               idempotency_key=None):
+        """
+        Queue a recharge and return at once
+
+        A request matching a job that is still running attaches to it, and a
+        repeat of a finished one gets the stored job; no browser work is
+        started for either. Jobs the scheduler rejected and jobs cancelled
+        before they started are never reused.
+        Without an explicit key, failed creations ('error') are not reused
+        either, so a retry after e.g. a failed login starts fresh.
+
+        Args:
+            callback_url (str): Optional URL that receives the job JSON (POST)
+                when the payment URL is ready and when the job finishes
+            idempotency_key (str): Client Idempotency-Key header (optional)
+
+        Returns:
+            tuple: (job, created) - created is False for a replay
+
+        Raises:
+            SchedulerFull / SchedulerClosed: No capacity; nothing was started
+            IdempotencyConflict: Key already used for a different request
+        """
+        request = {
+            'phone': phone,
+            'beneficiary': beneficiary,
+            'amount': amount,
+            'timeout_seconds': timeout_seconds,
+            'callback_url': callback_url
+        }
+
+        if idempotency_key:
+            reuse = lambda existing: existing['status'] not in ('rejected', 'cancelled')
+        else:
+            reuse = lambda existing: existing['status'] not in ('error', 'rejected', 'cancelled')
+
+        job, created = self.store.create(
+            request,
+            keys=idempotency_keys(phone, beneficiary, amount, idempotency_key),
+            reuse=reuse
+        )
+
+        if not created:
+            previous = job.get('request') or {}
+            if (str(previous.get('beneficiary')), str(previous.get('amount'))) != (str(beneficiary), str(amount)):
+                raise IdempotencyConflict(
+                    f"Idempotency-Key already used for {previous.get('beneficiary')} / {previous.get('amount')} TND"
+                )
+            print(f"♻️  Duplicate request attached to job {job['job_id']} ({job['status']})")
+            return job, False
+
+        self.logs.tag(job['job_id'], phone=phone, status=job['status'])
+
+        try:
+            self.scheduler.submit(
+                self._run, job['job_id'], time.time(),
+                phone, password, beneficiary, amount, timeout_seconds, callback_url,
+                account=phone, beneficiary=beneficiary, key=job['job_id']
+            )
+        except Exception as e:
+            self.store.update(job['job_id'], status='rejected', stage='scheduler_rejected', message=str(e))
+            self.store.discard(job['job_id'])
+            raise
+
+        return job, True
+
+    def submit_batch(self, items, timeout_seconds=300, callback_url=None, monitor=False, idempotency_key=None):
+        """
+        Queue many recharges, one logged-in session per login account
+
+        Items are grouped by their login phone; each group runs as one
+        scheduler job that logs in once and then only repeats the
+        recharge-online form (create_payment()) per beneficiary. Each
+        payment URL is published on the batch's event topic and stored in
+        its result as soon as it exists.
+        Without an explicit key, batches that ended 'failed' or 'error'
+        are not reused, so a retry (e.g. with a corrected password) runs.
+
+        Args:
+            items (list): Dicts with phone, password, beneficiary, amount
+            timeout_seconds (int): Payment monitoring timeout per item
+            callback_url (str): Receives the batch job JSON when it finishes
+            monitor (bool): Also monitor each payment as its own job
+            idempotency_key (str): Client Idempotency-Key header (optional)
+
+        Returns:
+            tuple: (batch job, created)
+
+        Raises:
+            SchedulerFull / SchedulerClosed: No capacity; nothing was started
+            IdempotencyConflict: Key already used for a different batch
+        """
+        public_items = [
+            {'phone': item['phone'], 'beneficiary': item['beneficiary'], 'amount': item['amount']}
+            for item in items
+        ]
+        groups = OrderedDict()
+        for index, item in enumerate(items):
+            groups.setdefault(item['phone'], []).append((index, item))
+
+        digest = hashlib.sha256(json.dumps(public_items, sort_keys=True).encode()).hexdigest()[:16]
+        request = {
+            'phone': ','.join(groups),
+            'beneficiary': f'batch:{len(items)}',
+            'amount': sum(item['amount'] for item in items),
+            'items': public_items,
+            'timeout_seconds': timeout_seconds,
+            'callback_url': callback_url,
+            'monitor': monitor
+        }
+
+        if idempotency_key:
+            reuse = lambda existing: existing['status'] not in ('rejected', 'cancelled')
+        else:
+            # submit() only skips 'error', where a failed login ends a single
+            # job; a batch whose login fails (e.g. wrong password, which is not
+            # part of the digest) ends 'failed', so that is skipped too
+            reuse = lambda existing: existing['status'] not in ('error', 'failed', 'rejected', 'cancelled')
+
+        job, created = self.store.create(
+            request,
+            keys=idempotency_keys(request['phone'], f'batch:{digest}', request['amount'], idempotency_key),
+            reuse=reuse
+        )
+
+        if not created:
+            if (job.get('request') or {}).get('items') not in (None, public_items):
+                raise IdempotencyConflict('Idempotency-Key already used for a different batch')
+            print(f"♻️  Duplicate batch attached to job {job['job_id']} ({job['status']})")
+            return job, False
+
+        batch_id = job['job_id']
+        with self.batch_lock:
+            self.batches[batch_id] = {
+                'items': [dict(item, index=index, status='queued', payment_url=None, job_id=None, message=None)
+                          for index, item in enumerate(public_items)],
+                'pending_groups': len(groups),
+                'started_at': None,
+                'login_seconds': [],
+                'item_seconds': []
+            }
+        job = self.store.update(batch_id, result=self._batch_result(batch_id))
+        self.logs.tag(batch_id, phone=request['phone'], status=job['status'])
+
+        submitted = []
+        try:
+            for phone, entries in groups.items():
+                self.scheduler.submit(
+                    self._run_batch_group, batch_id, phone, entries[0][1]['password'], entries,
+                    timeout_seconds, monitor,
+                    account=phone, key=f'{batch_id}:{phone}'
+                )
+                submitted.append(phone)
+        except Exception as e:
+            for phone in submitted:
+                self.scheduler.cancel(f'{batch_id}:{phone}')
+            self.store.update(batch_id, status='rejected', stage='scheduler_rejected', message=str(e))
+            self.store.discard(batch_id)
+            with self.batch_lock:
+                self.batches.pop(batch_id, None)
+            raise
+
+        return job, True
+
+    def submit_checkout(self, phone, password, lines, timeout_seconds=300, callback_url=None, idempotency_key=None):
+        """
+        Queue a multi-line checkout: several beneficiaries, one payment
+
+        The recharge-online form gets one recharge line per amount and a
+        phones[] checkbox per beneficiary, so a single ClicToPay payment of
+        the combined amount covers them all; the payment outcome is then
+        reported for every line (result['lines']).
+
+        Args:
+            lines (list): Dicts with 'amount' (int) and 'beneficiaries' (list)
+
+        Returns:
+            tuple: (job, created) - created is False for a replay
+
+        Raises:
+            SchedulerFull / SchedulerClosed: No capacity; nothing was started
+            IdempotencyConflict: Key already used for a different checkout
+        """
+        lines = [{'amount': line['amount'], 'beneficiaries': list(line['beneficiaries'])} for line in lines]
+        beneficiaries = [b for line in lines for b in line['beneficiaries']]
+        total = sum(line['amount'] * len(line['beneficiaries']) for line in lines)
+        digest = hashlib.sha256(json.dumps(lines, sort_keys=True).encode()).hexdigest()[:16]
+        request = {
+            'phone': phone,
+            'beneficiary': ','.join(beneficiaries),
+            'amount': total,
+            'lines': lines,
+            'timeout_seconds': timeout_seconds,
+            'callback_url': callback_url
+        }
+
+        if idempotency_key:
+            reuse = lambda existing: existing['status'] not in ('rejected', 'cancelled')
+        else:
+            reuse = lambda existing: existing['status'] not in ('error', 'rejected', 'cancelled')
+
+        job, created = self.store.create(
+            request,
+            keys=idempotency_keys(phone, f'checkout:{digest}', total, idempotency_key),
+            reuse=reuse
+        )
+
+        if not created:
+            if (job.get('request') or {}).get('lines') != lines:
+                raise IdempotencyConflict('Idempotency-Key already used for a different checkout')
+            print(f"♻️  Duplicate checkout attached to job {job['job_id']} ({job['status']})")
+            return job, False
+
+        self.logs.tag(job['job_id'], phone=phone, status=job['status'])
+
+        try:
+            self.scheduler.submit(
+                self._run, job['job_id'], time.time(),
+                phone, password, request['beneficiary'], total, timeout_seconds, callback_url,
+                lines=lines, account=phone, key=job['job_id']
+            )
+        except Exception as e:
+            self.store.update(job['job_id'], status='rejected', stage='scheduler_rejected', message=str(e))
+            self.store.discard(job['job_id'])
+            raise
+
+        return job, True
+
+    def cancel(self, job_id, reason='Cancelled before start'):
+        """
+        Withdraw a queued job (a running browser flow is never interrupted)
+
+        Returns:
+            dict: The cancelled job, or None if it had already started
+        """
+        if not self.scheduler.cancel(job_id):
+            return None
+        print(f"🚫 Job {job_id} cancelled: {reason}")
+        job = self.store.update(job_id, status='cancelled', stage='cancelled', message=reason)
+        self._log_finished(job)
+        return job
+
+    def _run(self, job_id, queued_at, phone, password, beneficiary, amount, timeout_seconds, callback_url,
+             lines=None):
+        """Scheduler worker: creation (single recharge or checkout), then payment monitoring"""
+        queue_seconds = time.time() - queued_at
+        metrics.observe('queue_wait', queue_seconds, flow='creditcard')
+        self.store.update(
+            job_id,
+            status='creating',
+            stage='recharge_creation',
+            queue_ms=round(queue_seconds * 1000, 1)
+        )
+
+        def on_created(recharge):
+            job = self.store.update(
+                job_id,
+                status='awaiting_payment',
+                stage='payment_monitoring',
+                payment_url=recharge.get('payment_url')
+            )
+            self._track_session()
+            self._callback(callback_url, job)
+
+        try:
+            result = RechargeAPI(log_file=None, stop=self.stopping).execute_recharge(
+                phone, password, beneficiary, amount, timeout_seconds,
+                on_created=on_created, on_event=self._event_sink(job_id), recharger=self._worker_session(), lines=lines
+            )
+            job = self._record_result(job_id, result)
+        except Exception as e:
+            job = self.store.update(job_id, status='error', stage='internal_error', message=f'Internal error: {str(e)}')
+
+        self._track_session()
+        print(f"📦 Job {job_id}: {job['status']} ({job['stage']})")
+        if job['status'] in TERMINAL_STATUSES:
+            self._log_finished(job)
+            self._callback(callback_url, job)
+
+    def _run_batch_group(self, batch_id, phone, password, entries, timeout_seconds, monitor):
+        """Scheduler worker: one login, then one payment per item of an account"""
+        recharger = self._worker_session()
+        own_session = recharger is None
+        if own_session:
+            recharger = OoredooCreditCardRecharge()
+
+        with self.batch_lock:
+            batch = self.batches[batch_id]
+            first = batch['started_at'] is None
+            if first:
+                batch['started_at'] = time.time()
+        if first:
+            self.store.update(batch_id, status='creating', stage='batch_creation')
+        # Portal milestones go to the batch's log only (its event stream carries items)
+        recharger.on_event = lambda event_type, data: self.logs.append(batch_id, event_type, data)
+
+        try:
+            started = time.perf_counter()
+            reused = recharger.has_session(phone, password)
+            logged_in = recharger.start_session(phone, password)
+            if logged_in and not reused:
+                with self.batch_lock:
+                    batch['login_seconds'].append(time.perf_counter() - started)
+            elif not logged_in:
+                recharger.close()
+            self._track_session()
+
+            for index, item in entries:
+                if not logged_in:
+                    self._batch_item(batch_id, index, status='failed', message='Login failed')
+                    continue
+                if self.stopping.is_set():
+                    self._batch_item(batch_id, index, status='failed', message='Server shutting down before this item')
+                    continue
+
+                started = time.perf_counter()
+                result = recharger.recharge(phone, password, item['beneficiary'], item['amount'], keep_session=True)
+                seconds = time.perf_counter() - started
+
+                if result.get('status') == 'success':
+                    with self.batch_lock:
+                        batch['item_seconds'].append(seconds)
+                    self._batch_item(batch_id, index, status='created', payment_url=result['payment_url'],
+                                                creation_seconds=round(seconds, 2))
+                    if monitor:
+                        self._monitor_batch_item(batch_id, index, phone, item, result['payment_url'], timeout_seconds)
+                else:
+                    self._batch_item(batch_id, index, status='failed', message=result.get('message'))
+        except Exception as e:
+            for index, _ in entries:
+                self._batch_item(batch_id, index, status='failed', message=f'Internal error: {str(e)}', only_pending=True)
+        finally:
+            self._track_session()
+            if own_session:
+                recharger.close()
+            self._finish_batch_group(batch_id)
+
+    def _batch_item(self, batch_id, index, only_pending=False, event=None, **fields):
+        """
+        Record an item's outcome on the batch job and publish it
+
+        Events: item_ready (payment URL), item_failed, item_monitoring
+        (its monitoring job ID)
+        """
+        with self.batch_lock:
+            item = self.batches[batch_id]['items'][index]
+            if only_pending and item['status'] != 'queued':
+                return item
+            item.update(fields)
+            item = dict(item)
+            self.store.update(batch_id, result=self._batch_result(batch_id))
+
+        if self.store.bus:
+            self.store.bus.publish(batch_id, event or ('item_ready' if item['status'] == 'created' else 'item_failed'), item)
+        return item
+
+    def _monitor_batch_item(self, batch_id, index, phone, item, payment_url, timeout_seconds):
+        """Track one created payment as its own job (status / events / order store)"""
+        job, _ = self.store.create({
+            'phone': phone,
+            'beneficiary': item['beneficiary'],
+            'amount': item['amount'],
+            'timeout_seconds': timeout_seconds,
+            'batch_id': batch_id
+        })
+        self.store.update(job['job_id'], status='awaiting_payment', stage='payment_monitoring',
+                          payment_url=payment_url)
+        self.logs.tag(job['job_id'], phone=phone, status='awaiting_payment')
+
+        try:
+            self.scheduler.submit(self._monitor, job['job_id'], payment_url, timeout_seconds, key=job['job_id'])
+            self._batch_item(batch_id, index, event='item_monitoring', job_id=job['job_id'])
+        except Exception as e:
+            self.store.update(job['job_id'], status='rejected', stage='scheduler_rejected', message=str(e))
+            self._batch_item(batch_id, index, event='item_monitoring', job_id=job['job_id'],
+                             message=f'Not monitored: {str(e)}')
+
+    def _monitor(self, job_id, payment_url, timeout_seconds, callback_url=None, lines=None, total=None):
+        """Scheduler worker: payment monitoring only (the payment already exists)"""
+        try:
+            result = RechargeAPI(log_file=None, stop=self.stopping).monitor_payment(
+                payment_url, timeout_seconds, on_event=self._event_sink(job_id), lines=lines, total=total
+            )
+            job = self._record_result(job_id, result)
+        except Exception as e:
+            job = self.store.update(job_id, status='error', stage='internal_error', message=f'Internal error: {str(e)}')
+        if job['status'] in TERMINAL_STATUSES:
+            self._log_finished(job)
+            self._callback(callback_url, job)
+
+    def _record_result(self, job_id, result):
+        """
+        Store a RechargeAPI result on its job, or checkpoint the job when
+        shutdown interrupted its payment monitoring
+
+        Returns:
+            dict: Updated job
+        """
+        payment = result.get('payment') or {}
+        if result.get('stage') == 'payment_interrupted':
+            return self._checkpoint(job_id, (payment.get('data') or {}).get('remaining_seconds'))
+
+        job = self.store.update(job_id, **summarize_result(result))
+        if self.store.orders and payment.get('status'):
+            self.store.orders.save_outcome(job_id, payment)
+        return job
+
+    def _checkpoint(self, job_id, remaining_seconds=None):
+        """
+        Save an unfinished payment monitor to the order store for resume()
+
+        Without an order store the job cannot outlive the process and ends
+        as an error instead.
+
+        Args:
+            remaining_seconds (float): Monitoring time left (the job's whole
+                timeout if None, e.g. a monitor that never started)
+
+        Returns:
+            dict: Updated job (awaiting_payment / checkpointed)
+        """
+        job = self.store.get(job_id)
+        if self.store.orders is None:
+            return self.store.update(job_id, status='error', stage='interrupted',
+                                     message='Payment monitoring interrupted by shutdown (no order store to resume from)')
+
+        request = job.get('request') or {}
+        if remaining_seconds is None:
+            remaining_seconds = request.get('timeout_seconds') or 300
+        deadline = (datetime.now() + timedelta(seconds=remaining_seconds)).isoformat()
+        order_id = job.get('order_id') or payment_order_id(job['payment_url'])
+
+        self.store.orders.save_checkpoint(job_id, job['payment_url'], deadline, order_id=order_id, request=request)
+        job = self.store.update(job_id, status='awaiting_payment', stage='checkpointed',
+                                message='Payment monitoring paused by shutdown, resumes after restart')
+        self.logs.append(job_id, 'CHECKPOINTED', {
+            'order_id': order_id,
+            'payment_url': job['payment_url'],
+            'remaining_seconds': round(remaining_seconds),
+            'deadline': deadline
+        })
+        self.checkpointed.add(job_id)
+        print(f"💾 Job {job_id} checkpointed (order {order_id}, {round(remaining_seconds)}s left)")
+        return job
+
+    def shutdown(self, deadline=None, grace=None):
+        """
+        Drain before the process exits (rolling deploy)
+
+        1. New jobs are refused (SchedulerClosed, readiness 'accepting'
+           fails) and queued jobs are withdrawn: never-started ones are
+           cancelled, queued payment monitors are checkpointed
+        2. Running jobs get `deadline` seconds to finish (stopping.set()
+           from another thread cuts this short)
+        3. Payment monitors still running are then stopped and checkpointed;
+           they get `grace` seconds to do so
+        4. Idle worker sessions are closed, every browser still registered
+           is quit, and jobs that are still unfinished are checkpointed
+           (payment URL known) or marked interrupted
+
+        Args:
+            deadline (float): Seconds for running jobs (SHUTDOWN_DEADLINE)
+            grace (float): Seconds for stopped monitors (SHUTDOWN_GRACE)
+
+        Returns:
+            dict: cancelled, checkpointed, interrupted and browsers_quit counts
+        """
+        deadline = SHUTDOWN_DEADLINE if deadline is None else deadline
+        grace = SHUTDOWN_GRACE if grace is None else grace
+        end = time.time() + deadline
+        summary = {'cancelled': 0, 'checkpointed': 0, 'interrupted': 0, 'browsers_quit': 0}
+
+        self.scheduler.close()
+        for key in self.scheduler.withdraw():
+            summary['cancelled'] += self._withdraw(key)
+
+        running = self.scheduler.snapshot()['running']
+        print(f"🛑 Shutting down: {running} running job(s), {deadline:.0f}s to finish")
+
+        drained = self.scheduler.drain(0)
+        while not drained and not self.stopping.is_set() and time.time() < end:
+            drained = self.scheduler.drain(min(1.0, end - time.time()))
+
+        if not drained:
+            print("⏱️  Out of time: stopping payment monitors")
+            self.stopping.set()
+            drained = self.scheduler.drain(grace)
+
+        self.scheduler.release_sessions()
+        summary['browsers_quit'] = browsers.quit_all()
+
+        for job in self.store.active():
+            if job['stage'] == 'checkpointed':
+                continue
+            if job['payment_url'] and job['status'] == 'awaiting_payment':
+                self._checkpoint(job['job_id'])
+                continue
+            job = self.store.update(job['job_id'], status='error', stage='interrupted',
+                                    message='Interrupted by server shutdown')
+            self._log_finished(job)
+            summary['interrupted'] += 1
+
+        summary['checkpointed'] = len(self.checkpointed)
+        print(f"🛑 Shutdown: {summary['checkpointed']} checkpointed, {summary['cancelled']} cancelled, "
+              f"{summary['interrupted']} interrupted, {summary['browsers_quit']} browser(s) quit")
+        return summary
+
+    def _withdraw(self, key):
+        """
+        Settle a queued job the scheduler gave back at shutdown
+
+        Returns:
+            int: 1 if it was cancelled, 0 if it was checkpointed
+        """
+        batch_id, _, phone = key.partition(':')
+        with self.batch_lock:
+            batch = self.batches.get(batch_id) if phone else None
+            indexes = [item['index'] for item in batch['items'] if item['phone'] == phone] if batch else []
+        if batch:
+            for index in indexes:
+                self._batch_item(batch_id, index, only_pending=True, status='failed',
+                                 message='Server shutting down before this item')
+            self._finish_batch_group(batch_id)
+            return 1
+
+        job = self.store.get(key)
+        if job is None:
+            return 0
+        if job['payment_url']:
+            # A batch item's monitor: the payment exists, the next process watches it
+            self._checkpoint(key)
+            return 0
+
+        job = self.store.update(key, status='cancelled', stage='cancelled',
+                                message='Server shutting down before the job started, retry')
+        self._log_finished(job)
+        self._callback((job.get('request') or {}).get('callback_url'), job)
+        return 1
+
+    def resume(self):
+        """
+        Restart the payment monitors a previous process checkpointed
+
+        Each checkpoint is claimed in the order store first, so when several
+        processes start together every monitor resumes exactly once. The
+        monitor gets the time that was left at shutdown, at least
+        RESUME_MIN_SECONDS.
+
+        Returns:
+            list: Resumed job IDs
+        """
+        orders = self.store.orders
+        if orders is None:
+            return []
+
+        owner = PROCESS_OWNER
+        resumed = []
+        for checkpoint in orders.checkpoints():
+            job_id = checkpoint['job_id']
+            if not orders.claim_checkpoint(job_id, owner):
+                continue
+            job = orders.get(job_id)
+            if job is None or job['status'] in TERMINAL_STATUSES:
+                continue
+
+            request = checkpoint['request'] or job['request']
+            left = (datetime.fromisoformat(checkpoint['deadline']) - datetime.now()).total_seconds()
+            timeout_seconds = int(max(RESUME_MIN_SECONDS, left))
+
+            self.store.adopt(dict(job, request=request))
+            self.store.update(job_id, stage='payment_monitoring', message='Payment monitoring resumed after restart')
+            try:
+                self.scheduler.submit(
+                    self._monitor, job_id, checkpoint['payment_url'], timeout_seconds,
+                    callback_url=request.get('callback_url'), lines=request.get('lines'), total=request.get('amount'),
+                    key=job_id
+                )
+            except Exception as e:
+                self.store.update(job_id, stage='checkpointed', message='Payment monitoring paused, resume failed')
+                orders.release_checkpoint(job_id)
+                print(f"⚠️  Could not resume job {job_id}: {str(e)[:80]}")
+                continue
+
+            self.logs.append(job_id, 'MONITORING_RESUMED', {
+                'order_id': checkpoint['order_id'],
+                'timeout_seconds': timeout_seconds,
+                'checkpointed_at': checkpoint['at']
+            })
+            resumed.append(job_id)
+
+        if resumed:
+            print(f"▶️  Resumed {len(resumed)} checkpointed payment monitor(s)")
+        return resumed
+
+    def _event_sink(self, job_id):
+        """
+        on_event callback of a job's flow: every event goes to the job's
+        log, milestones also to its live event topic
+        """
+        def on_event(event_type, data):
+            self.logs.append(job_id, event_type, data)
+            if self.store.bus and event_type in EVENT_STAGES:
+                self.store.bus.publish(job_id, EVENT_STAGES[event_type], data)
+        return on_event
+
+    def _log_finished(self, job):
+        """Close a job's log with its outcome and tag it for search"""
+        self.logs.append(job['job_id'], 'JOB_FINISHED', {
+            'status': job['status'],
+            'stage': job['stage'],
+            'message': job['message']
+        })
+        self.logs.tag(job['job_id'], status=job['status'], order_id=job.get('order_id'),
+                      transaction_id=job.get('transaction_id'))
+
+    def _finish_batch_group(self, batch_id):
+        """Close the batch once its last account group is done"""
+        with self.batch_lock:
+            batch = self.batches[batch_id]
+            batch['pending_groups'] -= 1
+            if batch['pending_groups'] > 0:
+                return
+            result = self._batch_result(batch_id)
+            del self.batches[batch_id]
+
+        created = result['created']
+        status = 'success' if created == len(result['items']) else 'partial' if created else 'failed'
+        job = self.store.update(
+            batch_id, status=status, stage='batch_completed', result=result,
+            message=f"{created}/{len(result['items'])} payment URLs created"
+        )
+        self._log_finished(job)
+        print(f"📦 Batch {batch_id}: {job['message']} ({result['throughput']['beneficiaries_per_minute']}/min)")
+        self._callback((job.get('request') or {}).get('callback_url'), job)
+
+    def _batch_result(self, batch_id):
+        """
+        Items so far plus throughput (caller holds batch_lock)
+
+        Throughput compares the batch with single requests, which pay for
+        a browser launch and login per beneficiary: single_per_minute is
+        what one worker would reach that way, estimated from this batch's
+        own login and per-item timings; speedup is the measured batch rate
+        over that estimate.
+        """
+        batch = self.batches[batch_id]
+        items = [dict(item) for item in batch['items']]
+        created = sum(1 for item in items if item['payment_url'])
+
+        elapsed = time.time() - batch['started_at'] if batch['started_at'] else 0.0
+        per_item = sum(batch['item_seconds']) / len(batch['item_seconds']) if batch['item_seconds'] else None
+        login = sum(batch['login_seconds']) / len(batch['login_seconds']) if batch['login_seconds'] else None
+
+        throughput = {
+            'elapsed_seconds': round(elapsed, 1),
+            'beneficiaries_per_minute': round(created * 60 / elapsed, 2) if elapsed and created else 0.0,
+            'login_seconds': round(login, 2) if login is not None else None,
+            'item_seconds': round(per_item, 2) if per_item is not None else None,
+            'single_per_minute': None,
+            'speedup': None
+        }
+        if per_item is not None and login is not None:
+            throughput['single_per_minute'] = round(60 / (login + per_item), 2)
+            if throughput['beneficiaries_per_minute']:
+                throughput['speedup'] = round(throughput['beneficiaries_per_minute'] / throughput['single_per_minute'], 2)
+
+        return {'items': items, 'created': created, 'throughput': throughput}
+
+    def _worker_session(self):
+        """
+        The scheduler worker's long-lived recharger
+
+        Its browser stays logged in between jobs, and the scheduler routes an
+        account's jobs to the worker whose session belongs to that account.
+
+        Returns:
+            OoredooCreditCardRecharge: None outside a scheduler worker
+        """
+        state = worker_state()
+        if state is None:
+            return None
+        if state['session'] is None:
+            state['session'] = OoredooCreditCardRecharge()
+            state['cleanup'] = state['session'].close
+        return state['session']
+
+    def _track_session(self):
+        """Publish which account the worker's session is logged in as (affinity key)"""
+        state = worker_state()
+        if state is not None and state['session'] is not None:
+            state['account'] = state['session'].account
+
+    def _callback(self, callback_url, job):
+        """POST the job to the client's callback URL (best effort)"""
+        if not callback_url or job is None:
+            return
+
+        try:
+            import requests
+            requests.post(callback_url, json=job_view(job, include=('request', 'timing')), timeout=self.callback_timeout)
+        except Exception as e:
+            print(f"⚠️  Callback to {callback_url} failed: {str(e)[:80]}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print("Usage: python recharge_jobs.py <phone> <password> <beneficiary> <amount> [timeout]")
+        print()
+        print("Runs one recharge as a background job and prints every state change")
+        sys.exit(1)
+
+    jobs = RechargeJobs()
+    job, _ = jobs.submit(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]),
+                         int(sys.argv[5]) if len(sys.argv) > 5 else 300)
+    print(f"📦 Job {job['job_id']} queued")
+
+    version = job['version']
+    while True:
+        job = jobs.store.wait(job['job_id'], version)
+        if job['version'] != version:
+            version = job['version']
+            print(json.dumps(job_view(job, include=('request', 'timing')), indent=2))
+        if job['status'] in TERMINAL_STATUSES:
+            break
+
+    sys.exit(0 if job['status'] == 'success' else 1)
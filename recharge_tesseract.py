@@ -13,16 +13,23 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from bs4 import BeautifulSoup
-from PIL import Image, ImageFilter, ImageEnhance
-import io
 
-# Import Tesseract OCR
-try:
-    import pytesseract
-except ImportError:
-    print("❌ pytesseract not installed. Install with: pip install pytesseract")
-    print("   Also install system package: apt install tesseract-ocr (Linux) or brew install tesseract (macOS)")
-    sys.exit(1)
+import metrics
+from captcha_capture import capture_captcha
+from captcha_retry import CaptchaRetryEngine
+from captcha_solvers import (
+    SERVICE_URL, DEFAULT_PREPROCESS, BackgroundSolve, CaptchaUnsolved, configured_solvers, get_solver,
+    join_captcha, solve_candidates, tuned_variants
+)
+
+# Import Tesseract OCR (not needed when the shared CAPTCHA service owns it)
+if not SERVICE_URL:
+    try:
+        import pytesseract
+    except ImportError:
+        print("❌ pytesseract not installed. Install with: pip install pytesseract")
+        print("   Also install system package: apt install tesseract-ocr (Linux) or brew install tesseract (macOS)")
+        sys.exit(1)
 
 class OoredooRecharge:
     def __init__(self, headless=True):
@@ -30,6 +37,7 @@ class OoredooRecharge:
         self.driver = None
         self.setup_driver()
         
+    @metrics.timed('browser_launch', flow='voucher')
     def setup_driver(self):
         """Initialize Chrome driver"""
         chrome_options = Options()
@@ -42,9 +50,11 @@ class OoredooRecharge:
         chrome_options.add_experimental_option('useAutomationExtension', False)
         
         self.driver = webdriver.Chrome(options=chrome_options)
+        metrics.gauge_add('recharge_live_browsers', 1)
         self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
         print("✅ Browser initialized")
         
+    @metrics.timed('login', flow='voucher')
     def login(self, username="27865121", password="espaceclient.ooredoo.tn%2F"):
         """Login to Ooredoo portal"""
         print(f"🔐 Logging in as {username}...")
@@ -71,6 +81,7 @@ class OoredooRecharge:
         time.sleep(3)
         print("✅ Logged in")
         
+    @metrics.timed('navigation', flow='voucher')
     def navigate_to_recharge(self):
         """Navigate to recharge card page"""
         print("📱 Navigating to recharge page...")
@@ -78,52 +89,33 @@ class OoredooRecharge:
         time.sleep(2)
         print("✅ On recharge page")
         
-    def preprocess_captcha(self, image_bytes):
-        """Preprocess CAPTCHA image for better OCR accuracy"""
-        # Open image
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to grayscale
-        img = img.convert('L')
-        
-        # Increase contrast
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(2.0)
-        
-        # Apply threshold (binarization)
-        threshold = 128
-        img = img.point(lambda p: p > threshold and 255)
-        
-        # Slight noise reduction
-        img = img.filter(ImageFilter.MedianFilter(size=3))
-        
-        return img
-        
-    def solve_captcha_tesseract(self):
-        """Solve CAPTCHA using FREE Tesseract OCR"""
+    @metrics.timed('captcha_solve', flow='voucher')
+    def solve_captcha_tesseract(self, captcha_png=None):
+        """
+        Solve CAPTCHA using FREE Tesseract OCR
+
+        Args:
+            captcha_png (bytes): Already captured image (captured now if None;
+                safe to call from a worker thread when given)
+        """
         print("🔍 Solving CAPTCHA with Tesseract (FREE)...")
         
-        # Find and screenshot captcha
-        captcha_img = self.driver.find_element(By.CSS_SELECTOR, 'img[alt="captcha"]')
-        captcha_png = captcha_img.screenshot_as_png
-        
-        # Preprocess image for better accuracy
-        preprocessed = self.preprocess_captcha(captcha_png)
+        # Read the original CAPTCHA bytes (element screenshot only as fallback)
+        if captcha_png is None:
+            capture = capture_captcha(self.driver)
+            captcha_png = capture['image']
+            print(f"   Captured via {capture['method']} ({capture['elapsed_ms']}ms)")
         
-        # Use Tesseract to read text
-        # Configure for single line of text, alphanumeric only
-        custom_config = r'--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
-        captcha_text = pytesseract.image_to_string(preprocessed, config=custom_config)
-        
-        # Clean up
-        captcha_text = captcha_text.strip().replace(' ', '').replace('\n', '')
+        # Preprocess + Tesseract (single line of text, alphanumeric only)
+        captcha_text = get_solver('tesseract')(captcha_png, preprocess=DEFAULT_PREPROCESS)
         
         if captcha_text:
             print(f"✅ CAPTCHA solved: {captcha_text}")
             return captcha_text
         else:
-            raise Exception("Could not read CAPTCHA text")
+            raise CaptchaUnsolved("Could not read CAPTCHA text")
             
+    @metrics.timed('submit', flow='voucher')
     def submit_recharge(self, phone_number, recharge_code, captcha_text=None):
         """Submit recharge form"""
         print(f"\n📝 Submitting recharge...")
@@ -132,11 +124,12 @@ class OoredooRecharge:
         
         wait = WebDriverWait(self.driver, 10)
         
-        # Auto-solve captcha if not provided
+        # Auto-solve captcha if not provided: grab the image now and solve it
+        # on a worker thread while this thread fills the rest of the form
         if not captcha_text:
-            captcha_text = self.solve_captcha_tesseract()
-        
-        print(f"   CAPTCHA: {captcha_text}")
+            capture = capture_captcha(self.driver)
+            print(f"   Captured CAPTCHA via {capture['method']} ({capture['elapsed_ms']}ms)")
+            captcha_text = BackgroundSolve(self.solve_captcha_tesseract, capture['image'])
         
         # Select phone number radio (my number)
         try:
@@ -162,8 +155,15 @@ class OoredooRecharge:
                 print("   ✅ Filled recharge code")
                 break
         
-        # Fill captcha
         time.sleep(0.5)
+        
+        # Join the CAPTCHA solve only now that it is needed
+        captcha_text, captcha_timing = join_captcha(captcha_text)
+        print(f"   CAPTCHA: {captcha_text}")
+        if captcha_timing:
+            print(f"   ⏱️  Solve {captcha_timing['solve_ms']}ms, {captcha_timing['hidden_ms']}ms hidden behind form filling")
+        
+        # Fill captcha
         captcha_inputs = self.driver.find_elements(By.CSS_SELECTOR, 'input[type="text"]')
         if len(captcha_inputs) >= 2:
             captcha_input = captcha_inputs[-1]
@@ -180,7 +180,10 @@ class OoredooRecharge:
         
         time.sleep(3)
         
-        return self.parse_response()
+        # Get response
+        response = self.parse_response()
+        response['captcha_timing'] = captcha_timing
+        return response
         
     def parse_response(self):
         """Parse page response"""
@@ -217,6 +220,8 @@ class OoredooRecharge:
         """Close browser"""
         if self.driver:
             self.driver.quit()
+            metrics.gauge_add('recharge_live_browsers', -1)
+            self.driver = None
             print("🔒 Browser closed")
 
 def main():
@@ -235,7 +240,13 @@ def main():
     try:
         bot.login()
         bot.navigate_to_recharge()
-        response = bot.submit_recharge("27865121", recharge_code)
+        engine = CaptchaRetryEngine(
+            bot,
+            lambda image: solve_candidates(image, solvers=configured_solvers(('tesseract',)), variants=tuned_variants('tesseract')),
+            max_attempts=3
+        )
+        response = engine.submit("27865121", recharge_code)
+        print(f"\n🔁 CAPTCHA attempts: {len(response['attempts'])}")
         
         print("\n" + "="*60)
         print("RESPONSE:")
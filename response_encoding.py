@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+API Response Encoding
+Fast JSON serialization and Accept-Encoding negotiation shared by the Flask
+and ASGI servers
+
+- dumps() uses orjson when it is installed (several times faster than the
+  json module on job and batch payloads), compact json otherwise
+- encode() compresses JSON / text bodies of COMPRESS_MIN_BYTES or more with
+  brotli (if the brotli package is installed) or gzip, whichever the client
+  accepts; smaller bodies and streams (SSE) are sent as they are
+
+    python response_encoding.py bench    # bytes and serialization time per shape
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Bodies smaller than this are not worth compressing (headers dominate)
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/plain')
+
+
+def dumps(obj):
+    """
+    Serialize to compact JSON
+
+    Returns:
+        bytes: UTF-8 JSON (values it cannot encode are written as str())
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits: let json handle them
+    return json.dumps(obj, default=str, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def negotiate(accept_encoding):
+    """
+    Pick the response encoding from an Accept-Encoding header
+
+    Args:
+        accept_encoding (str): Header value (e.g. "gzip, deflate, br;q=0.9")
+
+    Returns:
+        str: 'br', 'gzip' or None (identity)
+    """
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        weight = 1.0
+        if params.strip().startswith('q='):
+            try:
+                weight = float(params.strip()[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for name in (('br',) if brotli is not None else ()) + ('gzip',):
+        weight = weights.get(name, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+def compress(body, encoding):
+    """Compress a body with 'br' or 'gzip'"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode(body, content_type, accept_encoding):
+    """
+    Compress a complete response body if the client and content allow it
+
+    Args:
+        body (bytes): Response body
+        content_type (str): Its Content-Type
+        accept_encoding (str): Request Accept-Encoding header
+
+    Returns:
+        tuple: (body, encoding) - encoding is None when sent as is
+    """
+    if len(body) < COMPRESS_MIN_BYTES or not (content_type or '').startswith(COMPRESSIBLE_TYPES):
+        return body, None
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return body, None
+    return compress(body, encoding), encoding
+
+
+def _sample_responses(events=150):
+    """A finished job as RechargeAPI used to return it (logs nested) and as the API returns it now"""
+    from recharge_jobs import job_view
+
+    log_events = [
+        {
+            'timestamp': f'2025-02-13T16:30:{i % 60:02d}.{i:06d}',
+            'event_type': 'MONITORING_CHECK',
+            'data': {'elapsed_seconds': i * 2, 'current_url': 'https://ipay.clictopay.com/epg/merchants/OOREDOO/payment.html?mdOrder=' + 'a1b2c3d4' * 4}
+        }
+        for i in range(events)
+    ]
+    payment = {
+        'success': True, 'status': 'success', 'payment_status': 'completed', 'message': 'Payment completed',
+        'data': {'order_id': '12345', 'transaction_id': '67890', 'amount': '20',
+                 'redirect_url': 'https://espaceclient.ooredoo.tn/payment-success?orderId=12345&transactionId=67890',
+                 'detection_method': 'redirect_url', 'elapsed_seconds': 45.2},
+        'timestamp': '2025-02-13T16:30:45',
+        'log_summary': {'total_events': len(log_events), 'events': log_events}
+    }
+    full = {
+        'request': {'phone': '27865121', 'beneficiary': '27865121', 'amount': 20, 'timestamp': '2025-02-13T16:30:00'},
+        'recharge': {'status': 'success', 'message': None, 'payment_url': 'https://ipay.clictopay.com/...'},
+        'payment': payment, 'success': True, 'message': 'Recharge completed successfully',
+        'stage': 'completed', 'logs': [], 'completed_at': '2025-02-13T16:30:48'
+    }
+    job = {
+        'job_id': '3f9c0a7d12ab44e1', 'status': 'success', 'stage': 'completed', 'message': 'Recharge completed successfully',
+        'payment_url': 'https://ipay.clictopay.com/...', 'order_id': '12345', 'transaction_id': '67890',
+        'request': {'phone': '27865121', 'beneficiary': '27865121', 'amount': 20, 'timeout_seconds': 300, 'callback_url': None},
+        'result': {'success': True, 'order_id': '12345', 'transaction_id': '67890', 'elapsed_seconds': 45.2,
+                   'detection_method': 'redirect_url', 'details': 'Payment completed',
+                   'completed_at': '2025-02-13T16:30:48'},
+        'log_file': None, 'queue_ms': 12.5, 'created_at': '2025-02-13T16:30:00', 'updated_at': '2025-02-13T16:30:48',
+        'version': 7
+    }
+    records = [{'at': e['timestamp'], 'job_id': job['job_id'], 'event': e['event_type'], 'data': e['data']}
+               for e in log_events]
+    return {
+        'full RechargeAPI response': full,
+        'compact job (default)': dict(job_view(job), success=True),
+        'job ?include=logs': dict(job_view(job, include=('logs',), logs=records), success=True),
+    }
+
+
+def bench(iterations=2000):
+    """Print response bytes (raw / gzip / br) and serialization time per shape"""
+    print(f"orjson: {'yes' if orjson else 'no (pip install orjson)'}, "
+          f"brotli: {'yes' if brotli else 'no (pip install brotli)'}")
+    print()
+    print(f"{'shape':<28}{'raw':>9}{'gzip':>9}{'br':>9}{'json.dumps':>13}{'dumps()':>11}")
+
+    for name, body in _sample_responses().items():
+        raw = dumps(body)
+        gz = len(compress(raw, 'gzip'))
+        br = len(compress(raw, 'br')) if brotli else None
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            json.dumps(body, default=str)
+        stdlib_us = (time.perf_counter() - started) / iterations * 1e6
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            dumps(body)
+        fast_us = (time.perf_counter() - started) / iterations * 1e6
+
+        print(f"{name:<28}{len(raw):>9}{gz:>9}{br if br is not None else '-':>9}"
+              f"{stdlib_us:>11.1f}us{fast_us:>9.1f}us")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'bench':
+        print("Usage: python response_encoding.py bench [iterations]")
+        print("Response bytes and serialization time: full vs compact vs ?include=logs")
+        sys.exit(1)
+
+    bench(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Graceful Shutdown
+SIGTERM / SIGINT handling for the API servers, so a rolling deploy loses no
+payment outcome and leaves no Chrome behind
+
+The first signal starts RechargeJobs.shutdown() on a background thread:
+new jobs are refused, running ones get SHUTDOWN_DEADLINE seconds, payment
+monitors still running are checkpointed to the order store and every
+browser is quit. The stores are then flushed and closed and the process
+exits. Meanwhile the server keeps answering status requests and
+/health/ready reports not ready, so the load balancer sends new work to
+other nodes. A second signal skips the rest of the deadline.
+
+The next process picks the checkpointed monitors up with RechargeJobs.resume().
+"""
+
+import os
+import sys
+import signal
+import threading
+
+
+class GracefulShutdown:
+    """Drain a RechargeJobs instance, then close the stores behind it"""
+
+    def __init__(self, jobs, closers=(), deadline=None):
+        """
+        Args:
+            jobs (RechargeJobs): Job runner to drain
+            closers (list): Called in order after the drain (e.g. LogStore.close,
+                OrderStore.close, so checkpoints are committed)
+            deadline (float): Seconds for running jobs (SHUTDOWN_DEADLINE)
+        """
+        self.jobs = jobs
+        self.closers = list(closers)
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.thread = None
+        self.started = False
+        self.done = threading.Event()
+        self.summary = None
+
+    def install(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        """
+        Handle the signals (call from the main thread)
+
+        Returns:
+            GracefulShutdown: self
+        """
+        for signum in signals:
+            signal.signal(signum, self._on_signal)
+        return self
+
+    def _on_signal(self, signum, frame):
+        name = signal.Signals(signum).name
+        with self.lock:
+            first = self.thread is None
+            if first:
+                self.thread = threading.Thread(target=self.run, kwargs={'exit_process': True},
+                                               name='graceful-shutdown')
+        if first:
+            print(f"\n🛑 {name}: draining in-flight recharges (send again to stop monitors now)")
+            self.thread.start()
+        else:
+            print(f"\n🛑 {name} again: stopping payment monitors now")
+            self.jobs.stopping.set()
+
+    def run(self, exit_process=False):
+        """
+        Drain the jobs and close the stores (once; later calls wait for it)
+
+        Args:
+            exit_process (bool): Exit the process when done (signal path)
+
+        Returns:
+            dict: RechargeJobs.shutdown() summary
+        """
+        with self.lock:
+            first = not self.started
+            self.started = True
+        if not first:
+            self.done.wait()
+            return self.summary
+
+        try:
+            self.summary = self.jobs.shutdown(self.deadline)
+        finally:
+            for close in self.closers:
+                try:
+                    close()
+                except Exception as e:
+                    print(f"⚠️  Close failed during shutdown: {str(e)[:80]}")
+            self.done.set()
+
+        if exit_process:
+            print("👋 Shutdown complete")
+            sys.stdout.flush()
+            os._exit(0)
+        return self.summary
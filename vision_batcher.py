@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Vision CAPTCHA Micro-Batcher
+Collects CAPTCHA images for a few milliseconds (or up to N images) and
+sends them as ONE multi-image chat-completions request
+
+The prompt tags every image with its index and asks for a JSON object
+{"1": "...", "2": "..."}; each answer is routed back to the session that
+submitted the image. If the reply can't be parsed (or misses an index),
+the affected images fall back to single-image requests.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import base64
+import asyncio
+
+from vision_client import AsyncVisionClient, VisionAPIError
+
+BATCH_PROMPT = (
+    "You will receive {count} CAPTCHA images, labeled Image 1 to Image {count}. "
+    "Read the text shown in each one. Reply with ONLY a JSON object mapping each image "
+    "number to its characters, for example {{\"1\": \"abc123\", \"2\": \"x7k2pq\"}}. "
+    "No explanation, no code fences."
+)
+
+
+def parse_batch_answer(text, count):
+    """
+    Parse the model's index-tagged JSON answer
+
+    Returns:
+        dict: {index (1-based int): captcha text} for every index found
+    """
+    cleaned = text.strip()
+    cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', cleaned)
+    match = re.search(r'\{.*\}', cleaned, re.DOTALL)
+    if not match:
+        raise ValueError(f"No JSON object in batch answer: {text[:100]!r}")
+
+    data = json.loads(match.group(0))
+    answers = {}
+    for key, value in data.items():
+        index = int(re.sub(r'\D', '', str(key)) or 0)
+        if 1 <= index <= count and isinstance(value, str) and value.strip():
+            answers[index] = value.strip().replace(' ', '')
+    return answers
+
+
+class VisionBatcher:
+    """Coalesce concurrent CAPTCHA solves into multi-image requests"""
+
+    def __init__(self, client, max_batch=8, max_wait_ms=15):
+        """
+        Args:
+            client (AsyncVisionClient): Client used for the requests
+            max_batch (int): Max images per request (1 disables batching)
+            max_wait_ms (float): Max time the first image waits for company
+        """
+        self.client = client
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = []
+        self._timer = None
+
+        self.stats = {
+            'images': 0,
+            'batches': 0,
+            'batched_images': 0,
+            'fallback_images': 0,
+            'parse_errors': 0,
+        }
+
+    async def solve(self, image_bytes):
+        """
+        Solve one CAPTCHA, possibly together with others
+
+        Returns:
+            str: CAPTCHA text
+        """
+        self.stats['images'] += 1
+        if self.max_batch <= 1:
+            return await self.client.solve(image_bytes)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((image_bytes, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush_now)
+
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if self._pending:
+            # Overflow starts its own wait window
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush_now)
+        if batch:
+            asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch):
+        """Send one batch and resolve its futures"""
+        if len(batch) == 1:
+            await self._send_single(*batch[0])
+            return
+
+        content = [{'type': 'text', 'text': BATCH_PROMPT.format(count=len(batch))}]
+        for index, (image_bytes, _) in enumerate(batch, 1):
+            captcha_b64 = base64.b64encode(image_bytes).decode('utf-8')
+            content.append({'type': 'text', 'text': f'Image {index}:'})
+            content.append({'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{captcha_b64}'}})
+
+        answers = {}
+        try:
+            result = await self.client.chat(content, max_tokens=20 + 16 * len(batch))
+            self.stats['batches'] += 1
+            answers = parse_batch_answer(result['choices'][0]['message']['content'], len(batch))
+        except VisionAPIError as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except (ValueError, KeyError, IndexError):
+            self.stats['parse_errors'] += 1
+
+        missing = []
+        for index, (image_bytes, future) in enumerate(batch, 1):
+            if index in answers:
+                self.stats['batched_images'] += 1
+                if not future.done():
+                    future.set_result(answers[index])
+            else:
+                missing.append((image_bytes, future))
+
+        if missing:
+            self.stats['fallback_images'] += len(missing)
+            await asyncio.gather(*(self._send_single(image, future) for image, future in missing))
+
+    async def _send_single(self, image_bytes, future):
+        try:
+            text = await self.client.solve(image_bytes)
+            if not future.done():
+                future.set_result(text)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+
+async def compare_batching(images=200, concurrency=50, max_batch=8, max_wait_ms=15, latency_ms=200):
+    """Solve the same load with and without batching against the local stub"""
+    from vision_stub_server import StubVisionServer
+
+    results = {}
+    with StubVisionServer(latency_ms=latency_ms) as stub:
+        for label, batch_size in (('single', 1), ('batched', max_batch)):
+            requests_before = stub.requests
+            async with AsyncVisionClient(api_key='test', base_url=stub.base_url, max_concurrency=concurrency) as client:
+                batcher = VisionBatcher(client, max_batch=batch_size, max_wait_ms=max_wait_ms)
+                semaphore = asyncio.Semaphore(concurrency)
+                image = b'\x89PNG\r\n\x1a\n' + os.urandom(512)
+
+                async def one():
+                    async with semaphore:
+                        return await batcher.solve(image)
+
+                start = time.perf_counter()
+                await asyncio.gather(*(one() for _ in range(images)))
+                elapsed = time.perf_counter() - start
+
+                stats = client.get_stats()
+                results[label] = {
+                    'http_requests': stub.requests - requests_before,
+                    'elapsed_seconds': round(elapsed, 2),
+                    'images_per_second': round(images / elapsed, 1),
+                    'prompt_tokens': stats['prompt_tokens'],
+                    'completion_tokens': stats['completion_tokens'],
+                    'batcher': dict(batcher.stats)
+                }
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'bench':
+        print("Vision CAPTCHA Micro-Batcher")
+        print()
+        print("Usage: python vision_batcher.py bench [images] [concurrency] [max_batch] [max_wait_ms]")
+        print()
+        print("Compares single-image and batched requests against the local stub server")
+        print()
+        sys.exit(1)
+
+    images = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    max_batch = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+    max_wait_ms = float(sys.argv[5]) if len(sys.argv) > 5 else 15
+
+    print(json.dumps(asyncio.run(compare_batching(images, concurrency, max_batch, max_wait_ms)), indent=2))
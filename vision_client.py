@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Async Vision CAPTCHA Client
+Pooled, concurrency-limited client for the OpenAI chat-completions API
+
+- One persistent aiohttp connection pool per client
+- Total timeout budget per call (shared by all retries)
+- Retries with exponential backoff + jitter on 429/5xx and network errors,
+  honoring Retry-After
+- Semaphore limiting in-flight requests
+- Token and latency accounting
+
+Blocking code (the Selenium scripts) uses the shared client through
+solve_captcha_sync(), which runs it on a background event loop.
+"""
+
+import os
+import sys
+import time
+import json
+import atexit
+import base64
+import random
+import asyncio
+import threading
+from collections import deque
+
+import aiohttp
+
+from captcha_solvers import VISION_PROMPT
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class VisionAPIError(Exception):
+    """Non-retryable error (or retries exhausted) from the vision API"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncVisionClient:
+    """Async chat-completions client for CAPTCHA images"""
+
+    def __init__(self, api_key=None, base_url=None, model='gpt-4o', max_concurrency=8,
+                 pool_size=16, timeout=20.0, max_retries=3, backoff_base=0.5, backoff_max=8.0):
+        """
+        Args:
+            api_key (str): API key (defaults to OPENAI_API_KEY)
+            base_url (str): API base URL (defaults to VISION_API_BASE_URL or OpenAI)
+            model (str): Model name
+            max_concurrency (int): Max in-flight requests
+            pool_size (int): Max pooled connections
+            timeout (float): Total time budget per call in seconds, retries included
+            max_retries (int): Retries after the first attempt
+            backoff_base (float): First backoff delay in seconds
+            backoff_max (float): Backoff delay cap in seconds
+        """
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+        self.base_url = (base_url or os.getenv('VISION_API_BASE_URL') or DEFAULT_BASE_URL).rstrip('/')
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._session = None
+        self._semaphore = None
+
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'failures': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'in_flight': 0,
+        }
+        self._latencies = deque(maxlen=10000)
+
+    async def start(self):
+        """Open the connection pool (idempotent)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={
+                    'Content-Type': 'application/json',
+                    'Authorization': f'Bearer {self.api_key}'
+                }
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def close(self):
+        """Close the connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _backoff(self, attempt, retry_after=None):
+        """Delay before retry number `attempt` (1-based)"""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+    async def chat(self, content, max_tokens=50):
+        """
+        Send one chat-completions request with retries
+
+        Args:
+            content (list): OpenAI message content parts
+            max_tokens (int): Completion token limit
+
+        Returns:
+            dict: Parsed JSON response
+        """
+        await self.start()
+
+        payload = {
+            'model': self.model,
+            'messages': [{'role': 'user', 'content': content}],
+            'max_tokens': max_tokens
+        }
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        last_error = None
+
+        async with self._semaphore:
+            self.stats['in_flight'] += 1
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+
+                    retry_after = None
+                    start = time.perf_counter()
+                    try:
+                        self.stats['requests'] += 1
+                        async with self._session.post(
+                            f'{self.base_url}/chat/completions',
+                            json=payload,
+                            timeout=aiohttp.ClientTimeout(total=remaining)
+                        ) as response:
+                            if response.status == 200:
+                                result = await response.json()
+                                self._latencies.append(time.perf_counter() - start)
+                                usage = result.get('usage') or {}
+                                self.stats['prompt_tokens'] += usage.get('prompt_tokens', 0)
+                                self.stats['completion_tokens'] += usage.get('completion_tokens', 0)
+                                return result
+
+                            body = await response.text()
+                            if response.status not in RETRY_STATUSES:
+                                self.stats['failures'] += 1
+                                raise VisionAPIError(f"Vision API error: {body}", response.status)
+
+                            last_error = VisionAPIError(f"Vision API error {response.status}: {body[:200]}", response.status)
+                            retry_after = response.headers.get('Retry-After')
+
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        last_error = VisionAPIError(f"Vision API request failed: {e!r}")
+
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        break
+
+                    delay = self._backoff(attempt, retry_after)
+                    if time.monotonic() + delay >= deadline:
+                        break
+                    self.stats['retries'] += 1
+                    await asyncio.sleep(delay)
+            finally:
+                self.stats['in_flight'] -= 1
+
+        self.stats['failures'] += 1
+        raise last_error or VisionAPIError(f"Vision API timed out after {self.timeout}s")
+
+    async def solve(self, image_bytes, prompt=VISION_PROMPT):
+        """
+        Solve one CAPTCHA image
+
+        Returns:
+            str: CAPTCHA text
+        """
+        captcha_b64 = base64.b64encode(image_bytes).decode('utf-8')
+        result = await self.chat([
+            {'type': 'text', 'text': prompt},
+            {'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{captcha_b64}'}}
+        ])
+        return result['choices'][0]['message']['content'].strip()
+
+    def get_stats(self):
+        """Counters plus p50/p99 latency of successful requests"""
+        latencies = sorted(self._latencies)
+        stats = dict(self.stats)
+        stats['latency_p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None
+        stats['latency_p99_ms'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1) if latencies else None
+        return stats
+
+
+# --- Shared client for blocking callers -------------------------------------
+
+_loop = None
+_clients = {}   # (api_key, base_url, model) -> (AsyncVisionClient, other kwargs)
+_batchers = {}  # same key -> VisionBatcher
+_lock = threading.Lock()
+
+
+def get_background_loop():
+    """Event loop running forever in a daemon thread (created on first use)"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='vision-client-loop', daemon=True).start()
+        return _loop
+
+
+def _shared_key(api_key=None, base_url=None, model='gpt-4o'):
+    """Account/endpoint a shared client is bound to, with defaults resolved"""
+    return (
+        api_key or os.getenv('OPENAI_API_KEY'),
+        (base_url or os.getenv('VISION_API_BASE_URL') or DEFAULT_BASE_URL).rstrip('/'),
+        model
+    )
+
+
+def get_shared_client(api_key=None, base_url=None, model='gpt-4o', **kwargs):
+    """
+    Process-wide AsyncVisionClient bound to the background loop
+
+    There is one client per (api_key, base_url, model), so callers with
+    different keys never share a pool or a quota.
+
+    Args:
+        **kwargs: Other AsyncVisionClient settings, fixed by the first caller
+            of each key
+
+    Raises:
+        ValueError: kwargs differ from those the client was created with
+    """
+    loop = get_background_loop()
+    key = _shared_key(api_key, base_url, model)
+    with _lock:
+        if key not in _clients:
+            client = AsyncVisionClient(api_key=key[0], base_url=key[1], model=model, **kwargs)
+            asyncio.run_coroutine_threadsafe(client.start(), loop).result()
+            if not _clients:
+                atexit.register(_close_shared_clients)
+            _clients[key] = (client, kwargs)
+
+        client, settings = _clients[key]
+        if kwargs and kwargs != settings:
+            raise ValueError(f'Shared vision client for model {model} already created with {settings}, got {kwargs}')
+        return client
+
+
+def _close_shared_clients():
+    """Close the shared pools at interpreter exit"""
+    if _loop is None or not _loop.is_running():
+        return
+    for client, _ in list(_clients.values()):
+        try:
+            asyncio.run_coroutine_threadsafe(client.close(), _loop).result(timeout=2)
+        except Exception:
+            pass
+
+
+def get_shared_batcher(api_key=None, base_url=None, model='gpt-4o'):
+    """Process-wide VisionBatcher over the shared client of the same key
+
+    VISION_BATCH_MAX (default 8, 1 disables) and VISION_BATCH_WAIT_MS
+    (default 15) tune the micro-batching window.
+    """
+    client = get_shared_client(api_key, base_url, model)
+    key = _shared_key(api_key, base_url, model)
+    with _lock:
+        if key not in _batchers:
+            from vision_batcher import VisionBatcher
+            _batchers[key] = VisionBatcher(
+                client,
+                max_batch=int(os.getenv('VISION_BATCH_MAX', '8')),
+                max_wait_ms=float(os.getenv('VISION_BATCH_WAIT_MS', '15'))
+            )
+        return _batchers[key]
+
+
+def solve_captcha_sync(image_bytes, api_key=None):
+    """Blocking solve through the shared pooled (and micro-batched) client of the key"""
+    client = get_shared_client(api_key=api_key)
+    batcher = get_shared_batcher(api_key=api_key)
+    future = asyncio.run_coroutine_threadsafe(batcher.solve(image_bytes), get_background_loop())
+    return future.result(timeout=client.timeout * 2 + 5)
+
+
+async def load_test(requests_count=200, concurrency=50, base_url=None, **client_kwargs):
+    """Fire `requests_count` solves with `concurrency` callers and report stats"""
+    image = b'\x89PNG\r\n\x1a\n' + os.urandom(512)
+    async with AsyncVisionClient(api_key='test', base_url=base_url, **client_kwargs) as client:
+        queue = asyncio.Queue()
+        for _ in range(requests_count):
+            queue.put_nowait(image)
+        errors = 0
+
+        async def caller():
+            nonlocal errors
+            while not queue.empty():
+                img = queue.get_nowait()
+                try:
+                    await client.solve(img)
+                except VisionAPIError:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(caller() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        stats = client.get_stats()
+        stats['errors'] = errors
+        stats['elapsed_seconds'] = round(elapsed, 2)
+        stats['throughput_rps'] = round(requests_count / elapsed, 1)
+        return stats
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'loadtest':
+        print("Async Vision CAPTCHA Client")
+        print()
+        print("Usage: python vision_client.py loadtest [requests] [concurrency] [base_url]")
+        print()
+        print("Without base_url a local stub server is started (see vision_stub_server.py)")
+        print()
+        print("Example:")
+        print("  python vision_client.py loadtest 500 100")
+        print()
+        sys.exit(1)
+
+    requests_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    base_url = sys.argv[4] if len(sys.argv) > 4 else None
+
+    stub = None
+    if base_url is None:
+        from vision_stub_server import StubVisionServer
+        stub = StubVisionServer(latency_ms=50, error_rate=0.05).start()
+        base_url = stub.base_url
+        print(f"🧪 Stub server on {base_url}")
+
+    try:
+        result = asyncio.run(load_test(requests_count, concurrency, base_url))
+        print(json.dumps(result, indent=2))
+    finally:
+        if stub:
+            stub.stop()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Local Vision API Stub
+Mimics the OpenAI chat-completions response shape so the vision client
+can be tested and load-tested offline (no API key, no cost)
+
+    POST /v1/chat/completions -> {"choices": [...], "usage": {...}}
+
+Options: artificial latency and a rate of 429/500 errors to exercise the
+client's retry path. Every image is answered with a fixed text; requests
+with several images get the index-tagged JSON the batcher asks for.
+"""
+
+import sys
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubVisionServer:
+    """Threaded HTTP stub of the chat-completions endpoint"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, error_rate=0.0, answer='p4mduj'):
+        """
+        Args:
+            host (str): Bind address
+            port (int): Bind port (0 = any free port)
+            latency_ms (int): Delay added to every response
+            error_rate (float): Fraction of requests answered with 429/500
+            answer (str): CAPTCHA text returned for every image
+        """
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.answer = answer
+        self.requests = 0
+        self.images = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                stub.requests += 1
+
+                if stub.latency_ms:
+                    time.sleep(stub.latency_ms / 1000.0)
+
+                if not self.path.endswith('/chat/completions'):
+                    return self._send(404, {'error': {'message': 'Not found'}})
+
+                if stub.error_rate and random.random() < stub.error_rate:
+                    if random.random() < 0.5:
+                        return self._send(429, {'error': {'message': 'Rate limit reached'}}, {'Retry-After': '0.05'})
+                    return self._send(500, {'error': {'message': 'Internal error'}})
+
+                content = payload.get('messages', [{}])[0].get('content', [])
+                image_count = sum(1 for part in content if part.get('type') == 'image_url')
+                stub.images += image_count
+
+                return self._send(200, stub.build_response(payload, image_count))
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def build_response(self, payload, image_count):
+        """Chat-completions response body for a request"""
+        if image_count > 1:
+            # Multi-image (batched) prompt: index-tagged JSON answer
+            text = json.dumps({str(i): self.answer for i in range(1, image_count + 1)})
+        else:
+            text = self.answer
+        return {
+            'id': f'chatcmpl-stub-{self.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'gpt-4o'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': 30 + 85 * image_count,
+                'completion_tokens': max(1, len(text) // 3),
+                'total_tokens': 30 + 85 * image_count + max(1, len(text) // 3)
+            }
+        }
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='vision-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8089
+    latency_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+    server = StubVisionServer(port=port, latency_ms=latency_ms, error_rate=error_rate)
+    print(f"🧪 Vision API stub on {server.base_url} (latency {latency_ms}ms, errors {error_rate:.0%})")
+    print(f"   export VISION_API_BASE_URL={server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass